@@ -10,27 +10,13 @@ from pylivetrader.api import (
                              cancel_order,
                              symbols
                              )
-from zipline.pipeline import Pipeline
-from pipeline_live.data.iex.pricing import USEquityPricing
-from pipeline_live.data.iex.factors import SimpleMovingAverage, AverageDollarVolume, RSI
 from pylivetrader.finance.execution import LimitOrder
 
-# TODO: Move to pipeline once PR is merged https://github.com/alpacahq/pipeline-live/pull/6
-# from pipeline_live.data.polygon.filters import StaticSymbols
-import numpy as np
-from zipline.pipeline.filters import CustomFilter
-class StaticSymbols(CustomFilter):
-    inputs = ()
-    window_length = 1
-    params = ('symbols',)
-
-    def compute(self, today, assets, out, symbols, *inputs):
-        ary = np.array([symbol in symbols for symbol in assets])
-        out[:] = ary
-# END TODO
-
 from math import floor
 
+from tradealgo.orders import OpenOrderIndex
+from tradealgo.stoploss import StopLossMonitor
+
 import logbook
 log = logbook.Logger('algo')
 
@@ -46,11 +32,25 @@ def initialize(context):
     my_pipe = make_pipeline()
     attach_pipeline(my_pipe, 'my_pipeline')
 
+# My list of ETFS
+ETFS = ("DGAZ", "UGAZ", "JDST", "JNUG", "UWT", "DWT",
+        "GUSH", "DRIP", "TQQQ", "SQQQ", "SPXS", "SPXL")
+
 def make_pipeline():
-    # My list of ETFS
-    base_universe = StaticSymbols(symbols = ("DGAZ", "UGAZ", "JDST", "JNUG", "UWT", "DWT", "GUSH", "DRIP", "TQQQ", "SQQQ", "SPXS", "SPXL"))
+    # Imported here so loading the algo doesn't wait on the data source modules,
+    # see tradealgo/importprofile.py
+    from zipline.pipeline import Pipeline
+    from pipeline_live.data.iex.factors import SimpleMovingAverage, AverageDollarVolume, RSI
+    from tradealgo.filters import StaticSymbols
+    from tradealgo.pricing import static_pricing
+
+    base_universe = StaticSymbols(symbols=ETFS)
+
+    # Only the ETFs' prices are fetched, the factors below rank them among themselves
+    USEquityPricing = static_pricing(ETFS)
 
     dollar_volume = AverageDollarVolume(
+        inputs=[USEquityPricing.close, USEquityPricing.volume],
         window_length=14
     )
     high_dollar_volume = (dollar_volume > 10000000)
@@ -63,7 +63,7 @@ def make_pipeline():
         inputs=[USEquityPricing.close],
         window_length=30
     )
-    rsi = RSI()
+    rsi = RSI(inputs=[USEquityPricing.close])
 
     percent_difference = (mean_close_10 - mean_close_30) / mean_close_30
     rsi_low = (rsi <= 40)
@@ -157,6 +157,8 @@ def my_record_vars(context, data):
         short_count=shorts
     )
 
+STOP_LOSS = StopLossMonitor(stop_loss=-0.05)
+
 def handle_data(context, data):
     today = get_datetime().floor('1D')
     last_date = getattr(context, 'last_ran_buy', None)
@@ -164,15 +166,15 @@ def handle_data(context, data):
         my_rebalance(context, data)
         context.last_ran_buy = today
     else:
-        for stock, position in context.portfolio.positions.items():
-            if get_open_orders(stock):
+        # Only positions past the stop loss need the broker, and only if there are any
+        crossed = STOP_LOSS.crossed(context.portfolio.positions, data)
+        if not crossed:
+            return
+
+        open_orders = OpenOrderIndex(get_open_orders())
+        for stock, current_loss in crossed:
+            if stock in open_orders:
                 continue
 
-            current_price = data.current(stock, 'price')
-            cost_basis = position.cost_basis
-            stop_loss = -0.05
-            current_loss = (current_price - cost_basis) / cost_basis
-
-            if current_loss < stop_loss:
-                log.info('selling early %s (%.2f)' % (stock.symbol, current_loss))
-                order_target_percent(stock, 0)
+            log.info('selling early %s (%.2f)' % (stock.symbol, current_loss))
+            order_target_percent(stock, 0)
@@ -8,79 +8,94 @@ from pylivetrader.api import (
     symbol,
 )
 
-from pipeline_live.data.alpaca.factors import AverageDollarVolume
-from pipeline_live.data.alpaca.pricing import USEquityPricing
-from pipeline_live.data.polygon.fundamentals import PolygonCompany
-from pipeline_live.data.polygon.filters import IsPrimaryShareEmulation
-
-from zipline.pipeline import Pipeline
-from zipline.pipeline.factors import CustomFactor, Returns
 import numpy as np
 import pandas as pd
 
-import alpaca_trade_api as tradeapi
-from pipeline_live.data.sources.util import parallelize
+from tradealgo.cache import TTLCache, DAY
+from tradealgo.fetch import Fetcher
+from tradealgo.singleflight import RequestCoalescer
 
 import os
 import logbook
 
 log = logbook.Logger("algo")
 
+# Financials only change quarterly, dividends are checked daily for new declarations
+POLYGON_CACHE = TTLCache("polygon", ttls={"financials": 7 * DAY, "dividends": DAY})
 
-def financials(symbols):
-    def fetch(symbols):
-        symbol = symbols[0]
-        api = tradeapi.REST()
-        data = api.polygon.get(
-            "/reference/financials/{}".format(symbol), version="v2", params={"limit": 1}
-        )
-        return {symbol: data["results"]}
+# Every factor reading financials during a pipeline run shares a single fetch
+FINANCIALS = RequestCoalescer()
+
+# One keep-alive session for every Polygon lookup, paced and retried on 429s
+POLYGON = Fetcher(
+    os.environ.get("POLYGON_BASE_URL", "https://api.polygon.io"),
+    params={"apiKey": os.environ.get("APCA_API_KEY_ID")},
+    rate=20,
+    concurrency=25,
+)
+
+
+def polygon_results(endpoint, symbols):
+    responses = POLYGON.get_many(
+        {
+            symbol: ("/v2/reference/{}/{}".format(endpoint, symbol), {"limit": 1})
+            for symbol in symbols
+        }
+    )
+    return {symbol: data["results"] for symbol, data in responses.items()}
 
-    return parallelize(fetch, workers=25, splitlen=1)(symbols)
+
+def financials(symbols):
+    return POLYGON_CACHE.fetch(
+        "financials", symbols, lambda missing: polygon_results("financials", missing)
+    )
 
 
 def dividends(symbols):
-    def fetch(symbols):
-        symbol = symbols[0]
-        api = tradeapi.REST()
-        data = api.polygon.get(
-            "/reference/dividends/{}".format(symbol), version="v2", params={"limit": 1}
-        )
-        return {symbol: data["results"]}
+    return POLYGON_CACHE.fetch(
+        "dividends", symbols, lambda missing: polygon_results("dividends", missing)
+    )
 
-    return parallelize(fetch, workers=25, splitlen=1)(symbols)
 
+def financial_factors():
+    """The ``DividendYield`` and ``PriceEarningsRatio`` pipeline factors.
 
-class DividendYield(CustomFactor):
-    window_length = 1
-    inputs = []
+    Defined when the pipeline is built so loading the algo doesn't import
+    zipline's pipeline, see tradealgo/importprofile.py
+    """
+    from zipline.pipeline.factors import CustomFactor
 
-    def compute(self, today, assets, out, *inputs):
-        asset_financials = financials(assets)
-        out[:] = np.array(
-            [
-                asset_financials[asset][0].get("dividendYield", 0)
-                if asset_financials[asset]
-                else 0
-                for asset in assets
-            ]
-        )
+    class DividendYield(CustomFactor):
+        window_length = 1
+        inputs = []
 
+        def compute(self, today, assets, out, *inputs):
+            asset_financials = FINANCIALS.fetch(today, assets, financials)
+            out[:] = np.array(
+                [
+                    asset_financials[asset][0].get("dividendYield", 0)
+                    if asset_financials[asset]
+                    else 0
+                    for asset in assets
+                ]
+            )
 
-class PriceEarningsRatio(CustomFactor):
-    window_length = 1
-    inputs = []
+    class PriceEarningsRatio(CustomFactor):
+        window_length = 1
+        inputs = []
+
+        def compute(self, today, assets, out, *inputs):
+            asset_financials = FINANCIALS.fetch(today, assets, financials)
+            out[:] = np.array(
+                [
+                    asset_financials[asset][0].get("priceToEarningsRatio", 0)
+                    if asset_financials[asset]
+                    else 0
+                    for asset in assets
+                ]
+            )
 
-    def compute(self, today, assets, out, *inputs):
-        asset_financials = financials(assets)
-        out[:] = np.array(
-            [
-                asset_financials[asset][0].get("priceToEarningsRatio", 0)
-                if asset_financials[asset]
-                else 0
-                for asset in assets
-            ]
-        )
+    return DividendYield, PriceEarningsRatio
 
 
 def print_report(context, data):
@@ -137,6 +152,17 @@ def before_trading_start(context, data):
 
 
 def my_pipeline(context):
+    # Imported here so loading the algo doesn't wait on the data source modules,
+    # see tradealgo/importprofile.py
+    from pipeline_live.data.alpaca.factors import AverageDollarVolume
+    from pipeline_live.data.alpaca.pricing import USEquityPricing
+    from pipeline_live.data.polygon.fundamentals import PolygonCompany
+    from pipeline_live.data.polygon.filters import IsPrimaryShareEmulation
+    from zipline.pipeline import Pipeline
+    from zipline.pipeline.factors import Returns
+
+    DividendYield, PriceEarningsRatio = financial_factors()
+
     pipe = Pipeline()
 
     mkt_cap = PolygonCompany.marketcap.latest
@@ -174,65 +200,110 @@ def my_pipeline(context):
 
 
 class PortfolioOptimizer(object):
+    """Greedily grows the portfolio with equally weighted candidates.
+
+    Candidates are tried in order. Adding one re-targets every holding to an
+    equal share of the portfolio value (less the cash buffer), and it is kept
+    when topping up the holdings that fall short of that target fits in the
+    remaining cash. Holdings and prices are kept in NumPy arrays, so each pass
+    prices every remaining candidate at once and jumps to the first one that
+    fits, instead of copying the portfolio for every attempt.
+    """
+
     CASH_BUFFER = 0.05
 
-    def __init__(
-        self, portfolio_value, cash_available, current_portfolio, get_price_fn
-    ):
+    def __init__(self, portfolio_value, cash_available, current_portfolio, prices):
         self.portfolio_value = portfolio_value
         self.cash_available = cash_available
         self.current_portfolio = current_portfolio
-        self.new_portfolio = current_portfolio.copy()
-        self.get_price_fn = get_price_fn
-        self.price_cache = {}
+        self.prices = prices
+
+        self.stocks = list(current_portfolio.keys())
+        self.shares = np.array(list(current_portfolio.values()), dtype=np.int64)
+        self.stock_prices = np.array([prices[stock] for stock in self.stocks], dtype=float)
 
-        self.load_prices()
-        self.rebalance(self.new_portfolio.copy())
+        # Top up the current holdings to their equal weight first
+        if self.stocks:
+            self._add_first_fit([])
+
+    @property
+    def new_portfolio(self):
+        return dict(zip(self.stocks, self.shares.tolist()))
 
     def add(self, stock):
         if stock in self.current_portfolio:
             return True
 
-        attempted_portfolio = self.new_portfolio.copy()
-        attempted_portfolio[stock] = 0
-        log.info(f"attempting to add {stock} to portfolio @ {self.get_price(stock)}")
+        return bool(self.add_all([stock]))
 
-        return self.rebalance(attempted_portfolio)
+    def add_all(self, candidates):
+        """Tries ``candidates`` in order and returns the ones that were added.
 
-    def rebalance(self, attempted_portfolio):
-        target_allocation = (1 - self.CASH_BUFFER) / len(attempted_portfolio)
-        cost_of_update = 0.0
-        log.info(f"target_allocation: {target_allocation}")
+        Candidates are expected to be unique, like the pipeline output index.
+        """
+        candidates = [stock for stock in candidates if stock not in self.current_portfolio]
+        added = []
 
-        for stock, current_shares in attempted_portfolio.items():
-            target_shares = round(
-                (self.portfolio_value * target_allocation) / self.get_price(stock)
-            )
+        while candidates:
+            index = self._add_first_fit(candidates)
+            if index is None:
+                break
 
-            if target_shares <= current_shares:
-                continue
+            added.append(candidates[index])
+            candidates = candidates[index + 1:]
 
-            cost_of_update += (target_shares - current_shares) * self.get_price(stock)
-            log.info(
-                f"[{stock}] cost_of_update:{cost_of_update} cash_available:{self.cash_available}"
-            )
-            attempted_portfolio[stock] = target_shares
+        return added
 
-        attempted_portfolio = {
-            stock: quantity
-            for stock, quantity in attempted_portfolio.items()
-            if quantity > 0
-        }
-        if (
-            attempted_portfolio != self.new_portfolio
-            and cost_of_update <= self.cash_available
-        ):
-            log.info(f"found ideal portfolio: {attempted_portfolio}")
-            self.cash_available -= cost_of_update
-            self.new_portfolio = attempted_portfolio
-            return True
+    def _add_first_fit(self, candidates):
+        """Adds the first of ``candidates`` the cash allows and returns its index.
+
+        With no candidates the current holdings alone are re-targeted. Returns
+        ``None`` when no candidate fits.
+        """
+        target_allocation = (1 - self.CASH_BUFFER) / (len(self.stocks) + (1 if candidates else 0))
+        target_value = self.portfolio_value * target_allocation
+
+        target_shares = np.round(target_value / self.stock_prices)
+        top_up = target_shares > self.shares
+        # A running sum adds the holdings' costs in portfolio order, candidates come last
+        holdings_cost = np.cumsum(
+            np.where(top_up, (target_shares - self.shares) * self.stock_prices, 0.0)
+        )
+        holdings_cost = holdings_cost[-1] if len(holdings_cost) else 0.0
+        holdings_changed = bool(top_up.any() or (self.shares <= 0).any())
+
+        if candidates:
+            candidate_prices = np.array([self.prices[stock] for stock in candidates], dtype=float)
+            candidate_shares = np.round(target_value / candidate_prices)
+            buys = candidate_shares > 0
+            candidate_cost = np.where(buys, candidate_shares * candidate_prices, 0.0)
+            cost_of_update = holdings_cost + candidate_cost
+            changed = buys | holdings_changed
         else:
-            return False
+            cost_of_update = np.array([holdings_cost])
+            changed = np.array([holdings_changed])
+
+        fits = changed & (cost_of_update <= self.cash_available)
+        if not fits.any():
+            return None
+
+        index = int(np.argmax(fits))
+        shares = np.where(top_up, target_shares, self.shares).astype(np.int64)
+        stocks = self.stocks
+        stock_prices = self.stock_prices
+        if candidates and buys[index]:
+            stocks = stocks + [candidates[index]]
+            shares = np.append(shares, int(candidate_shares[index]))
+            stock_prices = np.append(stock_prices, candidate_prices[index])
+
+        keep = shares > 0
+        self.stocks = [stock for stock, kept in zip(stocks, keep) if kept]
+        self.shares = shares[keep]
+        self.stock_prices = stock_prices[keep]
+        self.cash_available -= float(cost_of_update[index])
+        log.info(f"found ideal portfolio: {self.new_portfolio}")
+
+        return index
 
     def optimizations(self):
         return {
@@ -241,21 +312,15 @@ class PortfolioOptimizer(object):
             if target_amount - self.current_portfolio.get(stock, 0) > 0
         }
 
-    def get_price(self, stock):
-        if stock in self.price_cache:
-            return self.price_cache[stock]
 
-        price = self.get_price_fn(stock)
-        if price:
-            self.price_cache[stock] = price
+def load_prices(data, stocks):
+    """Returns the last daily price of every stock from one history call"""
+    stocks = list(stocks)
+    if not stocks:
+        return {}
 
-    def load_prices(self):
-        for stock in self.current_portfolio.keys():
-            self.get_price(stock)
-
-
-def get_price_fn(data):
-    return lambda stock: data.history([symbol(stock)], "price", 5, "1d").values[-1][0]
+    history = data.history([symbol(stock) for stock in stocks], "price", 5, "1d")
+    return dict(zip(stocks, history.values[-1].tolist()))
 
 
 def rebalance(context, data):
@@ -265,15 +330,16 @@ def rebalance(context, data):
         asset.symbol: position.amount
         for asset, position in context.portfolio.positions.items()
     }
+    candidates = [asset.symbol for asset in context.output.head(20).index]
+    prices = load_prices(data, list(current_portfolio) + candidates)
+
     optimizer = PortfolioOptimizer(
         context.portfolio.portfolio_value,
         context.portfolio.cash,
         current_portfolio,
-        get_price_fn(data),
+        prices,
     )
-
-    for new_asset, row in context.output.head(20).iterrows():
-        optimizer.add(new_asset.symbol)
+    optimizer.add_all(candidates)
 
     validate(context, data, optimizer)
 
@@ -287,7 +353,7 @@ def validate(context, data, optimizer):
     log.info(f"found optimizations: {optimizer.optimizations()}")
     cost_of_update = sum(
         [
-            amount * get_price_fn(data)(stock)
+            amount * optimizer.prices[stock]
             for stock, amount in optimizer.optimizations().items()
         ]
     )
@@ -298,7 +364,7 @@ def validate(context, data, optimizer):
     dollar_value = {}
     total = 0.0
     for stock, quantity in optimizer.new_portfolio.items():
-        dollar_value[stock] = quantity * get_price_fn(data)(stock)
+        dollar_value[stock] = quantity * optimizer.prices[stock]
         total += dollar_value[stock]
 
     for stock, dollars in dollar_value.items():
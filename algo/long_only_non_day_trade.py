@@ -1,4 +1,3 @@
-from zipline.pipeline import Pipeline
 from pylivetrader.api import (
                              schedule_function,
                              date_rules,
@@ -10,19 +9,17 @@ from pylivetrader.api import (
                              order,
                              cancel_order
                              )
-from pipeline_live.data.iex.pricing import USEquityPricing
-from pipeline_live.data.iex.fundamentals import IEXCompany, IEXKeyStats
-from pipeline_live.data.iex.factors import SimpleMovingAverage, AverageDollarVolume
-from pipeline_live.data.polygon.filters import IsPrimaryShareEmulation
 from pylivetrader.finance.execution import LimitOrder
 
+from tradealgo.orderqueue import OrderQueue, CANCEL
+from tradealgo.orders import OpenOrderIndex, BUY, SELL, reconcile, side_of
+from tradealgo.schedule import IntervalSchedule
+from tradealgo import sizing
+from tradealgo.snapshot import PriceSnapshot
+
 import logbook
 log = logbook.Logger('algo')
 
-import numpy as np  # needed for NaN handling
-import math  # ceil and floor are useful for rounding
-import dateutil
-
 from itertools import cycle
 
 def record(*args, **kwargs):
@@ -44,16 +41,6 @@ def initialize(context):
     if not hasattr(context, 'age') or not context.age:
         context.age = {}
 
-    # Rebalance
-    minutes = 10
-    trading_hours = 6.5
-    trading_minutes = int(trading_hours * 60)
-    for minutez in range(1, trading_minutes, minutes):
-        schedule_function(my_rebalance,
-                date_rules.every_day(),
-                time_rules.market_open(
-                    minutes=minutez))
-
     # Prevent excessive logging of canceled orders at market close.
     schedule_function(
         cancel_open_orders,
@@ -76,29 +63,18 @@ def make_pipeline(context):
     """
     Create our pipeline.
     """
-
-    # Filter for primary share equities. IsPrimaryShare is a built-in filter.
-    primary_share = IsPrimaryShareEmulation()
-
-    # Equities listed as common stock (as opposed to, say, preferred stock).
-    # 'ST00000001' indicates common stock.
-    common_stock = IEXCompany.issueType.latest.eq('cs')
-
-    # Equities not trading over-the-counter.
-    not_otc = ~IEXCompany.exchange.latest.startswith(
-        'OTC')
-
-    # Not when-issued equities.
-    not_wi = ~IEXCompany.symbol.latest.endswith('.WI')
-
-    # Equities without LP in their name, .matches does a match using a regular
-    # expression
-    not_lp_name = ~IEXCompany.companyName.latest.matches(
-        '.* L[. ]?P.?$')
-
-    # Equities whose most recent Morningstar market cap is not null have
-    # fundamental data and therefore are not ETFs.
-    have_market_cap = IEXKeyStats.marketcap.latest.notnull()
+    # Imported here so loading the algo doesn't wait on the data source modules,
+    # see tradealgo/importprofile.py
+    from zipline.pipeline import Pipeline
+    from pipeline_live.data.iex.pricing import USEquityPricing
+    from tradealgo.factors import IncrementalDollarVolume, IncrementalSMA
+    from tradealgo.filters import TradeableUniverse
+
+    # Primary share common stocks not trading over-the-counter, not when-issued,
+    # without LP in their name and with a market cap (so not ETFs). These don't
+    # change during the day and are read from an index built once per session,
+    # see tradealgo/universe.py
+    classified = TradeableUniverse()
 
     # At least a certain price
     price = USEquityPricing.close.latest
@@ -107,12 +83,7 @@ def make_pipeline(context):
 
     # Filter for stocks that pass all of our previous filters.
     tradeable_stocks = (
-        primary_share
-        & common_stock
-        & not_otc
-        & not_wi
-        & not_lp_name
-        & have_market_cap
+        classified
         & AtLeastPrice
         & AtMostPrice
     )
@@ -128,30 +99,32 @@ Algorithm initialized variables:
  HighVar %s''' %
         (context.MaxCandidates, LowVar, HighVar))
 
+    # The averages below keep their windows between runs and only pull the latest
+    # bar each day. They track every tradeable stock so that symbols moving in and
+    # out of base_universe don't need their history refetched.
+
     # High dollar volume filter.
-    base_universe = AverageDollarVolume(
-        window_length=20,
+    base_universe = IncrementalDollarVolume(
+        bars=20,
         mask=tradeable_stocks
     ).percentile_between(LowVar, HighVar)
 
     # Short close price average.
-    ShortAvg = SimpleMovingAverage(
-        inputs=[USEquityPricing.close],
-        window_length=3,
-        mask=base_universe
+    ShortAvg = IncrementalSMA(
+        bars=3,
+        mask=tradeable_stocks
     )
 
     # Long close price average.
-    LongAvg = SimpleMovingAverage(
-        inputs=[USEquityPricing.close],
-        window_length=45,
-        mask=base_universe
+    LongAvg = IncrementalSMA(
+        bars=45,
+        mask=tradeable_stocks
     )
 
     percent_difference = (ShortAvg - LongAvg) / LongAvg
 
     # Filter to select securities to long.
-    stocks_worst = percent_difference.bottom(context.MaxCandidates)
+    stocks_worst = percent_difference.bottom(context.MaxCandidates, mask=base_universe)
     securities_to_trade = (stocks_worst)
 
     return Pipeline(
@@ -190,86 +163,112 @@ def before_trading_start(context, data):
     # Track the last run
     context.last_date = today
 
+def handle_data(context, data):
+    # Rebalance every 10 minutes from the first minute until a minute before the close
+    REBALANCE(context, data, get_datetime())
+
 def my_rebalance(context, data):
-    cancel_open_buy_orders(context, data)
+    # List open orders once per cycle and keep the index current as we place and cancel
+    open_orders = OpenOrderIndex(get_open_orders())
+
+    positions = list(context.portfolio.positions)
+    candidates = [context.MyCandidate.__next__() for _ in range(context.MaxBuyOrdersAtOnce)]
+
+    # Fetch the prices for every decision of this rebalance in one batch
+    snapshot = PriceSnapshot(data, positions + candidates, history_bars=20)
+
+    # The orders we want open after this cycle, keyed by (stock, side). When the pipeline
+    # returns fewer names than MaxBuyOrdersAtOnce the cycle repeats them, a stock still
+    # gets a single buy sized by weight: placing one per repeat canceled the previous
+    # one, since buying a stock cancels its open orders, and left the last one open.
+    desired = {}
 
     # Order sell at profit target in hope that somebody actually buys it
-    for stock in context.portfolio.positions:
-        submit_sell(stock, context, data)
+    plan_sells(positions, context, snapshot, open_orders, desired)
 
     weight = float(1.00 / context.MaxBuyOrdersAtOnce)
-    for ThisBuyOrder in range(context.MaxBuyOrdersAtOnce):
-        submit_buy(context.MyCandidate.__next__(), context, data, weight)
+    plan_buys(candidates, context, snapshot, weight, desired)
 
-def submit_sell(stock, context, data):
-    if get_open_orders(stock):
-        return
+    # Only touch the orders that differ from what is open, an order that is kept
+    # also keeps its place in the queue. Open buys we no longer want are canceled.
+    cancels, creates, kept = reconcile(open_orders, desired, cancel_unlisted=(BUY,))
+    for open_order in cancels:
+        cancel_open_order(open_order, open_orders)
+    for stock, amount, limit_price in creates:
+        submit_order(stock, amount, limit_price, open_orders)
+    log.info('orders: %d kept, %d canceled, %d placed' % (len(kept), len(cancels), len(creates)))
+
+    # Wait for the queued cancels and orders to go out before the cycle ends
+    ORDERS.join()
+
+REBALANCE = IntervalSchedule(my_rebalance, minutes=10, start=1, end=1)
+
+# Paced to the broker's rate limit, cancels first, then sells, then buys
+ORDERS = OrderQueue()
+
+def submit_order(stock, amount, limit_price, open_orders):
+    # The ticket stands in for the order id until the queue has placed the order
+    ticket = ORDERS.submit(order, stock, amount, style=LimitOrder(limit_price),
+                           kind=side_of(amount), key=stock)
+    open_orders.add(stock, ticket, amount, limit_price)
+
+def cancel_open_order(open_order, open_orders):
+    ORDERS.submit(cancel_order_id, open_order.id, kind=CANCEL, key=open_order.asset)
+    open_orders.remove(open_order)
+
+def cancel_order_id(order_id):
+    # order() returns None for orders it didn't place
+    if order_id is not None:
+        cancel_order(order_id)
+
+def plan_sells(positions, context, snapshot, open_orders, desired):
+    # Leave the sells that are already open alone
+    stocks = [stock for stock in positions if not open_orders.orders(stock, SELL)]
 
     # We bought a stock but don't know it's age yet
-    if stock not in context.age:
-        context.age[stock] = 0
+    for stock in stocks:
+        if stock not in context.age:
+            context.age[stock] = 0
 
     # Don't sell stuff that's less than 1 day old
-    if stock in context.age and context.age[stock] < 1:
+    stocks = [stock for stock in stocks if context.age[stock] >= 1]
+    if not stocks:
         return
 
-    shares = context.portfolio.positions[stock].amount
-    current_price = float(data.current([stock], 'price'))
-    cost_basis = float(context.portfolio.positions[stock].cost_basis)
-
-    if (context.age[stock] >= context.MyFireSaleAge and
-            (current_price < context.MyFireSalePrice or current_price < cost_basis)):
-        log.info("%s is in fire sale!" % stock.symbol)
-        sell_price = float(make_div_by_05(.95 * current_price, buy=False))
-
-        order(stock, -shares, style=LimitOrder(sell_price))
-    else:
-        sell_price = float(
-            make_div_by_05(
-                cost_basis *
-                context.sell_factor,
-                buy=False))
+    held = context.portfolio.positions
+    limits, fire_sale = sizing.plan_sells(
+        snapshot.prices[[snapshot.index(stock) for stock in stocks]],
+        [float(held[stock].cost_basis) for stock in stocks],
+        [context.age[stock] for stock in stocks],
+        context.MyFireSaleAge, context.MyFireSalePrice, context.sell_factor)
 
-        order(stock, -shares, style=LimitOrder(sell_price))
+    for stock, sell_price, on_sale in zip(stocks, limits.tolist(), fire_sale.tolist()):
+        if on_sale:
+            log.info("%s is in fire sale!" % stock.symbol)
+        desired[(stock, SELL)] = (-held[stock].amount, sell_price)
 
-def submit_buy(stock, context, data, weight):
+def plan_buys(candidates, context, snapshot, weight, desired):
     cash = min(investment_limits(context)['remaining_to_invest'], context.portfolio.cash)
 
-    price_history = data.history([stock], 'price', 20, '1d')
-    average_price = float(price_history.mean())
-    current_price = float(data.current([stock], 'price'))
-
-    if np.isnan(current_price):
-        pass  # probably best to wait until nan goes away
-    else:
-        if current_price > float(1.25 * average_price): # if the price is 25% above the 20d avg
-            buy_price = float(current_price)
-        else: # Otherwise buy at a discount
-            buy_price = float(current_price * context.buy_factor)
-        buy_price = float(make_div_by_05(buy_price, buy=True))
-        shares_to_buy = int(weight * cash / buy_price)
-        max_exposure = int(weight * context.portfolio.portfolio_value / buy_price)
-
-        # Prevent over exposing to a particular stock, never own more than 1/max_buy_orders
-        # of our account value
-        positions = context.portfolio.positions
-        if stock in positions and positions[stock].amount >= max_exposure:
-            return
-
-        # This cancels open sales that would prevent these buys from being submitted if running
-        # up against the PDT rule
-        open_orders = get_open_orders()
-        if stock in open_orders:
-            for open_order in open_orders[stock]:
-                cancel_order(open_order)
-
-        order(stock, shares_to_buy, style=LimitOrder(buy_price))
-
-def make_div_by_05(s, buy=False):
-    s *= 20.00
-    s = math.floor(s) if buy else math.ceil(s)
-    s /= 20.00
-    return s
+    # Prevent over exposing to a particular stock, never own more than 1/max_buy_orders
+    # of our account value. Candidates without a price are skipped, probably best to
+    # wait until nan goes away
+    positions = context.portfolio.positions
+    rows = [snapshot.index(stock) for stock in candidates]
+    buy, limits, shares = sizing.plan_buys(
+        snapshot.prices[rows], snapshot.averages[rows],
+        [stock in positions for stock in candidates],
+        [positions[stock].amount if stock in positions else 0 for stock in candidates],
+        weight, cash, context.portfolio.portfolio_value, context.buy_factor)
+
+    for stock, buying, buy_price, shares_to_buy in zip(
+            candidates, buy.tolist(), limits.tolist(), shares.tolist()):
+        if not buying:
+            continue
+        # No open sales alongside the buy, they would prevent it from being submitted if
+        # running up against the PDT rule
+        desired[(stock, SELL)] = None
+        desired[(stock, BUY)] = (shares_to_buy, buy_price)
 
 def my_record_vars(context, data):
     """
@@ -292,18 +291,6 @@ def my_record_vars(context, data):
     record(Invested=limits['invested'])
     record(RemainingToInvest=limits['remaining_to_invest'])
 
-def cancel_open_buy_orders(context, data):
-    oo = get_open_orders()
-    if len(oo) == 0:
-        return
-    for stock, orders in oo.items():
-        for o in orders:
-            # message = 'Canceling order of {amount} shares in {stock}'
-            # log.info(message.format(amount=o.amount, stock=stock))
-            if 0 < o.amount:  # it is a buy order
-                cancel_order(o)
-
-
 def cancel_open_orders(context, data):
     oo = get_open_orders()
     if len(oo) == 0:
@@ -312,7 +299,8 @@ def cancel_open_orders(context, data):
         for o in orders:
             # message = 'Canceling order of {amount} shares in {stock}'
             # log.info(message.format(amount=o.amount, stock=stock))
-            cancel_order(o)
+            ORDERS.submit(cancel_order, o, kind=CANCEL, key=stock)
+    ORDERS.join()
 
 def investment_limits(context):
     cash = context.portfolio.cash
@@ -1,25 +1,43 @@
-from pylivetrader.api import order_target_percent, symbol
+from pylivetrader.api import order_target_percent, symbol, get_datetime
+
+from tradealgo.bars import BarAggregator
 
 import logbook
-import talib
 
 log = logbook.Logger('algo')
 
+BAR_MINUTES = 240
+HISTORY_MINUTES = 10000
+SHORT_SPAN = 20
+LONG_SPAN = 40
+
 def initialize(context):
     context.i = 0
     context.asset = symbol('SPY')
 
+    # 240 minute bars and their EMAs, kept in the state file between restarts
+    if not hasattr(context, 'bars'):
+        context.bars = None
+
+def update_bars(context, data):
+    bars = context.bars
+    missed = bars.minutes_since(get_datetime()) if bars is not None else None
+
+    # Rebuild from the last 10000 minutes on a cold start or after a long gap,
+    # otherwise only fetch the minutes since the last update
+    if missed is None or missed > HISTORY_MINUTES:
+        bars = context.bars = BarAggregator(BAR_MINUTES, (SHORT_SPAN, LONG_SPAN))
+        missed = HISTORY_MINUTES
+
+    prices = data.history(context.asset, 'price', bar_count=max(1, missed), frequency="1m")
+    bars.add_history(prices)
+    return bars
+
 def handle_data(context, data):
     # Compute averages
-    # data.history() has to be called with the same params
-    # from above and returns a pandas dataframe.
-    prices = data.history(context.asset, 'price', bar_count=10000, frequency="1m")
-    print(prices.tail(10))
-    prices = prices.resample('240T').last().dropna()
-    print(prices.tail(10))
-
-    short_mavg = talib.EMA(prices, 20)[-1]
-    long_mavg = talib.EMA(prices, 40)[-1]
+    bars = update_bars(context, data)
+    short_mavg = bars.ema(SHORT_SPAN)
+    long_mavg = bars.ema(LONG_SPAN)
 
     log.info(
             '''
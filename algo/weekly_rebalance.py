@@ -11,9 +11,10 @@ from pylivetrader.api import (
     symbol,
 )
 from pylivetrader.finance.execution import LimitOrder
-import talib
 import logbook
 
+from tradealgo.market import MarketState
+
 LOG = logbook.Logger("algo")
 
 
@@ -28,6 +29,10 @@ def initialize(context):
 
     context.target_leverage = 1
 
+    # Running SMA-200 of QQQ and last known prices, kept in the state file between restarts
+    if not hasattr(context, "market"):
+        context.market = MarketState(200)
+
     schedule_function(
         rebalance, date_rules.every_day(), time_rules.market_open(minutes=11)
     )
@@ -36,13 +41,14 @@ def initialize(context):
 def before_trading_start(context, data):
     determine_market_direction(context, data)
     set_portfolio(context, data)
+    context.market.remember(data.current(list(context.stocks), "price"))
 
 
 def determine_market_direction(context, data):
-    history = data.history(symbol("QQQ"), fields="price", bar_count=390, frequency="1d")
-    long_ma = talib.SMA(history, 200)
+    market = context.market
+    market.update_index(data, symbol("QQQ"))
 
-    if long_ma[-1] < history[-1]:
+    if market.sma.value < market.sma.last_close:
         LOG.info("market is up")
         context.direction = 1
     else:
@@ -76,8 +82,12 @@ def calculate_totals(context, data):
     for stock, weight in context.stocks.items():
         price = data.current(stock, "price")
         if isnan(price):
-            # Pull the last week of minut data and use the last "price" for sparsely traded stocks
+            # Sparsely traded stocks use the last price we saw for them
+            price = context.market.last_price(stock)
+        if isnan(price):
+            # Nothing seen yet, pull the last week of minute data for the last "price"
             price = data.history(stock, "price", bar_count=3360, frequency="1m")[-1]
+        context.market.remember({stock: price})
         weight *= context.target_leverage
         total = floor((weight * context.portfolio.portfolio_value) / price)
         if stock in context.portfolio.positions:
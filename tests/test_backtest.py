@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tradealgo.backtest import BarStore, Engine
+from tradealgo.bench import ALGO_ENV, synthetic_bars
+from tradealgo.sweep import LongOnlyPipeline
+
+ALGO_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "algo")
+
+LIMIT_BUY = """
+from pylivetrader.api import order, schedule_function, symbol, date_rules, time_rules
+from pylivetrader.finance.execution import LimitOrder
+
+
+def initialize(context):
+    schedule_function(buy, date_rules.every_day(), time_rules.market_open(minutes=30))
+
+
+def buy(context, data):
+    stock = symbol("A")
+    if stock not in context.portfolio.positions:
+        context.price = data.current(stock, "price")
+        order(stock, 10, style=LimitOrder(context.limit_factor * context.price))
+"""
+
+
+@pytest.fixture(autouse=True)
+def algo_env(monkeypatch):
+    for name, value in ALGO_ENV.items():
+        monkeypatch.setenv(name, value)
+
+
+def daily_bars(low):
+    sessions = pd.bdate_range("2019-01-02", periods=2)
+    ones = np.ones((2, 1))
+    return BarStore.from_arrays(["A"], sessions, {
+        "open": 10 * ones, "high": 11 * ones, "low": low * ones, "close": 10 * ones,
+        "volume": 1e6 * ones,
+    })
+
+
+def run_limit_buy(tmp_path, bars, limit_factor):
+    algofile = tmp_path / "limit_buy.py"
+    algofile.write_text(LIMIT_BUY)
+    engine = Engine(str(algofile), bars, params={"limit_factor": limit_factor},
+                    end=bars.sessions[0])
+    result = engine.run()
+    return result, engine.broker.positions, engine.context.price
+
+
+def test_daily_limit_buy_fills_at_the_limit_when_the_low_reaches_it(tmp_path):
+    result, positions, price = run_limit_buy(tmp_path, daily_bars(low=9), limit_factor=0.95)
+    assert result.fills == 1
+    (position,) = positions.values()
+    assert position.cost_basis == pytest.approx(0.95 * price)
+
+
+def test_daily_limit_buy_stays_open_above_the_low(tmp_path):
+    result, positions, _ = run_limit_buy(tmp_path, daily_bars(low=9.8), limit_factor=0.95)
+    assert result.fills == 0
+    assert result.cancels == 1
+    assert not positions
+
+
+def test_marketable_limit_fills_at_the_current_price(tmp_path):
+    result, positions, price = run_limit_buy(tmp_path, daily_bars(low=9), limit_factor=1.05)
+    assert result.fills == 1
+    (position,) = positions.values()
+    assert position.cost_basis == pytest.approx(price)
+
+
+def test_long_only_fills_on_daily_bars():
+    bars = synthetic_bars(40, sessions=70, seed=1)
+    pipeline = LongOnlyPipeline(bars)
+    engine = Engine(os.path.join(ALGO_DIR, "long_only_non_day_trade.py"), bars,
+                    start=pipeline.first_session)
+    engine.pipelines = pipeline.bind(engine.context)
+    stats = engine.run().stats()
+    assert stats["fills"] > 0
+    assert not np.isnan(stats["sharpe"])
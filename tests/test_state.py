@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tradealgo.state import JournalStore, RedisStateStore
+
+
+class Context(object):
+    pass
+
+
+@pytest.mark.parametrize("kind", ["journal", "redis"])
+def test_in_place_changes_survive_a_reload(tmp_path, kind):
+    if kind == "redis":
+        fakeredis = pytest.importorskip("fakeredis")
+        client = fakeredis.FakeStrictRedis()
+        make_store = lambda: RedisStateStore("algo", client=client)
+    else:
+        make_store = lambda: JournalStore(str(tmp_path / "algo.state"))
+
+    context = Context()
+    context.output = pd.DataFrame({"rank": [1.0, 2.0]}, index=["A", "B"])
+    context.weights = np.zeros(3)
+    store = make_store()
+    store.load(context, "algo")
+    store.save(context, "algo", [])
+
+    context.output.loc["A", "rank"] = 5.0
+    context.weights[:] = 0.5
+    store.save(context, "algo", [])
+
+    reloaded = Context()
+    make_store().load(reloaded, "algo")
+    assert reloaded.output.loc["A", "rank"] == 5.0
+    assert reloaded.weights.tolist() == [0.5, 0.5, 0.5]
+
+
+def test_unchanged_frames_are_not_rewritten(tmp_path):
+    context = Context()
+    context.output = pd.DataFrame({"rank": np.arange(1000.0)})
+    store = JournalStore(str(tmp_path / "algo.state"))
+    store.load(context, "algo")
+    store.save(context, "algo", [])
+
+    written = store._journal_bytes
+    context.output = context.output.copy()
+    store.save(context, "algo", [])
+    assert store._journal_bytes == written
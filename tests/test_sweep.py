@@ -0,0 +1,15 @@
+import numpy as np
+
+from tradealgo.sweep import rank
+
+
+def test_rank_puts_runs_without_fills_after_the_ones_with_fills():
+    rows = [
+        {"point": 1, "sharpe": np.nan, "orders": 120, "fills": 0, "error": ""},
+        {"point": 2, "sharpe": 0.5, "orders": 90, "fills": 12, "error": ""},
+        {"point": 3, "error": "ValueError: boom"},
+        {"point": 4, "sharpe": 1.5, "orders": 80, "fills": 20, "error": ""},
+    ]
+    results = rank(rows, "sharpe")
+    assert results["point"].tolist() == [4, 2, 1, 3]
+    assert results["traded"].tolist() == [True, True, False, False]
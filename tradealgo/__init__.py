@@ -0,0 +1 @@
+"""Shared helpers for the algorithms in ``algo/``."""
@@ -0,0 +1,9 @@
+"""Offline backtests of the ``algo/`` modules against recorded bars.
+
+    python -m tradealgo.backtest algo/long_only_non_day_trade.py --bars tmp/bars \\
+        --pipelines tmp/pipelines --start 2019-01-02 --end 2019-12-31
+"""
+from tradealgo.backtest.data import Asset, BarStore
+from tradealgo.backtest.engine import BacktestResult, Engine, RecordedPipelines
+
+__all__ = ["Asset", "BarStore", "BacktestResult", "Engine", "RecordedPipelines"]
@@ -0,0 +1,43 @@
+import argparse
+
+import logbook
+
+from tradealgo.backtest import BarStore, Engine, RecordedPipelines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m tradealgo.backtest",
+        description="Runs an algo file against recorded bars",
+    )
+    parser.add_argument("algofile")
+    parser.add_argument("--bars", required=True,
+                        help="directory with daily/<SYMBOL>.csv and minute/<SYMBOL>.csv bars")
+    parser.add_argument("--pipelines", help="directory with <name>/<YYYY-MM-DD>.csv outputs")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--capital", type=float, default=100000)
+    parser.add_argument("--equity-out", help="write the daily portfolio value to this CSV")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the algo's log")
+    args = parser.parse_args(argv)
+
+    level = logbook.INFO if args.verbose else logbook.WARNING
+    with logbook.StderrHandler(level=level).applicationbound():
+        engine = Engine(
+            args.algofile,
+            BarStore.load(args.bars),
+            capital=args.capital,
+            pipelines=RecordedPipelines(args.pipelines) if args.pipelines else None,
+            start=args.start,
+            end=args.end,
+        )
+        result = engine.run()
+
+    for name, value in result.stats().items():
+        print("{:<16} {}".format(name, value))
+    if args.equity_out:
+        result.equity.to_csv(args.equity_out, header=["portfolio_value"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Stand-in for ``pylivetrader.api`` that routes every call to the running Engine."""
+import numpy as np
+import pandas as pd
+
+from tradealgo.backtest.data import SESSION_MINUTES
+
+_engine = None
+
+
+def _current():
+    if _engine is None:
+        raise RuntimeError("pylivetrader.api stand-in used outside of a backtest")
+    return _engine
+
+
+class DateRule(object):
+    def __init__(self, matches):
+        self.matches = matches
+
+
+class TimeRule(object):
+    """``minute`` is the session minute (1 = first bar) or ``None`` for every minute."""
+
+    def __init__(self, minute):
+        self.minute = minute
+
+
+def _position_in_group(sessions, keys, from_end=False):
+    return pd.Series(np.arange(len(sessions))).groupby(keys).cumcount(ascending=not from_end)
+
+
+class date_rules(object):
+    @staticmethod
+    def every_day():
+        return DateRule(lambda sessions: np.ones(len(sessions), dtype=bool))
+
+    @staticmethod
+    def week_start(days_offset=0):
+        return DateRule(lambda sessions: _position_in_group(
+            sessions, _weeks(sessions)).values == days_offset)
+
+    @staticmethod
+    def week_end(days_offset=0):
+        return DateRule(lambda sessions: _position_in_group(
+            sessions, _weeks(sessions), from_end=True).values == days_offset)
+
+    @staticmethod
+    def month_start(days_offset=0):
+        return DateRule(lambda sessions: _position_in_group(
+            sessions, _months(sessions)).values == days_offset)
+
+    @staticmethod
+    def month_end(days_offset=0):
+        return DateRule(lambda sessions: _position_in_group(
+            sessions, _months(sessions), from_end=True).values == days_offset)
+
+
+def _weeks(sessions):
+    return (sessions.tz_localize(None) - pd.to_timedelta(sessions.dayofweek, unit="D")).values
+
+
+def _months(sessions):
+    return (sessions.year * 12 + sessions.month).values
+
+
+def _offset_minutes(offset, hours, minutes):
+    if offset is not None:
+        return int(offset.total_seconds() // 60)
+    if hours is None and minutes is None:
+        return 1
+    return int(hours or 0) * 60 + int(minutes or 0)
+
+
+class time_rules(object):
+    @staticmethod
+    def market_open(offset=None, hours=None, minutes=None):
+        return TimeRule(_offset_minutes(offset, hours, minutes))
+
+    @staticmethod
+    def market_close(offset=None, hours=None, minutes=None):
+        return TimeRule(SESSION_MINUTES - _offset_minutes(offset, hours, minutes))
+
+    @staticmethod
+    def every_minute():
+        return TimeRule(None)
+
+
+def schedule_function(func, date_rule=None, time_rule=None, half_days=True, calendar=None):
+    _current().schedule_function(func, date_rule, time_rule)
+
+
+def attach_pipeline(pipeline, name, chunks=None, eager=True):
+    _current().count("attach_pipeline")
+    _current().pipelines_attached[name] = pipeline
+    return pipeline
+
+
+def pipeline_output(name):
+    return _current().pipeline_output(name)
+
+
+def get_datetime(tz=None):
+    now = _current().get_datetime()
+    return now.tz_convert(tz) if tz is not None else now
+
+
+def get_environment(field="platform"):
+    return "backtest"
+
+
+def record(*args, **kwargs):
+    _current().record(**kwargs)
+
+
+def symbol(symbol_str):
+    return _current().symbol(symbol_str)
+
+
+def symbols(*args):
+    return [_current().symbol(symbol_str) for symbol_str in args]
+
+
+def order(asset, amount, limit_price=None, stop_price=None, style=None):
+    return _current().order(asset, amount, limit_price, style)
+
+
+def order_value(asset, value, limit_price=None, stop_price=None, style=None):
+    return _current().order_value(asset, value, limit_price, style)
+
+
+def order_percent(asset, percent, limit_price=None, stop_price=None, style=None):
+    return _current().order_percent(asset, percent, limit_price, style)
+
+
+def order_target(asset, target, limit_price=None, stop_price=None, style=None):
+    return _current().order_target(asset, target, limit_price, style)
+
+
+def order_target_value(asset, target, limit_price=None, stop_price=None, style=None):
+    return _current().order_target_value(asset, target, limit_price, style)
+
+
+def order_target_percent(asset, target, limit_price=None, stop_price=None, style=None):
+    return _current().order_target_percent(asset, target, limit_price, style)
+
+
+def get_open_orders(asset=None):
+    return _current().get_open_orders(asset)
+
+
+def get_order(order_id):
+    return _current().get_order(order_id)
+
+
+def cancel_order(order_param):
+    _current().cancel_order(order_param)
@@ -0,0 +1,107 @@
+"""Simulated account: cash, positions and open orders."""
+from collections import OrderedDict
+
+
+class Order(object):
+    def __init__(self, id, asset, amount, created, limit=None):
+        # created is the UTC timestamp in nanoseconds
+        self.id = id
+        self.asset = asset
+        self.amount = amount
+        self.created = created
+        self.limit = limit
+        self.filled = 0
+        self.status = "open"
+
+    @property
+    def sid(self):
+        return self.asset
+
+    @property
+    def open(self):
+        return self.status == "open"
+
+    def __repr__(self):
+        return "Order(id={!r}, asset={!r}, amount={}, limit={}, status={})".format(
+            self.id, self.asset, self.amount, self.limit, self.status
+        )
+
+
+class Position(object):
+    def __init__(self, asset):
+        self.asset = asset
+        self.amount = 0
+        self.cost_basis = 0.0
+        self.last_sale_price = 0.0
+
+    def copy(self):
+        # Called for every position whenever the portfolio is looked at, cheaper than copy.copy
+        position = Position(self.asset)
+        position.amount = self.amount
+        position.cost_basis = self.cost_basis
+        position.last_sale_price = self.last_sale_price
+        return position
+
+    def __repr__(self):
+        return "Position(asset={!r}, amount={}, cost_basis={})".format(
+            self.asset, self.amount, self.cost_basis
+        )
+
+
+class Broker(object):
+    """Keeps the books, the engine decides when and at what price orders fill."""
+
+    def __init__(self, capital):
+        self.starting_cash = float(capital)
+        self.cash = float(capital)
+        self.positions = OrderedDict()
+        self.open_orders = OrderedDict()
+        self.order_count = 0
+        self.fill_count = 0
+        self.cancel_count = 0
+
+    def place(self, asset, amount, created, limit=None):
+        self.order_count += 1
+        o = Order(str(self.order_count), asset, amount, created, limit)
+        self.open_orders[o.id] = o
+        return o
+
+    def cancel(self, order_id):
+        o = self.open_orders.pop(order_id, None)
+        if o is not None:
+            o.status = "canceled"
+            self.cancel_count += 1
+        return o
+
+    def cancel_all(self):
+        for order_id in list(self.open_orders):
+            self.cancel(order_id)
+
+    def orders_for(self, asset):
+        return [o for o in self.open_orders.values() if o.asset == asset]
+
+    def fill(self, o, price):
+        self.open_orders.pop(o.id, None)
+        o.filled = o.amount
+        o.status = "filled"
+        self.fill_count += 1
+        self.cash -= o.amount * price
+
+        position = self.positions.get(o.asset)
+        if position is None:
+            position = self.positions[o.asset] = Position(o.asset)
+
+        amount = position.amount + o.amount
+        if amount == 0:
+            del self.positions[o.asset]
+            return
+
+        if position.amount == 0 or (position.amount > 0) != (amount > 0):
+            # Opened or flipped the position
+            position.cost_basis = price
+        elif abs(amount) > abs(position.amount):
+            position.cost_basis = (
+                position.cost_basis * position.amount + price * o.amount
+            ) / amount
+        position.amount = amount
+        position.last_sale_price = price
@@ -0,0 +1,219 @@
+"""Recorded bars for offline runs, held in NumPy arrays."""
+import os
+
+import numpy as np
+import pandas as pd
+
+SESSION_MINUTES = 390
+MINUTE_NS = 60 * 10 ** 9
+FIELDS = ("open", "high", "low", "close", "volume")
+PATH_LEG = SESSION_MINUTES // 3
+
+
+class Asset(object):
+    """Equity identified by its symbol, like the assets pylivetrader hands out.
+
+    The engine hands out one instance per symbol, so assets compare and hash
+    by identity, which keeps the algos' dict and set lookups cheap.
+    """
+
+    __slots__ = ("symbol",)
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+
+    def __lt__(self, other):
+        return self.symbol < other.symbol
+
+    def __repr__(self):
+        return "Equity({})".format(self.symbol)
+
+
+class MinuteBars(object):
+    """Minute bars of one symbol, ``times`` are bar end times in UTC nanoseconds."""
+
+    def __init__(self, frame):
+        self.times = frame.index.values.astype("datetime64[ns]").astype(np.int64)
+        self.open = frame["open"].values.astype(float)
+        self.high = frame["high"].values.astype(float)
+        self.low = frame["low"].values.astype(float)
+        self.close = frame["close"].values.astype(float)
+        self.volume = frame["volume"].values.astype(float)
+
+    def last_index(self, now_ns):
+        """Index of the last bar ending at or before ``now_ns``, -1 if there is none."""
+        return int(np.searchsorted(self.times, now_ns, side="right")) - 1
+
+    def window(self, start_ns, end_ns):
+        """Slice of the bars ending in ``(start_ns, end_ns]``."""
+        lo = int(np.searchsorted(self.times, start_ns, side="right"))
+        hi = int(np.searchsorted(self.times, end_ns, side="right"))
+        return slice(lo, hi)
+
+
+def _utc_index(frame):
+    frame = frame.sort_index()
+    index = pd.DatetimeIndex(frame.index)
+    frame.index = index.tz_localize("UTC") if index.tz is None else index.tz_convert("UTC")
+    return frame
+
+
+def _daily_from_minute(frame):
+    eastern = frame.index.tz_convert("America/New_York")
+    grouped = frame.groupby(pd.DatetimeIndex(eastern.date).tz_localize("UTC"))
+    return pd.DataFrame({
+        "open": grouped["open"].first(),
+        "high": grouped["high"].max(),
+        "low": grouped["low"].min(),
+        "close": grouped["close"].last(),
+        "volume": grouped["volume"].sum(),
+    })
+
+
+def _read_frames(path):
+    frames = {}
+    if not os.path.isdir(path):
+        return frames
+
+    for filename in sorted(os.listdir(path)):
+        for extension in (".csv", ".csv.gz"):
+            if filename.endswith(extension):
+                symbol = filename[:-len(extension)]
+                frame = pd.read_csv(os.path.join(path, filename), index_col=0, parse_dates=True)
+                frames[symbol] = _utc_index(frame)
+    return frames
+
+
+class BarStore(object):
+    """Daily bars aligned on one session calendar, plus optional minute bars.
+
+    Daily fields are ``sessions x (symbols + 1)`` matrices. The extra last
+    column is all NaN and is what unknown symbols resolve to, so lookups for
+    a list of assets are always a single fancy-indexing operation.
+    """
+
+    def __init__(self, daily, minute=None):
+        """``daily`` and ``minute`` map symbols to DataFrames indexed by timestamp
+        with open, high, low, close and volume columns. Symbols that only have
+        minute bars get daily bars derived from them."""
+        minute = {symbol: _utc_index(frame) for symbol, frame in (minute or {}).items()}
+        daily = {symbol: _utc_index(frame) for symbol, frame in daily.items()}
+        for symbol, frame in minute.items():
+            if symbol not in daily:
+                daily[symbol] = _daily_from_minute(frame)
+
+        for symbol, frame in daily.items():
+            daily[symbol] = frame.groupby(frame.index.normalize()).last()
+
+        sessions = set()
+        for frame in daily.values():
+            sessions.update(frame.index)
+        sessions = pd.DatetimeIndex(sorted(sessions))
+        if sessions.tz is None:
+            sessions = sessions.tz_localize("UTC")
+
+        symbols = sorted(daily)
+        matrices = {}
+        for field in FIELDS:
+            matrix = np.empty((len(sessions), len(symbols)))
+            for i, symbol in enumerate(symbols):
+                matrix[:, i] = daily[symbol][field].reindex(sessions).values
+            matrices[field] = matrix
+
+        self._build(symbols, sessions, matrices, minute)
+
+    @classmethod
+    def from_arrays(cls, symbols, sessions, daily):
+        """Builds a daily-only store from one ``sessions x symbols`` matrix per field."""
+        store = cls.__new__(cls)
+        sessions = pd.DatetimeIndex(sessions)
+        if sessions.tz is None:
+            sessions = sessions.tz_localize("UTC")
+        store._build(list(symbols), sessions, daily, {})
+        return store
+
+    def _build(self, symbols, sessions, matrices, minute):
+        self.symbols = symbols
+        self._columns = {symbol: i for i, symbol in enumerate(symbols)}
+        self.sessions = sessions
+
+        opens = (sessions.tz_localize(None) + pd.Timedelta(hours=9, minutes=30))
+        self.session_opens = opens.tz_localize("America/New_York").tz_convert("UTC") \
+            .values.astype("datetime64[ns]").astype(np.int64)
+
+        self.daily = {}
+        for field in FIELDS:
+            matrix = np.full((len(sessions), len(symbols) + 1), np.nan)
+            matrix[:, :len(symbols)] = matrices[field]
+            self.daily[field] = matrix
+
+        self.minute = {symbol: MinuteBars(frame) for symbol, frame in minute.items()}
+
+    @classmethod
+    def load(cls, root):
+        """Loads ``<root>/daily/<SYMBOL>.csv`` and ``<root>/minute/<SYMBOL>.csv`` files."""
+        return cls(
+            _read_frames(os.path.join(root, "daily")),
+            _read_frames(os.path.join(root, "minute")),
+        )
+
+    def column(self, symbol):
+        return self._columns.get(symbol, -1)
+
+    def columns(self, symbols):
+        return np.array([self._columns.get(symbol, -1) for symbol in symbols], dtype=np.int64)
+
+    def minute_time(self, session, minute):
+        return int(self.session_opens[session]) + minute * MINUTE_NS
+
+    def _path(self, session, columns):
+        """Vertices of the intraday path of daily-only symbols, 4 x len(columns).
+
+        The price walks open -> low -> high -> close on up days and
+        open -> high -> low -> close on down days, spending a third of the
+        session on each leg.
+        """
+        daily = self.daily
+        open_, high, low, close = (daily[field][session][columns]
+                                   for field in ("open", "high", "low", "close"))
+        up = close >= open_
+        return np.array([open_, np.where(up, low, high), np.where(up, high, low), close])
+
+    def path_prices(self, session, columns, minute):
+        if minute < 0:
+            if session == 0:
+                return np.full(len(columns), np.nan)
+            return self.daily["close"][session - 1][columns]
+
+        minute = min(minute, SESSION_MINUTES)
+        leg = min(minute // PATH_LEG, 2)
+        vertices = self._path(session, columns)
+        fraction = (minute - leg * PATH_LEG) / float(PATH_LEG)
+        return vertices[leg] + (vertices[leg + 1] - vertices[leg]) * fraction
+
+    def prices(self, symbols, session, minute, now_ns):
+        """Last known price of each symbol at ``minute`` of ``session``.
+
+        Symbols with minute bars use the last minute close, daily-only symbols
+        follow their intraday path and sit at the previous close before the open.
+        """
+        prices = self.path_prices(session, self.columns(symbols), minute)
+
+        if self.minute:
+            for i, symbol in enumerate(symbols):
+                bars = self.minute.get(symbol)
+                if bars is not None:
+                    last = bars.last_index(now_ns)
+                    prices[i] = bars.close[last] if last >= 0 else np.nan
+        return prices
+
+    def range(self, symbol, start_ns, end_ns):
+        """Lowest low and highest high of the minute bars in ``(start_ns, end_ns]``."""
+        bars = self.minute.get(symbol)
+        if bars is None:
+            return np.nan, np.nan
+
+        window = bars.window(start_ns, end_ns)
+        if window.start >= window.stop:
+            return np.nan, np.nan
+        return bars.low[window].min(), bars.high[window].max()
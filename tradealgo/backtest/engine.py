@@ -0,0 +1,574 @@
+"""Replays recorded bars through an algo module with simulated fills."""
+import os
+import sys
+import time
+import types
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from tradealgo.backtest import api, execution
+from tradealgo.backtest.broker import Broker
+from tradealgo.backtest.data import SESSION_MINUTES, Asset
+from tradealgo.backtest.inert import inert_modules
+from tradealgo.orderqueue import OrderQueue
+from tradealgo.schedule import IntervalSchedule
+
+# before_trading_start runs 45 minutes before the open, like pylivetrader
+BEFORE_OPEN = -45
+
+
+@contextmanager
+def stand_in_modules(engine):
+    """Installs the ``pylivetrader`` stand-in modules bound to ``engine``."""
+    root = types.ModuleType("pylivetrader")
+    finance = types.ModuleType("pylivetrader.finance")
+    root.api = api
+    root.finance = finance
+    finance.execution = execution
+    modules = {
+        "pylivetrader": root,
+        "pylivetrader.api": api,
+        "pylivetrader.finance": finance,
+        "pylivetrader.finance.execution": execution,
+    }
+
+    saved = {name: sys.modules.get(name) for name in modules}
+    previous_engine = api._engine
+    sys.modules.update(modules)
+    api._engine = engine
+    try:
+        with inert_modules():
+            yield
+    finally:
+        api._engine = previous_engine
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+
+
+def _is_listlike(value):
+    return isinstance(value, (list, tuple, set, pd.Index, np.ndarray, pd.Series))
+
+
+class Context(object):
+    """The algo's ``context``, attributes set by the algo live on it directly."""
+
+    def __init__(self, engine):
+        self._engine = engine
+
+    @property
+    def portfolio(self):
+        return self._engine.portfolio()
+
+    @property
+    def account(self):
+        return self._engine.account()
+
+
+class Portfolio(object):
+    def __init__(self, broker, prices):
+        self.cash = broker.cash
+        self.starting_cash = broker.starting_cash
+        # Copies, so algos can place orders while iterating over their positions
+        self.positions = OrderedDict(
+            (asset, position.copy()) for asset, position in broker.positions.items()
+        )
+
+        for position, price in zip(self.positions.values(), prices):
+            if not np.isnan(price):
+                position.last_sale_price = price
+
+        self.positions_value = float(sum(
+            position.amount * position.last_sale_price for position in self.positions.values()
+        ))
+        self.gross_positions_value = float(sum(
+            abs(position.amount) * position.last_sale_price
+            for position in self.positions.values()
+        ))
+        self.portfolio_value = self.cash + self.positions_value
+        self.pnl = self.portfolio_value - self.starting_cash
+        self.returns = self.pnl / self.starting_cash if self.starting_cash else 0.0
+
+
+class Account(object):
+    def __init__(self, portfolio):
+        value = portfolio.portfolio_value
+        self.settled_cash = portfolio.cash
+        self.buying_power = portfolio.cash
+        self.total_positions_value = portfolio.positions_value
+        self.net_liquidation = value
+        self.leverage = portfolio.gross_positions_value / value if value else 0.0
+        self.net_leverage = portfolio.positions_value / value if value else 0.0
+
+
+class BarData(object):
+    """The algo's ``data`` argument.
+
+    ``price`` and ``close`` follow the engine's price model. Other fields come
+    from the current minute bar, or today's daily bar for daily-only symbols.
+    """
+
+    def __init__(self, engine):
+        self._engine = engine
+
+    def current(self, assets, fields):
+        engine = self._engine
+        engine.count("data.current")
+
+        single_asset = not _is_listlike(assets)
+        single_field = isinstance(fields, str)
+        asset_list = [assets] if single_asset else list(assets)
+        field_list = [fields] if single_field else list(fields)
+        values = {field: engine.current_values(asset_list, field) for field in field_list}
+
+        if single_asset and single_field:
+            return float(values[fields][0])
+        if single_field:
+            return pd.Series(values[fields], index=asset_list)
+        if single_asset:
+            return pd.Series({field: values[field][0] for field in field_list})
+        return pd.DataFrame(values, index=asset_list, columns=field_list)
+
+    def history(self, assets, fields, bar_count, frequency):
+        engine = self._engine
+        engine.count("data.history")
+
+        single_asset = not _is_listlike(assets)
+        asset_list = [assets] if single_asset else list(assets)
+        if not isinstance(fields, str):
+            frames = {field: self.history(asset_list, field, bar_count, frequency)
+                      for field in fields}
+            if single_asset:
+                return pd.DataFrame({field: frame.iloc[:, 0] for field, frame in frames.items()})
+            return pd.concat(frames, axis=1)
+
+        if frequency in ("1d", "daily"):
+            frame = engine.daily_history(asset_list, fields, bar_count)
+        elif frequency in ("1m", "minute"):
+            frame = engine.minute_history(asset_list, fields, bar_count)
+        else:
+            raise ValueError("unsupported history frequency {!r}".format(frequency))
+
+        if fields == "price":
+            frame = frame.ffill()
+        return frame.iloc[:, 0] if single_asset else frame
+
+    def can_trade(self, assets):
+        if _is_listlike(assets):
+            prices = self._engine.current_values(list(assets), "price")
+            return pd.Series(~np.isnan(prices), index=list(assets))
+        return not np.isnan(self._engine.current_values([assets], "price")[0])
+
+    def is_stale(self, assets):
+        if _is_listlike(assets):
+            return pd.Series(False, index=list(assets))
+        return False
+
+
+class BacktestResult(object):
+    def __init__(self, equity, orders, fills, cancels, calls, elapsed):
+        self.equity = equity
+        self.orders = orders
+        self.fills = fills
+        self.cancels = cancels
+        self.calls = calls
+        self.elapsed = elapsed
+
+    def stats(self):
+        equity = self.equity
+        returns = equity.pct_change().dropna()
+        drawdown = equity / equity.cummax() - 1 if len(equity) else equity
+        volatility = returns.std()
+        return OrderedDict([
+            ("sessions", len(equity)),
+            ("start_value", float(equity.iloc[0]) if len(equity) else float("nan")),
+            ("end_value", float(equity.iloc[-1]) if len(equity) else float("nan")),
+            ("total_return", float(equity.iloc[-1] / equity.iloc[0] - 1)
+                if len(equity) else float("nan")),
+            ("sharpe", float(returns.mean() / volatility * np.sqrt(252))
+                if volatility else float("nan")),
+            ("max_drawdown", float(drawdown.min()) if len(equity) else float("nan")),
+            ("orders", self.orders),
+            ("fills", self.fills),
+            ("cancels", self.cancels),
+            ("elapsed_seconds", self.elapsed),
+        ])
+
+
+class Engine(object):
+    """Runs an algo file over the sessions of a BarStore.
+
+    Only the minutes with something scheduled are simulated. Market orders,
+    and limit orders the current price already satisfies, fill at the current
+    price when placed. Between two simulated minutes, open limit orders fill
+    at their limit when the minute bars' lows and highs crossed it. Daily-only
+    symbols use the daily rule instead: buys fill when the session's low is at
+    or below the limit, sells when its high is at or above it. Unfilled
+    orders expire at the close, like day orders.
+    ``pipelines`` is a callable ``(name, session) -> DataFrame`` indexed by
+    symbol, e.g. ``RecordedPipelines``. ``params`` are context attributes set
+    once ``initialize`` returned, in place of the values it hard-codes.
+    """
+
+    def __init__(self, algofile, bars, capital=100000, pipelines=None, start=None, end=None,
+                 params=None):
+        self.algofile = algofile
+        self.bars = bars
+        self.params = dict(params or {})
+        self.broker = Broker(capital)
+        self.pipelines = pipelines or (lambda name, session: pd.DataFrame())
+        self.pipelines_attached = {}
+        self.context = Context(self)
+        self.data = BarData(self)
+        self.calls = Counter()
+        self.records = []
+
+        sessions = bars.sessions
+        first = 0 if start is None else int(sessions.searchsorted(_utc(start)))
+        last = len(sessions) if end is None else int(sessions.searchsorted(_utc(end), "right"))
+        self.session_range = range(first, last)
+
+        self._assets = {}
+        self._scheduled = []
+        self._pipeline_cache = {}
+        self._portfolio = None
+        self.session = first
+        self.minute = BEFORE_OPEN
+        self.now_ns = bars.minute_time(first, BEFORE_OPEN) if len(sessions) else 0
+
+    def count(self, name):
+        self.calls[name] += 1
+
+    def load(self):
+        with open(self.algofile) as f:
+            source = f.read()
+        namespace = {"__name__": os.path.splitext(os.path.basename(self.algofile))[0],
+                     "__file__": self.algofile}
+        exec(compile(source, self.algofile, "exec"), namespace)
+        # Simulated orders don't need pacing, and run in order they stay deterministic
+        for value in namespace.values():
+            if isinstance(value, OrderQueue):
+                value.inline = True
+        return namespace
+
+    def run(self):
+        started = time.time()
+        equity = []
+        with stand_in_modules(self):
+            namespace = self.load()
+            initialize = namespace.get("initialize")
+            before_trading_start = namespace.get("before_trading_start")
+            handle_data = namespace.get("handle_data")
+
+            if initialize is not None:
+                initialize(self.context)
+            for name, value in self.params.items():
+                setattr(self.context, name, value)
+
+            intervals = [value for value in namespace.values()
+                         if isinstance(value, IntervalSchedule)]
+
+            ticks = self._session_ticks(handle_data, intervals)
+            for session in self.session_range:
+                self.set_time(session, BEFORE_OPEN)
+                self._pipeline_cache = {}
+                if before_trading_start is not None:
+                    before_trading_start(self.context, self.data)
+
+                for minute, funcs in ticks(session):
+                    self._advance(minute)
+                    for func in funcs:
+                        func(self.context, self.data)
+
+                self._advance(SESSION_MINUTES)
+                self._close_session()
+                equity.append(self.portfolio().portfolio_value)
+
+        sessions = self.bars.sessions[self.session_range.start:self.session_range.stop]
+        return BacktestResult(
+            pd.Series(equity, index=sessions),
+            self.broker.order_count,
+            self.broker.fill_count,
+            self.broker.cancel_count,
+            dict(self.calls),
+            time.time() - started,
+        )
+
+    def _session_ticks(self, handle_data, intervals=()):
+        sessions = self.bars.sessions
+        date_masks = [date_rule.matches(sessions) for date_rule, _, _ in self._scheduled]
+        every_minute = handle_data is not None and bool(self.bars.minute)
+        interval_ticks = [(schedule.tick_minutes(), self._interval_tick(schedule))
+                          for schedule in intervals]
+
+        def ticks(session):
+            by_minute = {}
+            if handle_data is not None:
+                minutes = range(1, SESSION_MINUTES + 1) if every_minute else [SESSION_MINUTES]
+                for minute in minutes:
+                    by_minute[minute] = [handle_data]
+
+            # Live, handle_data drives the interval schedules every minute. Here they are
+            # called at their own minutes, which are no-ops if handle_data already ran them
+            for minutes, tick in interval_ticks:
+                for minute in minutes:
+                    by_minute.setdefault(minute, []).append(tick)
+
+            for mask, (_, time_rule, func) in zip(date_masks, self._scheduled):
+                if not mask[session]:
+                    continue
+                minutes = range(1, SESSION_MINUTES + 1) if time_rule.minute is None \
+                    else [time_rule.minute]
+                for minute in minutes:
+                    by_minute.setdefault(minute, []).append(func)
+            return sorted(by_minute.items())
+
+        return ticks
+
+    def _interval_tick(self, schedule):
+        def tick(context, data):
+            schedule(context, data, self.get_datetime())
+        tick.__name__ = schedule.func.__name__
+        return tick
+
+    def set_time(self, session, minute):
+        self.session = session
+        self.minute = minute
+        self.now_ns = self.bars.minute_time(session, minute)
+        self._portfolio = None
+
+    def _advance(self, minute):
+        start_ns = self.now_ns
+        self.set_time(self.session, minute)
+        if self.broker.open_orders:
+            self._match_orders(start_ns, self.now_ns)
+
+    def _match_orders(self, start_ns, end_ns):
+        daily_orders = []
+        for o in list(self.broker.open_orders.values()):
+            if o.limit is None:
+                price = self.current_values([o.asset], "price")[0]
+                if not np.isnan(price):
+                    self._fill(o, price)
+            elif o.asset.symbol in self.bars.minute:
+                low, high = self.bars.range(o.asset.symbol, start_ns, end_ns)
+                self._fill_limit(o, low, high)
+            else:
+                daily_orders.append(o)
+
+        if daily_orders:
+            # The intraday path only moves a fraction of a percent between two rebalances,
+            # limits placed below or above the price would hardly ever be reached on it
+            columns = self.bars.columns([o.asset.symbol for o in daily_orders])
+            lows = self.bars.daily["low"][self.session][columns]
+            highs = self.bars.daily["high"][self.session][columns]
+            for o, low, high in zip(daily_orders, lows, highs):
+                self._fill_limit(o, low, high)
+
+    def _fill_limit(self, o, low, high):
+        if o.amount > 0 and low <= o.limit:
+            self._fill(o, o.limit)
+        elif o.amount < 0 and high >= o.limit:
+            self._fill(o, o.limit)
+
+    def _fill(self, o, price):
+        self.broker.fill(o, price)
+        self._portfolio = None
+
+    def _close_session(self):
+        self.broker.cancel_all()
+
+    # Prices
+
+    def current_values(self, assets, field):
+        symbols = [asset.symbol for asset in assets]
+        if field in ("price", "close"):
+            return self.bars.prices(symbols, self.session, self.minute, self.now_ns)
+        if field == "last_traded":
+            return np.array([self.get_datetime()] * len(assets))
+
+        values = self.bars.daily[field][self.session][self.bars.columns(symbols)]
+        for i, symbol in enumerate(symbols):
+            minute_bars = self.bars.minute.get(symbol)
+            if minute_bars is not None:
+                last = minute_bars.last_index(self.now_ns)
+                values[i] = getattr(minute_bars, field)[last] if last >= 0 else np.nan
+        return values
+
+    def daily_history(self, assets, field, bar_count):
+        in_session = self.minute >= 1
+        end = self.session + 1 if in_session else self.session
+        start = max(0, end - bar_count)
+        column = "close" if field == "price" else field
+        symbols = [asset.symbol for asset in assets]
+
+        values = self.bars.daily[column][start:end][:, self.bars.columns(symbols)]
+        if in_session and field in ("price", "close") and len(values):
+            values[-1] = self.current_values(assets, "price")
+        return pd.DataFrame(values, index=self.bars.sessions[start:end], columns=assets)
+
+    def minute_history(self, assets, field, bar_count):
+        column = "close" if field == "price" else field
+        series = []
+        for asset in assets:
+            minute_bars = self.bars.minute.get(asset.symbol)
+            if minute_bars is None:
+                series.append(pd.Series([], dtype=float, name=asset))
+                continue
+            end = minute_bars.last_index(self.now_ns) + 1
+            start = max(0, end - bar_count)
+            index = pd.DatetimeIndex(minute_bars.times[start:end]).tz_localize("UTC")
+            series.append(pd.Series(getattr(minute_bars, column)[start:end],
+                                    index=index, name=asset))
+        return pd.concat(series, axis=1).iloc[-bar_count:]
+
+    # pylivetrader.api
+
+    def schedule_function(self, func, date_rule=None, time_rule=None):
+        self.count("schedule_function")
+        self._scheduled.append((
+            date_rule or api.date_rules.every_day(),
+            time_rule or api.time_rules.every_minute(),
+            func,
+        ))
+
+    def pipeline_output(self, name):
+        self.count("pipeline_output")
+        if name not in self._pipeline_cache:
+            output = self.pipelines(name, self.bars.sessions[self.session])
+            output = output.copy()
+            output.index = [self.symbol(s) if not isinstance(s, Asset) else s
+                            for s in output.index]
+            self._pipeline_cache[name] = output
+        return self._pipeline_cache[name]
+
+    def get_datetime(self):
+        return pd.Timestamp(self.now_ns, tz="UTC")
+
+    def record(self, **kwargs):
+        self.records.append((self.get_datetime(), kwargs))
+
+    def symbol(self, symbol_str):
+        asset = self._assets.get(symbol_str)
+        if asset is None:
+            asset = self._assets[symbol_str] = Asset(symbol_str)
+        return asset
+
+    def portfolio(self):
+        if self._portfolio is None:
+            prices = self.current_values(list(self.broker.positions), "price")
+            self._portfolio = Portfolio(self.broker, prices)
+        return self._portfolio
+
+    def account(self):
+        return Account(self.portfolio())
+
+    def order(self, asset, amount, limit_price=None, style=None):
+        self.count("order")
+        amount = int(amount)
+        if amount == 0:
+            return None
+
+        if limit_price is None and style is not None:
+            limit_price = style.limit_price
+        o = self.broker.place(asset, amount, self.now_ns, limit_price)
+
+        price = self.current_values([asset], "price")[0]
+        if not np.isnan(price) and (limit_price is None
+                                    or (amount > 0 and limit_price >= price)
+                                    or (amount < 0 and limit_price <= price)):
+            self._fill(o, price)
+        return o.id
+
+    def order_value(self, asset, value, limit_price=None, style=None):
+        price = self.current_values([asset], "price")[0]
+        if np.isnan(price) or price == 0:
+            return None
+        return self.order(asset, int(value / price), limit_price, style)
+
+    def order_percent(self, asset, percent, limit_price=None, style=None):
+        value = percent * self.portfolio().portfolio_value
+        return self.order_value(asset, value, limit_price, style)
+
+    def order_target(self, asset, target, limit_price=None, style=None):
+        position = self.broker.positions.get(asset)
+        current = position.amount if position is not None else 0
+        return self.order(asset, int(target) - current, limit_price, style)
+
+    def order_target_value(self, asset, target, limit_price=None, style=None):
+        self.count("order_target_value")
+        price = self.current_values([asset], "price")[0]
+        if np.isnan(price) or price == 0:
+            return None
+        return self.order_target(asset, int(target / price), limit_price, style)
+
+    def order_target_percent(self, asset, target, limit_price=None, style=None):
+        self.count("order_target_percent")
+        value = target * self.portfolio().portfolio_value
+        return self.order_target_value(asset, value, limit_price, style)
+
+    def get_open_orders(self, asset=None):
+        self.count("get_open_orders")
+        if asset is not None:
+            return self.broker.orders_for(asset)
+
+        open_orders = OrderedDict()
+        for o in self.broker.open_orders.values():
+            open_orders.setdefault(o.asset, []).append(o)
+        return open_orders
+
+    def get_order(self, order_id):
+        return self.broker.open_orders.get(order_id)
+
+    def cancel_order(self, order_param):
+        self.count("cancel_order")
+        order_id = getattr(order_param, "id", order_param)
+        self.broker.cancel(order_id)
+
+
+def _utc(value):
+    value = pd.Timestamp(value)
+    return value.tz_localize("UTC") if value.tz is None else value.tz_convert("UTC")
+
+
+class RecordedPipelines(object):
+    """Pipeline outputs recorded as ``<root>/<name>/<YYYY-MM-DD>.csv`` files.
+
+    Each file is indexed by symbol. A session uses the latest file dated on or
+    before it, and an empty output when there is none.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._dates = {}
+        self._frames = {}
+
+    def _available(self, name):
+        if name not in self._dates:
+            path = os.path.join(self.root, name)
+            filenames = sorted(f for f in os.listdir(path) if f.endswith(".csv")) \
+                if os.path.isdir(path) else []
+            self._dates[name] = (
+                pd.DatetimeIndex([f[:-len(".csv")] for f in filenames]).tz_localize("UTC"),
+                filenames,
+            )
+        return self._dates[name]
+
+    def __call__(self, name, session):
+        dates, filenames = self._available(name)
+        position = int(dates.searchsorted(session, "right")) - 1
+        if position < 0:
+            return pd.DataFrame()
+
+        filename = filenames[position]
+        key = (name, filename)
+        if key not in self._frames:
+            self._frames[key] = pd.read_csv(
+                os.path.join(self.root, name, filename), index_col=0
+            )
+        return self._frames[key]
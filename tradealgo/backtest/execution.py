@@ -0,0 +1,11 @@
+"""Stand-in for ``pylivetrader.finance.execution``."""
+
+
+class MarketOrder(object):
+    def __init__(self, exchange=None):
+        self.limit_price = None
+
+
+class LimitOrder(object):
+    def __init__(self, limit_price, asset=None, exchange=None):
+        self.limit_price = limit_price
@@ -0,0 +1,83 @@
+"""Inert stand-ins for pipeline libraries that are not installed.
+
+Backtests read pipeline results from recordings, so an algo's pipeline
+definition only has to build, never run. When ``zipline`` or ``pipeline_live``
+is missing, every name imported from them resolves to ``Inert``, a class that
+accepts any construction, attribute access, call or operator.
+"""
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import sys
+import types
+from contextlib import contextmanager
+
+PIPELINE_ROOTS = ("zipline", "pipeline_live")
+
+
+class _InertMeta(type):
+    def __getattr__(cls, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Inert()
+
+
+class Inert(metaclass=_InertMeta):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Inert()
+
+    def _inert(self, *args, **kwargs):
+        return Inert()
+
+    __call__ = __getitem__ = _inert
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = _inert
+    __truediv__ = __rtruediv__ = __pow__ = __neg__ = __invert__ = _inert
+    __and__ = __rand__ = __or__ = __ror__ = _inert
+    __lt__ = __le__ = __gt__ = __ge__ = _inert
+
+
+class InertModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return Inert
+
+
+class _InertFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def __init__(self, roots):
+        self.roots = roots
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname.split(".")[0] in self.roots:
+            return importlib.machinery.ModuleSpec(fullname, self, is_package=True)
+        return None
+
+    def create_module(self, spec):
+        return InertModule(spec.name)
+
+    def exec_module(self, module):
+        module.__path__ = []
+
+
+@contextmanager
+def inert_modules(roots=PIPELINE_ROOTS):
+    """Makes the ``roots`` that cannot be imported resolve to inert modules."""
+    missing = tuple(root for root in roots if importlib.util.find_spec(root) is None)
+    if not missing:
+        yield missing
+        return
+
+    finder = _InertFinder(missing)
+    sys.meta_path.append(finder)
+    try:
+        yield missing
+    finally:
+        sys.meta_path.remove(finder)
+        for name in list(sys.modules):
+            if name.split(".")[0] in missing:
+                del sys.modules[name]
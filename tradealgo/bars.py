@@ -0,0 +1,95 @@
+"""Streaming aggregation of minute prices into longer bars."""
+import math
+
+import numpy as np
+import pandas as pd
+
+MINUTE_NS = 60 * 10 ** 9
+
+
+class RunningEMA(object):
+    """Exponential moving average updated one bar at a time.
+
+    Like ``talib.EMA`` it is seeded with the simple average of the first
+    ``span`` bars and is NaN until then.
+    """
+
+    def __init__(self, span):
+        self.span = span
+        self.alpha = 2.0 / (span + 1)
+        self.count = 0
+        # Running sum of the bars until the seed is complete
+        self.value = 0.0
+
+    def add(self, price):
+        self.count += 1
+        if self.count < self.span:
+            self.value += price
+        elif self.count == self.span:
+            self.value = (self.value + price) / self.span
+        else:
+            self.value += self.alpha * (price - self.value)
+
+    def peek(self, price):
+        """The value the EMA would have if ``price`` was added, without adding it."""
+        if self.count + 1 < self.span:
+            return float("nan")
+        if self.count + 1 == self.span:
+            return (self.value + price) / self.span
+        return self.value + self.alpha * (price - self.value)
+
+
+class BarAggregator(object):
+    """Folds minute prices into ``minutes`` long bars and keeps EMAs of their closes.
+
+    Bars are aligned on midnight UTC, like ``Series.resample``. The EMAs
+    only hold completed bars; ``ema(span)`` adds the bar that is still open
+    on the fly, so it matches ``talib.EMA(prices.resample(...).last().dropna(),
+    span)[-1]`` computed over the same minutes.
+    """
+
+    def __init__(self, minutes, spans):
+        self.bar_ns = minutes * MINUTE_NS
+        self.emas = {span: RunningEMA(span) for span in spans}
+        self.bar = None
+        self.close = float("nan")
+        self.last_seen = None
+
+    def add(self, timestamp_ns, price):
+        if self.last_seen is not None and timestamp_ns <= self.last_seen:
+            return
+        self.last_seen = timestamp_ns
+        if math.isnan(price):
+            return
+
+        bar = timestamp_ns // self.bar_ns
+        if self.bar is not None and bar != self.bar:
+            for ema in self.emas.values():
+                ema.add(self.close)
+        self.bar = bar
+        self.close = price
+
+    def add_history(self, prices):
+        """Adds the minutes of a price Series that are newer than the last one seen."""
+        index = pd.DatetimeIndex(prices.index)
+        if index.tz is not None:
+            index = index.tz_convert("UTC").tz_localize(None)
+        times = index.values.astype("datetime64[ns]").astype(np.int64)
+
+        values = np.asarray(prices, dtype=float)
+        if self.last_seen is not None:
+            newer = times > self.last_seen
+            times, values = times[newer], values[newer]
+        for timestamp_ns, price in zip(times.tolist(), values.tolist()):
+            self.add(timestamp_ns, price)
+
+    def minutes_since(self, now):
+        """Whole minutes between the newest minute seen and ``now``, None if empty."""
+        if self.last_seen is None:
+            return None
+        return int(math.ceil((pd.Timestamp(now).value - self.last_seen) / float(MINUTE_NS)))
+
+    def ema(self, span):
+        if self.bar is None:
+            return float("nan")
+        return self.emas[span].peek(self.close)
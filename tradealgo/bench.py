@@ -0,0 +1,273 @@
+"""Benchmarks the algos' scheduled functions against synthetic universes.
+
+    python -m tradealgo.bench [--sizes 100,1000,5000,10000] [--output PATH]
+        [--compare PREVIOUS.json]
+
+Every scenario loads an algo through the backtest engine, seeds a portfolio
+and pipeline output sized to the universe, then times one call of the
+function. Wall time, API call counts and peak traced memory are written to a
+JSON file (``tmp/bench/<commit>.json`` by default) so runs from different
+commits can be compared.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+
+import logbook
+import numpy as np
+import pandas as pd
+
+from tradealgo.backtest.data import BarStore
+from tradealgo.backtest.engine import Engine, stand_in_modules
+
+ALGO_DIR = "algo"
+BENCH_DIR = os.path.join("tmp", "bench")
+DEFAULT_SIZES = (100, 1000, 5000, 10000)
+SESSIONS = 60
+REBALANCE_MINUTE = 31
+
+# Environment the algos read in initialize
+ALGO_ENV = {"HOURS": "0", "MINUTES": "30", "LEVERAGE": "1", "MAX_LEVERAGE": "1"}
+
+
+def synthetic_bars(size, sessions=SESSIONS, seed=0):
+    rng = np.random.RandomState(seed)
+    symbols = ["S{:05d}".format(i) for i in range(size)]
+    dates = pd.bdate_range(end="2019-12-31", periods=sessions)
+
+    start = rng.uniform(3, 25, size)
+    close = start * np.exp(np.cumsum(rng.normal(0, 0.02, (sessions, size)), axis=0))
+    open_ = np.vstack([close[:1], close[:-1]])
+    daily = {
+        "open": open_,
+        "high": np.maximum(open_, close) * 1.01,
+        "low": np.minimum(open_, close) * 0.99,
+        "close": close,
+        "volume": rng.uniform(1e5, 1e7, (sessions, size)),
+    }
+    return BarStore.from_arrays(symbols, dates, daily)
+
+
+def seed_positions(engine, assets):
+    for asset in assets:
+        price = engine.current_values([asset], "price")[0]
+        o = engine.broker.place(asset, 100, engine.now_ns)
+        engine.broker.fill(o, price)
+    engine.set_time(engine.session, engine.minute)
+
+
+def _universe(engine):
+    return [engine.symbol(symbol) for symbol in engine.bars.symbols]
+
+
+def _held(universe):
+    return universe[:max(1, len(universe) // 20)]
+
+
+def setup_long_only(engine, namespace):
+    universe = _universe(engine)
+    engine.pipelines = lambda name, session: pd.DataFrame(
+        {"stocks_worst": True}, index=[asset.symbol for asset in universe]
+    )
+    seed_positions(engine, _held(universe))
+    engine.context.age = {asset: 2 for asset in _held(universe)}
+
+
+def setup_long_only_rebalance(engine, namespace):
+    setup_long_only(engine, namespace)
+    engine.set_time(engine.session, -45)
+    namespace["before_trading_start"](engine.context, engine.data)
+    engine.set_time(engine.session, REBALANCE_MINUTE)
+
+
+def setup_dividend(engine, namespace):
+    universe = _universe(engine)
+    engine.pipelines = lambda name, session: pd.DataFrame(
+        {"rank": np.arange(len(universe), dtype=float)},
+        index=[asset.symbol for asset in universe],
+    )
+    seed_positions(engine, _held(universe))
+    engine.context.output = engine.pipeline_output("my_pipeline").sort_values(
+        "rank", ascending=False
+    )
+
+
+def run_portfolio_optimizer(engine, namespace):
+    portfolio = engine.context.portfolio
+    current = {asset.symbol: position.amount for asset, position in portfolio.positions.items()}
+    symbols = engine.bars.symbols
+    prices = dict(zip(symbols, engine.current_values(_universe(engine), "price").tolist()))
+
+    optimizer = namespace["PortfolioOptimizer"](
+        portfolio.portfolio_value, portfolio.cash, current, prices
+    )
+    optimizer.add_all([symbol for symbol in symbols if symbol not in current])
+
+
+def setup_weekly(engine, namespace):
+    universe = _universe(engine)
+    seed_positions(engine, _held(universe))
+    engine.context.stocks = {asset: 1.0 / len(universe) for asset in universe}
+
+
+def setup_held(engine, namespace):
+    seed_positions(engine, _held(_universe(engine)))
+
+
+def setup_3x_etfs(engine, namespace):
+    universe = _universe(engine)
+    seed_positions(engine, _held(universe))
+    engine.context.longs = universe[:max(1, len(universe) // 10)]
+    engine.context.shorts = universe[len(universe) // 10:max(2, len(universe) // 5)]
+
+
+class Scenario(object):
+    def __init__(self, algo, function, setup, run=None):
+        self.algo = algo
+        self.function = function
+        self.setup = setup
+        self.run = run
+
+    @property
+    def name(self):
+        return "{}:{}".format(self.algo, self.function)
+
+    def call(self, engine, namespace):
+        if self.run is not None:
+            return self.run(engine, namespace)
+        return namespace[self.function](engine.context, engine.data)
+
+
+SCENARIOS = [
+    Scenario("long_only_non_day_trade.py", "before_trading_start", setup_long_only),
+    Scenario("long_only_non_day_trade.py", "my_rebalance", setup_long_only_rebalance),
+    Scenario("dividend.py", "before_trading_start", setup_dividend),
+    Scenario("dividend.py", "rebalance", setup_dividend),
+    Scenario("dividend.py", "PortfolioOptimizer", setup_dividend, run_portfolio_optimizer),
+    Scenario("weekly_rebalance.py", "calculate_totals", setup_weekly),
+    Scenario("weekly_rebalance.py", "rebalance", setup_weekly),
+    Scenario("daily_rebalance.py", "rebalance", setup_held),
+    Scenario("3x_etfs.py", "my_rebalance", setup_3x_etfs),
+]
+
+
+def measure(scenario, bars, algo_dir=ALGO_DIR):
+    """Times one call of the scenario's function, then repeats it to trace memory."""
+    result = OrderedDict([("scenario", scenario.name), ("symbols", len(bars.symbols))])
+
+    for traced in (False, True):
+        engine = Engine(os.path.join(algo_dir, scenario.algo), bars)
+        with stand_in_modules(engine):
+            namespace = engine.load()
+            engine.set_time(len(bars.sessions) - 1, -45)
+            if "initialize" in namespace:
+                namespace["initialize"](engine.context)
+            engine.set_time(engine.session, REBALANCE_MINUTE)
+            scenario.setup(engine, namespace)
+            calls = Counter(engine.calls)
+            orders = engine.broker.order_count
+
+            if traced:
+                tracemalloc.start()
+                scenario.call(engine, namespace)
+                result["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                started = time.perf_counter()
+                scenario.call(engine, namespace)
+                result["wall_seconds"] = time.perf_counter() - started
+                result["api_calls"] = dict(Counter(engine.calls) - calls)
+                result["orders"] = engine.broker.order_count - orders
+
+    return result
+
+
+def run(sizes=DEFAULT_SIZES, scenarios=SCENARIOS, algo_dir=ALGO_DIR):
+    results = []
+    for size in sizes:
+        bars = synthetic_bars(size)
+        for scenario in scenarios:
+            try:
+                results.append(measure(scenario, bars, algo_dir))
+            except Exception as e:
+                results.append(OrderedDict([
+                    ("scenario", scenario.name),
+                    ("symbols", size),
+                    ("error", "{}: {}".format(type(e).__name__, e)),
+                ]))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline):
+    previous = {(r["scenario"], r["symbols"]): r for r in baseline["results"]}
+    for r in results:
+        before = previous.get((r["scenario"], r["symbols"]))
+        if before is None or "error" in r or "error" in before:
+            continue
+        print("{:<48} {:>6} wall x{:.2f} memory x{:.2f}".format(
+            r["scenario"], r["symbols"],
+            r["wall_seconds"] / max(before["wall_seconds"], 1e-9),
+            r["peak_memory_bytes"] / float(max(before["peak_memory_bytes"], 1)),
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tradealgo.bench", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument("--only", help="only run scenarios containing this text")
+    parser.add_argument("--algo-dir", default=ALGO_DIR)
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    args = parser.parse_args(argv)
+
+    for name, value in ALGO_ENV.items():
+        os.environ.setdefault(name, value)
+
+    scenarios = [s for s in SCENARIOS if not args.only or args.only in s.name]
+    sizes = [int(size) for size in args.sizes.split(",")]
+    with logbook.NullHandler(level=logbook.INFO).applicationbound():
+        results = run(sizes, scenarios, args.algo_dir)
+
+    for r in results:
+        if "error" in r:
+            print("{:<48} {:>6} skipped ({})".format(r["scenario"], r["symbols"], r["error"]))
+        else:
+            print("{:<48} {:>6} {:>9.4f}s {:>9.1f}KiB {}".format(
+                r["scenario"], r["symbols"], r["wall_seconds"],
+                r["peak_memory_bytes"] / 1024.0, sum(r["api_calls"].values()),
+            ))
+
+    commit = git_commit()
+    output = args.output or os.path.join(BENCH_DIR, "{}.json".format(commit))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "results": results,
+        }, f, indent=2)
+    print("results written to {}".format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
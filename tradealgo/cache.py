@@ -0,0 +1,184 @@
+"""TTL cache for slow-changing reference data (Polygon financials, dividends, ...).
+
+Entries are stored on disk under ``tmp/cache`` or, when ``USE_REDIS=1``, in the
+Redis instance pointed to by ``REDIS_URL``, so they survive restarts.
+"""
+import json
+import os
+import threading
+import time
+
+import logbook
+
+log = logbook.Logger("tradealgo")
+
+DAY = 24 * 60 * 60
+CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join("tmp", "cache"))
+
+MISSING = object()
+
+
+class FileBackend(object):
+    """Stores one JSON file per key below ``root``."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key)) as f:
+                expires_at, value = json.load(f)
+        except (OSError, ValueError):
+            return MISSING
+
+        if expires_at < time.time():
+            return MISSING
+        return value
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so a crash never leaves a half written entry
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(tmp_path, "w") as f:
+            json.dump([time.time() + ttl, value], f)
+        os.replace(tmp_path, path)
+
+    def evict(self, max_entries):
+        entries = []
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".json"):
+                    path = os.path.join(dirpath, filename)
+                    entries.append((os.path.getmtime(path), path))
+
+        excess = len(entries) - max_entries
+        if excess <= 0:
+            return 0
+
+        for _mtime, path in sorted(entries)[:excess]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return excess
+
+
+class RedisBackend(object):
+    """Stores one Redis key per entry plus a sorted set used for eviction."""
+
+    def __init__(self, namespace, client=None):
+        if client is None:
+            import redis
+
+            client = redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379"))
+
+        self.client = client
+        self.prefix = "tradealgo:cache:{}:".format(namespace)
+        self.index = self.prefix + "__index__"
+
+    def get(self, key):
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+
+        raw_values = self.client.mget([self.prefix + key for key in keys])
+        return [MISSING if raw is None else json.loads(raw) for raw in raw_values]
+
+    def set(self, key, value, ttl):
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, json.dumps(value), ex=int(ttl))
+        pipe.zadd(self.index, {key: time.time()})
+        pipe.execute()
+
+    def evict(self, max_entries):
+        excess = self.client.zcard(self.index) - max_entries
+        if excess <= 0:
+            return 0
+
+        oldest = [key.decode() if isinstance(key, bytes) else key
+                  for key in self.client.zrange(self.index, 0, excess - 1)]
+        pipe = self.client.pipeline()
+        pipe.delete(*[self.prefix + key for key in oldest])
+        pipe.zrem(self.index, *oldest)
+        pipe.execute()
+        return excess
+
+
+def default_backend(namespace):
+    if os.environ.get("USE_REDIS") == "1":
+        return RedisBackend(namespace)
+    return FileBackend(os.path.join(CACHE_DIR, namespace))
+
+
+class TTLCache(object):
+    """Caches values keyed by ``(endpoint, symbol)`` with a TTL per endpoint.
+
+    ``ttls`` maps endpoint names to a TTL in seconds. Once more than
+    ``max_entries`` entries are stored the oldest ones are evicted.
+    """
+
+    def __init__(self, namespace, ttls, max_entries=5000, backend=None):
+        self.namespace = namespace
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.backend = backend or default_backend(namespace)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, endpoint, symbol):
+        return "{}/{}".format(endpoint, symbol)
+
+    def fetch(self, endpoint, symbols, fetch_fn):
+        """Returns ``{symbol: value}`` for ``symbols``.
+
+        ``fetch_fn`` is called once with the list of symbols that are not cached
+        (or have expired) and must return a ``{symbol: value}`` dict for them.
+        """
+        symbols = list(symbols)
+        cached = self.backend.get_many([self._key(endpoint, symbol) for symbol in symbols])
+
+        results = {}
+        missing = []
+        for symbol, value in zip(symbols, cached):
+            if value is MISSING:
+                missing.append(symbol)
+            else:
+                results[symbol] = value
+
+        with self._lock:
+            self.hits += len(results)
+            self.misses += len(missing)
+
+        if missing:
+            ttl = self.ttls[endpoint]
+            for symbol, value in fetch_fn(missing).items():
+                self.backend.set(self._key(endpoint, symbol), value, ttl)
+                results[symbol] = value
+            self.backend.evict(self.max_entries)
+
+        log.info(
+            "{} cache {}: {} hits, {} misses".format(
+                self.namespace, endpoint, len(symbols) - len(missing), len(missing)
+            )
+        )
+        return results
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / total if total else 0.0,
+            }
@@ -0,0 +1,121 @@
+"""Pipeline factors that extend their windows by one bar a day.
+
+``IncrementalSMA`` and ``IncrementalDollarVolume`` give the same values as
+``SimpleMovingAverage`` and ``AverageDollarVolume`` but only ask the
+pipeline for the latest bar. The full window lives in a ``RollingWindows``
+store and is fetched from IEX only for symbols the store has not seen on
+the previous session. Factors over the same series share one store, sized
+to the longest of their windows, so a cold start fetches every symbol's
+history once.
+"""
+import threading
+
+import pandas as pd
+from pipeline_live.data.iex.pricing import USEquityPricing
+from pipeline_live.data.sources import iex
+from zipline.pipeline.factors import CustomFactor
+
+from tradealgo.rolling import RollingWindows
+
+# Shortest IEX chart range holding at least that many daily bars
+CHART_RANGES = ((15, "1m"), (55, "3m"), (110, "6m"), (220, "1y"))
+
+_windows = {}
+_lengths = {}
+_lock = threading.Lock()
+
+
+def register_window(name, bars):
+    """Makes the store of ``name`` keep sums over ``bars`` values, see ``rolling_windows``."""
+    with _lock:
+        lengths = _lengths.setdefault(name, set())
+        if bars not in lengths:
+            lengths.add(bars)
+            # Reopened with the new window on next use, its bars are saved on every update
+            _windows.pop(name, None)
+
+
+def rolling_windows(name):
+    """The process wide store of ``name``, as long as the longest window registered for it."""
+    with _lock:
+        windows = _windows.get(name)
+        if windows is None:
+            lengths = sorted(_lengths[name])
+            windows = _windows[name] = RollingWindows(name, lengths[-1], lengths)
+        return windows
+
+
+def sessions(today):
+    """The session whose bar the pipeline shows ``today`` and the one before it."""
+    from trading_calendars import get_calendar
+
+    today = pd.Timestamp(today).normalize()
+    if today.tz is None:
+        today = today.tz_localize("UTC")
+    labels = get_calendar("NYSE").all_sessions
+    i = labels.searchsorted(today)
+    return labels[i - 1], labels[i - 2]
+
+
+def iex_history(value):
+    """History source for ``RollingWindows`` built from IEX daily charts.
+
+    ``value`` maps a symbol's chart DataFrame to the series to store.
+    """
+    def history(symbols, bars):
+        chart_range = next((name for most, name in CHART_RANGES if bars <= most), "5y")
+        charts = iex._get_stockprices(symbols, chart_range)
+        return pd.DataFrame({
+            symbol: value(chart) for symbol, chart in charts.items() if len(chart)
+        }).tail(bars)
+
+    return history
+
+
+def close(chart):
+    return chart["close"]
+
+
+def dollar_volume(chart):
+    return chart["close"] * chart["volume"]
+
+
+class IncrementalSMA(CustomFactor):
+    """``SimpleMovingAverage`` of closes over ``bars`` sessions."""
+
+    inputs = [USEquityPricing.close]
+    window_length = 1
+    params = {"bars": 20}
+
+    def _init(self, *args, **kwargs):
+        # Registered when the pipeline is built, before any compute opens the store
+        term = super(IncrementalSMA, self)._init(*args, **kwargs)
+        register_window("close", self.params["bars"])
+        return term
+
+    def compute(self, today, assets, out, close_, bars):
+        windows = rolling_windows("close")
+        session, previous = sessions(today)
+        windows.update(session, previous, assets, close_[-1], iex_history(close))
+        out[:] = windows.mean(assets, bars)
+
+
+class IncrementalDollarVolume(CustomFactor):
+    """``AverageDollarVolume`` over ``bars`` sessions."""
+
+    inputs = [USEquityPricing.close, USEquityPricing.volume]
+    window_length = 1
+    params = {"bars": 20}
+
+    def _init(self, *args, **kwargs):
+        term = super(IncrementalDollarVolume, self)._init(*args, **kwargs)
+        register_window("dollar_volume", self.params["bars"])
+        return term
+
+    def compute(self, today, assets, out, close_, volume, bars):
+        windows = rolling_windows("dollar_volume")
+        session, previous = sessions(today)
+        windows.update(session, previous, assets, close_[-1] * volume[-1],
+                       iex_history(dollar_volume))
+        # Like AverageDollarVolume, missing bars count as zero
+        out[:] = windows.sum(assets, bars) / float(bars)
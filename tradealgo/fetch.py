@@ -0,0 +1,162 @@
+"""Rate limited, retrying HTTP fetches run concurrently on asyncio.
+
+``Fetcher`` sends the requests of a batch concurrently over one keep-alive
+``requests.Session``. A token bucket paces the requests and a shared thread
+pool caps how many are in flight, across every batch running at the time.
+Failed requests (429, 5xx, connection errors) are retried with jittered
+exponential backoff, honoring ``Retry-After``. ``get_many`` is the
+synchronous entry point for callers like pipeline factors.
+"""
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+import logbook
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logbook.Logger("tradealgo")
+
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class TokenBucket(object):
+    """Allows ``rate`` requests per second with bursts of up to ``capacity``.
+
+    ``reserve`` takes a token and returns how long to wait before using it,
+    going into debt when the bucket is empty so callers queue up in order.
+    ``take`` only takes a token that is there, for callers turning requests
+    away instead.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def take(self):
+        """Takes a token if one is left, otherwise returns how long until one is."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+def retry_after(response):
+    """Seconds the server asked us to wait, None when it didn't say."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Fetcher(object):
+    """GETs JSON from ``base_url`` with pacing, a concurrency cap and retries.
+
+    ``params`` are sent with every request (e.g. an API key). ``rate`` and
+    ``burst`` configure the token bucket, ``concurrency`` the number of
+    requests in flight.
+    """
+
+    def __init__(self, base_url, params=None, rate=20, burst=None, concurrency=10,
+                 retries=5, backoff=0.5, max_backoff=30, timeout=10):
+        self.base_url = base_url.rstrip("/")
+        self.params = dict(params or {})
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _request(self, path, params):
+        query = dict(self.params)
+        query.update(params or {})
+        return self.session.get(self.base_url + path, params=query, timeout=self.timeout)
+
+    def _delay(self, attempt):
+        # Full jitter keeps retrying clients from hitting the server in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def get(self, path, params=None):
+        """Decoded JSON of ``path``, raising once the retries are used up."""
+        loop = asyncio.get_event_loop()
+        for attempt in range(self.retries + 1):
+            wait = self.bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+
+            try:
+                response = await loop.run_in_executor(
+                    self._executor, self._request, path, params
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self._delay(attempt)
+                log.info("{} failed ({}), retrying in {:.2f}s".format(path, e, delay))
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                response.raise_for_status()
+                return response.json()
+
+            delay = retry_after(response)
+            if delay is None:
+                delay = self._delay(attempt)
+            log.info("{} returned {}, retrying in {:.2f}s".format(
+                path, response.status_code, delay))
+            await asyncio.sleep(delay)
+
+    async def get_all(self, requests_by_key):
+        keys = list(requests_by_key)
+        # Let every request finish before raising so none is left running on a closed loop
+        results = await asyncio.gather(
+            *[self.get(*requests_by_key[key]) for key in keys], return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return dict(zip(keys, results))
+
+    def get_many(self, requests_by_key):
+        """Runs ``{key: (path, params)}`` requests concurrently, returns ``{key: json}``.
+
+        Safe to call from any thread that is not already running an event loop.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.get_all(requests_by_key))
+        finally:
+            loop.close()
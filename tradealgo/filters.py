@@ -0,0 +1,49 @@
+"""Pipeline filters computed from precomputed data instead of loaded columns."""
+import numpy as np
+from zipline.pipeline.filters import CustomFilter
+
+from tradealgo.universe import universe_index
+
+
+class TradeableUniverse(CustomFilter):
+    """Symbols that passed the classification filters of ``tradealgo.universe``.
+
+    Equivalent to ``IsPrimaryShareEmulation()``, common stock, not OTC, not
+    when-issued, no LP name and a known market cap, read from the session's
+    universe index.
+    """
+
+    inputs = ()
+    window_length = 1
+
+    def compute(self, today, assets, out, *inputs):
+        out[:] = universe_index(today).contains(assets)
+
+
+class StaticSymbols(CustomFilter):
+    """True for the assets in the fixed ``symbols`` tuple.
+
+    The mask is built with one ``np.isin`` and reused while the pipeline's
+    asset domain stays the same.
+    """
+
+    inputs = ()
+    window_length = 1
+    params = ("symbols",)
+
+    def compute(self, today, assets, out, symbols, *inputs):
+        out[:] = static_mask(symbols, assets)
+
+
+_static_masks = {}
+
+
+def static_mask(symbols, assets):
+    """``np.isin(assets, symbols)``, cached for the latest asset domain of ``symbols``."""
+    fingerprint = hash(tuple(assets))
+    cached = _static_masks.get(symbols)
+    if cached is None or cached[0] != fingerprint:
+        wanted = np.array(sorted(set(symbols)), dtype=str)
+        mask = np.isin(np.asarray(assets, dtype=str), wanted, assume_unique=True)
+        cached = _static_masks[symbols] = (fingerprint, mask)
+    return cached[1]
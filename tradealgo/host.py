@@ -0,0 +1,263 @@
+"""Runs several algos in one process.
+
+    python -m tradealgo.host [--storage-engine file|redis|journal] long_only_non_day_trade.py ...
+
+Every algo gets its own pylivetrader ``Algorithm``, and with it its own
+context, state file and thread. The pylivetrader API resolves the running
+algorithm per thread, so scheduled functions only see their own algo. The
+algos share one interpreter and one HTTP connection pool. They also share
+the bars fetched from Alpaca: the first algo asking for a symbol's bars in
+a given minute fetches them and the others reuse that result.
+
+``--storage-engine journal`` keeps each algo's state in a
+``tradealgo.state.JournalStore`` (``tmp/state/<algo>.state``) and
+``--storage-engine redis`` in a ``tradealgo.state.RedisStateStore``, both of
+which only write the attributes that changed. ``file`` is pylivetrader's
+whole-file pickle.
+
+``--prewarm`` imports the algos' pipeline modules and loads their symbol
+lists on a background thread while the algos log in to the broker, see
+``tradealgo.prewarm``. Either way the time from process start until each
+algo is initialized, and so ready to run its first scheduled function, is
+logged. An algo not initialized within ``READY_TIMEOUT`` seconds stops the
+process.
+
+``--instrument`` records the latency of the algos' broker and data calls
+per callback, see ``tradealgo.instrument``.
+
+``--standin URL`` sends the Alpaca, Polygon and IEX requests to a
+``tradealgo.standin`` server instead, for load tests against recorded data.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import logbook
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from tradealgo.instrument import METRICS_PATH, Metrics, instrument, instrument_polygon
+from tradealgo.prewarm import Prewarm, pipeline_modules, process_uptime
+from tradealgo.singleflight import RequestCoalescer
+from tradealgo.standin import redirect
+from tradealgo.state import JournalStore, RedisStateStore
+
+log = logbook.Logger("tradealgo")
+
+ALGO_DIR = "algo"
+STATE_DIR = os.path.join("tmp", "state")
+# Seconds an algo may take from start until its initialize ran
+READY_TIMEOUT = 300
+
+
+class SharedBars(object):
+    """Bars fetched by any hosted algo during the current minute.
+
+    Wraps the Alpaca backends' ``_symbol_bars(symbols, size, limit=...)``,
+    which every ``data.history`` and ``data.current`` call goes through.
+    Lookups are shared per bar size and limit; calls with an explicit time
+    range are passed through.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._coalescers = {}
+        self.requested = 0
+        self.fetched = 0
+
+    def wrap(self, symbol_bars):
+        def shared_symbol_bars(symbols, size, _from=None, to=None, limit=None):
+            if _from is not None or to is not None:
+                return symbol_bars(symbols, size, _from=_from, to=to, limit=limit)
+            return self.fetch(symbols, size, limit, symbol_bars)
+
+        return shared_symbol_bars
+
+    def fetch(self, symbols, size, limit, symbol_bars):
+        with self._lock:
+            coalescer = self._coalescers.get((size, limit))
+            if coalescer is None:
+                coalescer = self._coalescers[(size, limit)] = RequestCoalescer()
+            self.requested += len(symbols)
+
+        def fetch_missing(missing):
+            with self._lock:
+                self.fetched += len(missing)
+            return symbol_bars(missing, size, limit=limit)
+
+        minute = pd.Timestamp.utcnow().floor("1min")
+        bars = coalescer.fetch(minute, symbols, fetch_missing)
+        # Every algo gets its own copy, the backend adjusts the frames it is handed
+        return {symbol: None if bars[symbol] is None else bars[symbol].copy()
+                for symbol in symbols}
+
+
+def shared_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class Host(object):
+    """Loads the algos and runs each one in its own thread."""
+
+    def __init__(self, algofiles, storage_engine="file", state_dir=STATE_DIR, prewarm=False,
+                 metrics=None, ready_timeout=READY_TIMEOUT):
+        self.algofiles = algofiles
+        self.storage_engine = storage_engine
+        self.state_dir = state_dir
+        self.prewarm = prewarm
+        self.metrics = metrics
+        self.ready_timeout = ready_timeout
+        self.bars = SharedBars()
+        self.session = shared_session(pool_size=10 * len(algofiles))
+        self.failed = threading.Event()
+        self.ready = {}
+
+    def load(self, algofile):
+        from pylivetrader.algorithm import Algorithm
+        from pylivetrader.loader import get_algomodule_by_path, get_api_functions, noop
+
+        name = os.path.basename(algofile)
+        algoname = os.path.splitext(name)[0]
+        journal = self.storage_engine == "journal"
+        statefile = os.path.join(self.state_dir, name + (".state" if journal else ".pkl"))
+
+        # Like `pylivetrader run`, Algorithm ignores the keyword arguments it doesn't know
+        module = get_algomodule_by_path(algofile)
+        functions = get_api_functions(module)
+        if functions["initialize"] is noop:
+            raise ValueError("{} defines no initialize".format(algofile))
+        algorithm = Algorithm(
+            # The name is also the state's checksum, `pylivetrader run` drops the extension
+            algoname=algoname,
+            backend="alpaca",
+            statefile=statefile,
+            storage_engine="file",
+            **functions
+        )
+
+        # pylivetrader's own stores write the whole context on every save
+        if journal:
+            algorithm._state_store = JournalStore(statefile)
+        elif self.storage_engine == "redis":
+            algorithm._state_store = RedisStateStore(algoname)
+        self.share(algorithm._backend)
+        if self.metrics is not None:
+            instrument(algorithm, name, self.metrics, module)
+        self.time_initialize(name, algorithm)
+        return algorithm
+
+    def time_initialize(self, name, algorithm):
+        initialize = algorithm.initialize
+        ready = self.ready[name] = threading.Event()
+
+        def timed_initialize(*args, **kwargs):
+            result = initialize(*args, **kwargs)
+            ready.set()
+            log.info("{} ready {:.2f}s after process start".format(name, process_uptime()))
+            return result
+
+        algorithm.initialize = timed_initialize
+
+    def share(self, backend):
+        api = backend._api
+        for client in (api, getattr(api, "polygon", None)):
+            if client is not None and hasattr(client, "_session"):
+                client._session = self.session
+        backend._symbol_bars = self.bars.wrap(backend._symbol_bars)
+
+    def run_algo(self, name, algorithm):
+        from pylivetrader.misc.api_context import LiveTraderAPI
+
+        def tag(record):
+            record.channel = "{}:{}".format(name, record.channel)
+
+        with logbook.Processor(tag).threadbound():
+            try:
+                # The pylivetrader API calls the algorithm of the running thread
+                with LiveTraderAPI(algorithm):
+                    algorithm.run()
+            except Exception:
+                log.exception("{} stopped".format(name))
+                self.failed.set()
+
+    def check_ready(self):
+        """Stops the process if an algo's initialize didn't run within ``ready_timeout``.
+
+        Such an algo never trades, e.g. because its functions didn't reach the
+        ``Algorithm``.
+        """
+        deadline = time.monotonic() + self.ready_timeout
+        for name, ready in self.ready.items():
+            if not ready.wait(max(0, deadline - time.monotonic())):
+                log.error("{} not initialized {:.0f}s after start".format(
+                    name, self.ready_timeout))
+                self.failed.set()
+                return
+
+    def run(self):
+        if self.prewarm:
+            Prewarm(pipeline_modules(self.algofiles)).start()
+        if self.metrics is not None:
+            instrument_polygon(self.metrics)
+            self.metrics.start()
+
+        algorithms = [(os.path.basename(path), self.load(path)) for path in self.algofiles]
+        for name, algorithm in algorithms:
+            thread = threading.Thread(target=self.run_algo, args=(name, algorithm), name=name)
+            thread.daemon = True
+            thread.start()
+            log.info("started {}".format(name))
+
+        watcher = threading.Thread(target=self.check_ready, name="ready")
+        watcher.daemon = True
+        watcher.start()
+
+        # One algo stopping takes the process down so the dyno restarts all of them
+        self.failed.wait()
+        log.info("shared bars: {} symbol lookups, {} fetched".format(
+            self.bars.requested, self.bars.fetched))
+        if self.metrics is not None:
+            self.metrics.stop()
+        return 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tradealgo.host", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("algos", nargs="+", help="algo files, relative to --algo-dir")
+    parser.add_argument("--algo-dir", default=ALGO_DIR)
+    parser.add_argument("--storage-engine", choices=("file", "redis", "journal"), default="file")
+    parser.add_argument("--state-dir", default=STATE_DIR)
+    parser.add_argument("--prewarm", action="store_true",
+                        help="import pipeline modules while the algos log in")
+    parser.add_argument("--instrument", action="store_true",
+                        help="record API call latencies to --metrics-path")
+    parser.add_argument("--metrics-path", default=METRICS_PATH)
+    parser.add_argument("--metrics-interval", type=float, default=60,
+                        help="seconds between metrics writes and summary log lines")
+    parser.add_argument("--standin", metavar="URL",
+                        help="send the API requests to a tradealgo.standin server at URL")
+    args = parser.parse_args(argv)
+
+    logbook.StreamHandler(sys.stdout, level=logbook.INFO).push_application()
+    if args.standin:
+        redirect(args.standin)
+    host = Host(
+        [os.path.join(args.algo_dir, algo) for algo in args.algos],
+        storage_engine=args.storage_engine,
+        state_dir=args.state_dir,
+        prewarm=args.prewarm,
+        metrics=Metrics(args.metrics_path, args.metrics_interval) if args.instrument else None,
+    )
+    return host.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
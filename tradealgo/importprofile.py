@@ -0,0 +1,120 @@
+"""Profiles how long importing each algo module takes.
+
+    python -m tradealgo.importprofile [--top 15] [algo/*.py]
+
+Every algo is loaded in a fresh interpreter, the way pylivetrader loads it,
+with ``__import__`` timed. The report lists the total load time and the
+modules that took the longest, cumulative (including the modules they
+import) and self (excluding them).
+"""
+import argparse
+import builtins
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+ALGO_DIR = "algo"
+
+
+class ImportTimer(object):
+    """Times first imports by wrapping ``builtins.__import__``."""
+
+    def __init__(self):
+        self.cumulative = {}
+        self.own = {}
+        self._stack = []
+        self._import = builtins.__import__
+
+    def __enter__(self):
+        builtins.__import__ = self._timed_import
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.__import__ = self._import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+
+        self._stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            children = self._stack.pop()
+            self.cumulative[name] = self.cumulative.get(name, 0.0) + elapsed
+            self.own[name] = self.own.get(name, 0.0) + elapsed - children
+            if self._stack:
+                self._stack[-1] += elapsed
+
+
+def profile(algofile):
+    """Loads ``algofile`` like pylivetrader does and returns the timings."""
+    with open(algofile) as f:
+        code = compile(f.read(), algofile, "exec")
+
+    error = None
+    with ImportTimer() as timer:
+        started = time.perf_counter()
+        try:
+            exec(code, {"__name__": "algo", "__file__": algofile})
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        total = time.perf_counter() - started
+
+    return {
+        "algo": algofile,
+        "seconds": total,
+        "error": error,
+        "cumulative": timer.cumulative,
+        "self": timer.own,
+    }
+
+
+def profile_in_subprocess(algofile):
+    output = subprocess.check_output(
+        [sys.executable, "-m", "tradealgo.importprofile", "--child", algofile]
+    )
+    return json.loads(output.decode())
+
+
+def report(result, top):
+    line = "{}: {:.3f}s".format(result["algo"], result["seconds"])
+    if result["error"]:
+        line += " (stopped by {})".format(result["error"])
+    print(line)
+
+    slowest = sorted(result["cumulative"].items(), key=lambda item: -item[1])[:top]
+    for name, seconds in slowest:
+        print("  {:>8.3f}s {:>8.3f}s self  {}".format(seconds, result["self"][name], name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tradealgo.importprofile", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("algos", nargs="*")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="also write the timings to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        json.dump(profile(args.child), sys.stdout)
+        return
+
+    algos = args.algos or sorted(glob.glob(os.path.join(ALGO_DIR, "*.py")))
+    results = [profile_in_subprocess(algo) for algo in algos]
+    for result in results:
+        report(result, args.top)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Opt-in latency metrics for the broker and data calls the algos make.
+
+``instrument(algorithm, name, metrics)`` wraps a pylivetrader ``Algorithm``:
+
+* the order, open order and pipeline API methods the algos call,
+* ``data.current``, ``data.history`` and ``data.can_trade``, through the
+  ``data`` handed to every callback,
+* every callback itself: ``initialize``, ``before_trading_start``,
+  ``handle_data``, each function passed to ``schedule_function`` and,
+  given the algo's module ``namespace``, each function its
+  ``IntervalSchedule`` instances run from ``handle_data``.
+
+``instrument_polygon(metrics)`` does the same for ``api.polygon.get`` and
+``tradealgo.fetch.Fetcher.get``, which pipeline data sources call from
+anywhere. Calls are labeled with the algo and the callback running on the
+thread, ``-`` outside of one.
+
+``Metrics`` keeps a latency histogram, a call count and an error count per
+algo, callback and function. ``Metrics.start`` writes them every
+``interval`` seconds to a Prometheus text file (``tmp/metrics/tradealgo.prom``
+by default, for node_exporter's textfile collector or plain reading) and
+logs the functions that took the most time.
+"""
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import logbook
+
+from tradealgo.schedule import IntervalSchedule
+
+log = logbook.Logger("tradealgo")
+
+METRICS_PATH = os.path.join("tmp", "metrics", "tradealgo.prom")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+API_METHODS = (
+    "order", "order_value", "order_percent", "order_target", "order_target_value",
+    "order_target_percent", "cancel_order", "get_open_orders", "get_order",
+    "pipeline_output",
+)
+DATA_METHODS = ("current", "history", "can_trade")
+
+# Algo and callback running on this thread, for calls made outside the wrapped API
+_running = threading.local()
+
+
+def running():
+    return getattr(_running, "algo", "-"), getattr(_running, "callback", "-")
+
+
+class Histogram(object):
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+
+    def observe(self, seconds, error):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+
+class Metrics(object):
+    """Histograms keyed by ``(metric, algo, callback, function)``."""
+
+    def __init__(self, path=METRICS_PATH, interval=60, top=5):
+        self.path = path
+        self.interval = interval
+        self.top = top
+        self._histograms = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def observe(self, metric, algo, callback, function, seconds, error=False):
+        key = (metric, algo, callback, function)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds, error)
+
+    def timed(self, function, func, algo=None):
+        """Wraps ``func`` to record its calls as ``function``."""
+        @functools.wraps(func)
+        def timed_call(*args, **kwargs):
+            running_algo, callback = running()
+            error = False
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                self.observe("call", algo or running_algo, callback, function,
+                             time.perf_counter() - started, error)
+
+        return timed_call
+
+    def callback(self, algo, func, wrap_data):
+        """Wraps a ``func(context, data)`` callback to label and time what it calls."""
+        name = getattr(func, "__name__", repr(func))
+
+        @functools.wraps(func)
+        def timed_callback(context, data, *args, **kwargs):
+            previous = running()
+            _running.algo, _running.callback = algo, name
+            error = False
+            started = time.perf_counter()
+            try:
+                return func(context, wrap_data(data), *args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                self.observe("callback", algo, name, name, time.perf_counter() - started, error)
+                _running.algo, _running.callback = previous
+
+        return timed_callback
+
+    def render(self):
+        """The metrics in the Prometheus text format."""
+        with self._lock:
+            items = [(key, list(h.buckets), h.count, h.sum, h.errors)
+                     for key, h in self._histograms.items()]
+
+        lines = []
+        for metric, help_text in (("call", "broker and data API calls"),
+                                  ("callback", "algo callbacks")):
+            name = "tradealgo_{}_seconds".format(metric)
+            lines.append("# HELP {} Latency of {}.".format(name, help_text))
+            lines.append("# TYPE {} histogram".format(name))
+            for (kind, algo, callback, function), buckets, count, total, _ in items:
+                if kind != metric:
+                    continue
+                labels = 'algo="{}",callback="{}",function="{}"'.format(algo, callback, function)
+                cumulative = 0
+                for bound, in_bucket in zip(BUCKETS, buckets):
+                    cumulative += in_bucket
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound,
+                                                                     cumulative))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, count))
+                lines.append("{}_sum{{{}}} {:.6f}".format(name, labels, total))
+                lines.append("{}_count{{{}}} {}".format(name, labels, count))
+
+            errors = "tradealgo_{}_errors_total".format(metric)
+            lines.append("# HELP {} Failed {}.".format(errors, help_text))
+            lines.append("# TYPE {} counter".format(errors))
+            for (kind, algo, callback, function), _, _, _, failed in items:
+                if kind == metric:
+                    lines.append('{}{{algo="{}",callback="{}",function="{}"}} {}'.format(
+                        errors, algo, callback, function, failed))
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(self.path, threading.get_ident())
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        """One line with the calls that took the most time in total."""
+        with self._lock:
+            calls = [(key, histogram.count, histogram.sum, histogram.errors)
+                     for key, histogram in self._histograms.items() if key[0] == "call"]
+        calls.sort(key=lambda call: -call[2])
+        return "slowest calls: " + ", ".join(
+            "{}/{}/{} {}x {:.2f}s ({:.0f}ms avg, {} errors)".format(
+                algo, callback, function, count, total, 1000 * total / count, errors)
+            for (_, algo, callback, function), count, total, errors in calls[:self.top]
+        )
+
+    def start(self):
+        thread = threading.Thread(target=self._report, name="metrics")
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._flush()
+
+    def _report(self):
+        while not self._stopped.wait(self.interval):
+            self._flush()
+
+    def _flush(self):
+        try:
+            self.write()
+        except OSError as e:
+            log.warning("could not write {} ({})".format(self.path, e))
+        if self._histograms:
+            log.info(self.summary())
+
+
+class InstrumentedData(object):
+    """A callback's ``data`` with its lookups timed."""
+
+    def __init__(self, data, metrics, algo):
+        self._data = data
+        for name in DATA_METHODS:
+            method = getattr(data, name, None)
+            if method is not None:
+                setattr(self, name, metrics.timed("data." + name, method, algo))
+
+    def __getattr__(self, name):
+        return getattr(self._data, name)
+
+
+def instrument(algorithm, name, metrics, namespace=None):
+    """Times the API calls and callbacks of a pylivetrader ``algorithm`` named ``name``.
+
+    pylivetrader's API functions call the running algorithm's methods, so
+    overriding them on the instance covers the algo's calls.
+    """
+    for method in API_METHODS:
+        if hasattr(algorithm, method):
+            setattr(algorithm, method, metrics.timed(method, getattr(algorithm, method), name))
+
+    def wrap_data(data):
+        if data is None or isinstance(data, InstrumentedData):
+            return data
+        return InstrumentedData(data, metrics, name)
+
+    schedule_function = algorithm.schedule_function
+
+    @functools.wraps(schedule_function)
+    def instrumented_schedule_function(func, *args, **kwargs):
+        return schedule_function(metrics.callback(name, func, wrap_data), *args, **kwargs)
+
+    algorithm.schedule_function = instrumented_schedule_function
+
+    for attribute in ("_before_trading_start", "_handle_data"):
+        func = getattr(algorithm, attribute, None)
+        if func is not None:
+            setattr(algorithm, attribute, metrics.callback(name, func, wrap_data))
+
+    # Otherwise a rebalance run by handle_data would be labeled handle_data
+    for value in (namespace or {}).values():
+        if isinstance(value, IntervalSchedule):
+            value.func = metrics.callback(name, value.func, wrap_data)
+
+    # initialize takes only the context
+    initialize = algorithm._initialize
+
+    def initialize_callback(context, data, *args, **kwargs):
+        return initialize(context, *args, **kwargs)
+
+    initialize_callback.__name__ = "initialize"
+    timed_initialize = metrics.callback(name, initialize_callback, wrap_data)
+    algorithm._initialize = lambda context, *args, **kwargs: timed_initialize(
+        context, None, *args, **kwargs)
+
+
+def instrument_polygon(metrics):
+    """Times ``api.polygon.get`` and ``Fetcher.get`` process wide."""
+    from tradealgo.fetch import Fetcher
+
+    get = Fetcher.get
+
+    @functools.wraps(get)
+    async def timed_get(self, path, params=None):
+        algo, callback = running()
+        error = False
+        started = time.perf_counter()
+        try:
+            return await get(self, path, params)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe("call", algo, callback, "polygon.fetch",
+                            time.perf_counter() - started, error)
+
+    Fetcher.get = timed_get
+
+    try:
+        from alpaca_trade_api.polygon import REST
+    except ImportError:
+        # alpaca-trade-api 1.0 dropped the Polygon client
+        return
+    REST.get = metrics.timed("polygon.get", REST.get)
@@ -0,0 +1,92 @@
+"""Market state that algos keep on their context between runs."""
+import math
+from collections import deque
+
+import pandas as pd
+
+
+class RunningSMA(object):
+    """Simple moving average of the last ``span`` daily closes.
+
+    ``update`` takes a few recent daily bars and only folds in the new ones.
+    The newest bar is kept provisional, a later update with a bar of the same
+    day replaces it, so a bar fetched while the session is still trading
+    gets corrected.
+    """
+
+    def __init__(self, span):
+        self.span = span
+        self.closes = deque(maxlen=span)
+        self.total = 0.0
+        self.last_date = None
+        self.appended = 0
+
+    def __len__(self):
+        return len(self.closes)
+
+    def covers(self, bars):
+        """Whether ``bars`` (a Series of daily closes) continues what was seen."""
+        return self.last_date is not None and len(bars) > 0 \
+            and pd.Timestamp(bars.index[0]) <= self.last_date
+
+    def update(self, bars):
+        for date, close in bars.items():
+            date = pd.Timestamp(date)
+            if math.isnan(close) or (self.last_date is not None and date < self.last_date):
+                continue
+
+            if date == self.last_date:
+                self.total += close - self.closes[-1]
+                self.closes[-1] = close
+                continue
+
+            if len(self.closes) == self.span:
+                self.total -= self.closes[0]
+            self.closes.append(close)
+            self.total += close
+            self.last_date = date
+
+            # Re-add the window now and then, the running total drifts by float rounding
+            self.appended += 1
+            if self.appended % self.span == 0:
+                self.total = float(sum(self.closes))
+
+    @property
+    def value(self):
+        if len(self.closes) < self.span:
+            return float("nan")
+        return self.total / self.span
+
+    @property
+    def last_close(self):
+        return self.closes[-1] if self.closes else float("nan")
+
+
+class MarketState(object):
+    """Running SMA of a market index plus the last known trade price of each asset.
+
+    ``last_prices`` maps symbols to the last non-NaN price seen for them, so
+    sparsely traded assets have a price to fall back on when
+    ``data.current`` has none.
+    """
+
+    def __init__(self, span):
+        self.sma = RunningSMA(span)
+        self.last_prices = {}
+
+    def update_index(self, data, asset):
+        """Adds the newest daily bars of ``asset``, rebuilding the SMA on a cold start or gap."""
+        bars = data.history(asset, "price", bar_count=2, frequency="1d")
+        if not self.sma.covers(bars):
+            self.sma = RunningSMA(self.sma.span)
+            bars = data.history(asset, "price", bar_count=self.sma.span, frequency="1d")
+        self.sma.update(bars)
+
+    def remember(self, prices):
+        """Keeps the non-NaN prices of a ``{asset: price}`` mapping or Series."""
+        for asset, price in prices.items():
+            if not math.isnan(price):
+                self.last_prices[asset.symbol] = float(price)
+
+    def last_price(self, asset):
+        return self.last_prices.get(asset.symbol, float("nan"))
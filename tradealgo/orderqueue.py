@@ -0,0 +1,232 @@
+"""Paced, prioritized order submission over a thread pool.
+
+A rebalance places and cancels dozens of orders in a burst, more than the
+broker's per-minute request limit allows. ``OrderQueue`` sends them from a
+few worker threads behind a token bucket sized to that limit. Cancels go
+out before sells and sells before buys. Requests for the same key (the
+asset) run in the order they were submitted, so a buy queued after a
+cancel of the same stock is only sent once the cancel went through.
+
+The pylivetrader API resolves the running algorithm per thread; every task
+runs under the API context of the thread that queued it. Backtests switch
+the queue to ``inline`` mode, which runs every request right away in the
+calling thread, unpaced and without cycle stats.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+import logbook
+
+from tradealgo.fetch import TokenBucket
+from tradealgo.orders import BUY, SELL
+
+log = logbook.Logger("tradealgo")
+
+CANCEL = "cancel"
+PRIORITIES = {CANCEL: 0, SELL: 1, BUY: 2}
+
+# Alpaca allows 200 requests per minute, leave room for the algo's other calls
+RATE_PER_MINUTE = 150
+
+
+def api_context():
+    """Enters the caller's pylivetrader API context in another thread, None without one."""
+    try:
+        from pylivetrader.misc.api_context import LiveTraderAPI, get_context
+    except ImportError:
+        # Not running under pylivetrader, the backtest's API isn't thread bound
+        return None
+    algorithm = get_context()
+    if algorithm is None:
+        return None
+    return lambda: LiveTraderAPI(algorithm)
+
+
+class Ticket(object):
+    """A queued request; ``result()`` waits for it and returns or raises its outcome."""
+
+    def __init__(self, func, args, kwargs, priority, key, context):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.key = key
+        self.context = context
+        self.queued = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.value = None
+        self.error = None
+        self.next = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError("order request still queued")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class Completed(object):
+    """The outcome of a request run inline, with the ``Ticket`` interface."""
+
+    __slots__ = ("value", "error")
+
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    def done(self):
+        return True
+
+    def result(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def resolve(value):
+    """The result of a ``Ticket`` argument, so requests can refer to earlier ones."""
+    return value.result() if isinstance(value, (Ticket, Completed)) else value
+
+
+class CycleStats(object):
+    def __init__(self, tickets, seconds):
+        self.requests = len(tickets)
+        self.failed = sum(1 for ticket in tickets if ticket.error is not None)
+        self.seconds = seconds
+        delays = [ticket.started - ticket.queued for ticket in tickets if ticket.started]
+        self.max_delay = max(delays) if delays else 0.0
+        self.mean_delay = sum(delays) / len(delays) if delays else 0.0
+
+    @property
+    def throughput(self):
+        return self.requests / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return ("{} requests ({} failed) in {:.1f}s, {:.1f}/s, queued {:.1f}s on average, "
+                "{:.1f}s at most").format(self.requests, self.failed, self.seconds,
+                                          self.throughput, self.mean_delay, self.max_delay)
+
+
+class OrderQueue(object):
+    """Sends ``submit``-ted requests at up to ``rate_per_minute`` from ``workers`` threads."""
+
+    def __init__(self, rate_per_minute=RATE_PER_MINUTE, burst=None, workers=4, name="orders"):
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst or workers)
+        self.workers = workers
+        self.name = name
+        self.inline = False
+        self._heap = []
+        self._sequence = itertools.count()
+        self._tails = {}
+        self._cycle = []
+        self._cycle_started = None
+        self._lock = threading.Condition()
+        self._threads = []
+
+    def _start(self):
+        # Started on first use so that loading an algo doesn't spawn threads
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name="{}-{}".format(self.name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        """Queues ``func(*args, **kwargs)`` and returns its ``Ticket``.
+
+        ``kind`` (``CANCEL``, ``SELL`` or ``BUY``, the default) and ``key``
+        are taken from the keyword arguments. Arguments that are tickets are
+        replaced by their results, which waits for them unless they were
+        queued with the same key. In ``inline`` mode the request runs right
+        away and a ``Completed`` is returned; it isn't counted by ``join``.
+        """
+        priority = PRIORITIES[kwargs.pop("kind", BUY)]
+        key = kwargs.pop("key", None)
+        if self.inline:
+            # A backtest submits tens of thousands of requests, skip the lock and the bookkeeping
+            try:
+                return Completed(func(*[resolve(arg) for arg in args], **kwargs))
+            except Exception as e:
+                log.warning("{}: {} failed ({})".format(
+                    self.name, getattr(func, "__name__", func), e))
+                return Completed(error=e)
+
+        ticket = Ticket(func, args, kwargs, priority, key, api_context())
+        with self._lock:
+            if not self._threads:
+                self._start()
+            if self._cycle_started is None:
+                self._cycle_started = time.monotonic()
+            self._cycle.append(ticket)
+
+            tail = self._tails.get(key) if key is not None else None
+            if key is not None:
+                self._tails[key] = ticket
+            if tail is not None and not tail.done():
+                # Released when the previous request for the key finishes
+                tail.next = ticket
+            else:
+                self._push(ticket)
+        return ticket
+
+    def _push(self, ticket):
+        heapq.heappush(self._heap, (ticket.priority, next(self._sequence), ticket))
+        self._lock.notify()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._heap:
+                    self._lock.wait()
+                _, _, ticket = heapq.heappop(self._heap)
+
+            wait = self.bucket.reserve()
+            if wait:
+                time.sleep(wait)
+            self._run(ticket)
+
+            with self._lock:
+                if ticket.next is not None:
+                    self._push(ticket.next)
+                elif self._tails.get(ticket.key) is ticket:
+                    del self._tails[ticket.key]
+                self._lock.notify_all()
+
+    def _run(self, ticket):
+        ticket.started = time.monotonic()
+        try:
+            args = [resolve(arg) for arg in ticket.args]
+            if ticket.context is None:
+                ticket.value = ticket.func(*args, **ticket.kwargs)
+            else:
+                with ticket.context():
+                    ticket.value = ticket.func(*args, **ticket.kwargs)
+        except Exception as e:
+            ticket.error = e
+            log.warning("{}: {} failed ({})".format(
+                self.name, getattr(ticket.func, "__name__", ticket.func), e))
+        ticket.finished = time.monotonic()
+        ticket._done.set()
+
+    def join(self, timeout=None):
+        """Waits for every request queued since the last ``join``, returns ``CycleStats``."""
+        with self._lock:
+            tickets, self._cycle = self._cycle, []
+            started, self._cycle_started = self._cycle_started, None
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for ticket in tickets:
+            ticket._done.wait(None if deadline is None else max(0, deadline - time.monotonic()))
+
+        stats = CycleStats(tickets, time.monotonic() - started if started else 0.0)
+        if tickets:
+            log.info("{}: {}".format(self.name, stats))
+        return stats
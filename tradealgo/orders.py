@@ -0,0 +1,129 @@
+"""In-process view of the account's open orders."""
+from collections import OrderedDict
+
+BUY = "buy"
+SELL = "sell"
+
+
+def side_of(amount):
+    return BUY if amount > 0 else SELL
+
+
+class PendingOrder(object):
+    """Order placed during the current cycle, before the broker lists it."""
+
+    def __init__(self, id, asset, amount, limit=None):
+        self.id = id
+        self.asset = asset
+        self.amount = amount
+        self.filled = 0
+        self.limit = limit
+
+    def __repr__(self):
+        return "PendingOrder(id={!r}, asset={!r}, amount={}, limit={})".format(
+            self.id, self.asset, self.amount, self.limit
+        )
+
+
+class OpenOrderIndex(object):
+    """Open orders keyed by asset and side.
+
+    Built from one ``get_open_orders()`` listing, then kept current locally with
+    ``add`` and ``remove`` as orders are placed and canceled, so the rest of the
+    cycle never has to ask the broker again.
+    """
+
+    def __init__(self, open_orders=None):
+        self._orders = OrderedDict()
+        for asset, orders in (open_orders or {}).items():
+            for o in orders:
+                self._insert(asset, o)
+
+    def _insert(self, asset, o):
+        sides = self._orders.setdefault(asset, {BUY: [], SELL: []})
+        sides[side_of(o.amount)].append(o)
+
+    def add(self, asset, order_id, amount, limit=None):
+        """Records an order placed with ``order()`` and returns it."""
+        o = PendingOrder(order_id, asset, amount, limit)
+        self._insert(asset, o)
+        return o
+
+    def remove(self, o):
+        sides = self._orders.get(o.asset)
+        if not sides:
+            return
+
+        orders = sides[side_of(o.amount)]
+        sides[side_of(o.amount)] = [existing for existing in orders if existing.id != o.id]
+        if not sides[BUY] and not sides[SELL]:
+            del self._orders[o.asset]
+
+    def orders(self, asset=None, side=None):
+        """Returns a list of open orders, optionally limited to an asset and/or side."""
+        if asset is None:
+            groups = self._orders.values()
+        elif asset in self._orders:
+            groups = [self._orders[asset]]
+        else:
+            return []
+
+        sides = (BUY, SELL) if side is None else (side,)
+        return [o for group in groups for s in sides for o in group[s]]
+
+    def assets(self):
+        return list(self._orders)
+
+    def __contains__(self, asset):
+        return asset in self._orders
+
+    def __len__(self):
+        return sum(len(group[BUY]) + len(group[SELL]) for group in self._orders.values())
+
+
+def same_order(o, amount, limit):
+    """Whether the open order ``o`` has ``amount`` left to fill at ``limit``."""
+    if o.amount - (o.filled or 0) != amount:
+        return False
+    if o.limit is None or limit is None:
+        return o.limit is None and limit is None
+    # Limits are on a cent grid, float noise isn't a difference
+    return round(o.limit * 100) == round(limit * 100)
+
+
+def reconcile(book, desired, cancel_unlisted=(BUY,)):
+    """Diffs the ``desired`` orders against the open orders in ``book``.
+
+    ``desired`` maps ``(asset, side)`` to ``(amount, limit)``, or to None
+    (or a zero amount) when that asset should have no open order on that
+    side. A single open order that already matches is kept, anything else
+    on that asset and side is canceled and the desired order created. Open
+    orders whose ``(asset, side)`` isn't in ``desired`` are canceled if
+    their side is in ``cancel_unlisted`` and kept otherwise.
+
+    Returns ``(cancels, creates, kept)``: open orders to cancel,
+    ``(asset, amount, limit)`` orders to place and open orders left alone.
+    """
+    cancels = []
+    creates = []
+    kept = []
+    for asset in book.assets():
+        for side in (BUY, SELL):
+            if (asset, side) in desired:
+                continue
+            orders = book.orders(asset, side)
+            (cancels if side in cancel_unlisted else kept).extend(orders)
+
+    for (asset, side), wanted in desired.items():
+        existing = book.orders(asset, side)
+        if wanted is None or not wanted[0]:
+            cancels.extend(existing)
+            continue
+
+        amount, limit = wanted
+        if len(existing) == 1 and same_order(existing[0], amount, limit):
+            kept.extend(existing)
+            continue
+        cancels.extend(existing)
+        creates.append((asset, amount, limit))
+    return cancels, creates, kept
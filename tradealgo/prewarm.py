@@ -0,0 +1,90 @@
+"""Startup helpers: warm up pipeline modules early and measure time to ready.
+
+The algos import their pipeline data sources lazily, in ``make_pipeline``.
+``Prewarm`` imports the ones they reference on a background thread and
+loads the symbol lists of their data sources, while the main thread is
+still logging in to the broker. When ``initialize`` builds the pipeline the
+modules are already loaded.
+"""
+import importlib
+import os
+import re
+import threading
+import time
+
+import logbook
+
+log = logbook.Logger("tradealgo")
+
+IMPORTED = time.time()
+PIPELINE_MODULE = re.compile(r"\b((?:zipline\.pipeline|pipeline_live\.data)(?:\.\w+)*)")
+
+
+def process_uptime():
+    """Seconds since this process started, or since this module was imported."""
+    try:
+        with open("/proc/self/stat") as f:
+            # The process name can contain spaces, the fields after it can't
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - started_ticks / float(os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return time.time() - IMPORTED
+
+
+def pipeline_modules(algofiles):
+    """The pipeline modules the algo files import, in order of appearance."""
+    modules = []
+    for algofile in algofiles:
+        with open(algofile) as f:
+            for name in PIPELINE_MODULE.findall(f.read()):
+                if name not in modules:
+                    modules.append(name)
+    return modules
+
+
+def symbol_sources(modules):
+    """``pipeline_live.data.<source>`` of each module mapped to its ``sources`` module."""
+    sources = []
+    for name in modules:
+        parts = name.split(".")
+        if parts[:2] == ["pipeline_live", "data"] and len(parts) > 2 and parts[2] != "sources":
+            source = "pipeline_live.data.sources." + parts[2]
+            if source not in sources:
+                sources.append(source)
+    return sources
+
+
+class Prewarm(object):
+    """Imports ``modules`` and loads the symbol lists of their sources on a thread."""
+
+    def __init__(self, modules):
+        self.modules = modules
+        self.seconds = None
+        self._thread = threading.Thread(target=self._run, name="prewarm")
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        started = time.perf_counter()
+        for name in self.modules:
+            self._warm(name, lambda module: None)
+        for name in symbol_sources(self.modules):
+            # Fills the data source's daily symbol cache the first pipeline run reads
+            self._warm(name, lambda module: getattr(module, "list_symbols", lambda: None)())
+        self.seconds = time.perf_counter() - started
+        log.info("prewarmed {} modules in {:.2f}s".format(len(self.modules), self.seconds))
+
+    def _warm(self, name, warm):
+        try:
+            warm(importlib.import_module(name))
+        except Exception as e:
+            # Only a head start, the algo will import it again and surface the error
+            log.info("could not prewarm {} ({})".format(name, e))
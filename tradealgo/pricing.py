@@ -0,0 +1,89 @@
+"""Daily pricing datasets that only fetch a fixed list of symbols.
+
+pipeline_live's ``USEquityPricing`` loads the IEX charts of every listed
+symbol, even when the pipeline screens down to a handful of them.
+``static_pricing(symbols)`` returns a dataset with the same columns whose
+loader fetches the charts of ``symbols`` only. Every other asset of the
+pipeline reads as missing (NaN), so factors over it only rank the symbols.
+"""
+import threading
+
+import logbook
+import numpy as np
+import pandas as pd
+from pipeline_live.data.iex.pricing_loader import _shift_dates
+from pipeline_live.data.sources import iex
+from zipline.lib.adjusted_array import AdjustedArray
+from zipline.pipeline.data.dataset import Column, DataSet
+from zipline.pipeline.loaders.base import PipelineLoader
+from zipline.utils.calendars import get_calendar
+from zipline.utils.numpy_utils import float64_dtype
+
+log = logbook.Logger("tradealgo")
+
+# Shortest IEX chart range reaching that many days back, as pipeline_live picks them
+CHART_DAYS = ((30, "1m"), (90, "3m"), (180, "6m"), (365, "1y"), (730, "2y"))
+
+_datasets = {}
+
+
+def chart_range(start_date):
+    days = pd.Timestamp.utcnow() - start_date
+    return next((name for most, name in CHART_DAYS if days <= pd.Timedelta(days=most)), "5y")
+
+
+class StaticPricingLoader(PipelineLoader):
+    """Loads the daily bars of ``symbols`` from IEX, once per day and chart range."""
+
+    def __init__(self, symbols):
+        self.symbols = tuple(sorted(set(symbols)))
+        self._all_sessions = get_calendar("NYSE").all_sessions
+        self._prices = {}
+        self._lock = threading.Lock()
+
+    def _charts(self, chart_range_):
+        key = (pd.Timestamp.utcnow().date(), chart_range_)
+        with self._lock:
+            if key not in self._prices:
+                log.info("loading {} charts of {} symbols".format(chart_range_, len(self.symbols)))
+                self._prices = {key: iex._get_stockprices(list(self.symbols), chart_range_)}
+            return self._prices[key]
+
+    def load_adjusted_array(self, columns, dates, symbols, mask):
+        # Day N shows the bar of day N - 1, like pipeline_live's loader
+        start_date, end_date = _shift_dates(self._all_sessions, dates[0], dates[-1], shift=1)
+        sessions = self._all_sessions
+        sessions = sessions[(sessions >= start_date) & (sessions <= end_date)]
+        prices = self._charts(chart_range(start_date))
+
+        raw = {c: np.full((len(sessions), len(symbols)), c.missing_value, dtype=c.dtype)
+               for c in columns}
+        for i, symbol in enumerate(symbols):
+            chart = prices.get(symbol)
+            if chart is None:
+                continue
+            chart = chart.reindex(sessions, method="ffill")
+            for c in columns:
+                raw[c][:, i] = chart[c.name].values
+
+        return {c: AdjustedArray(raw[c], {}, c.missing_value) for c in columns}
+
+
+def static_pricing(symbols):
+    """A ``USEquityPricing`` like dataset loading the charts of ``symbols`` only.
+
+    Datasets are cached by symbol list, zipline groups loads by loader.
+    """
+    symbols = tuple(sorted(set(symbols)))
+    dataset = _datasets.get(symbols)
+    if dataset is None:
+        loader = StaticPricingLoader(symbols)
+        dataset = _datasets[symbols] = type("StaticPricing", (DataSet,), {
+            "open": Column(float64_dtype),
+            "high": Column(float64_dtype),
+            "low": Column(float64_dtype),
+            "close": Column(float64_dtype),
+            "volume": Column(float64_dtype),
+            "get_loader": staticmethod(lambda: loader),
+        })
+    return dataset
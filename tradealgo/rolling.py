@@ -0,0 +1,216 @@
+"""Per-asset rolling windows of daily values that survive restarts.
+
+Pipelines recompute moving averages from scratch every morning, which means
+refetching the whole window for every asset. ``RollingWindows`` keeps the
+last ``capacity`` values of one series per symbol on disk, so each session
+only the newest bar has to be fetched and added.
+"""
+import os
+import threading
+
+import logbook
+import numpy as np
+import pandas as pd
+
+log = logbook.Logger("tradealgo")
+
+STATE_DIR = os.environ.get("STATE_DIR", os.path.join("tmp", "state"))
+DAY_NS = 24 * 60 * 60 * 10 ** 9
+
+
+def session_day(session):
+    """Days since the epoch of a date-like value, the unit sessions are stored in."""
+    return pd.Timestamp(session).value // DAY_NS
+
+
+class RollingWindows(object):
+    """The last ``capacity`` values of one daily series for each symbol.
+
+    ``values`` is a ``symbols x capacity`` matrix, oldest value first and NaN
+    padded. For every window length in ``windows`` the sum and the count of
+    the non-NaN values among the last ``window`` bars are kept up to date as
+    bars are added, so averages cost O(symbols) whatever the window length.
+
+    Each row remembers the session of its newest bar. A row that missed a
+    session (new to the universe, or the algo was down) is rebuilt from
+    ``history`` instead of being extended.
+    """
+
+    def __init__(self, name, capacity, windows, root=STATE_DIR):
+        self.name = name
+        self.capacity = capacity
+        self.windows = sorted(set(windows))
+        if self.windows[-1] > capacity:
+            raise ValueError("window {} is longer than capacity {}".format(
+                self.windows[-1], capacity))
+
+        self.path = os.path.join(root, "rolling", name + ".npz")
+        self._lock = threading.Lock()
+        self._reset()
+        self.load()
+
+    def _reset(self, symbols=(), values=None, sessions=None):
+        self.symbols = list(symbols)
+        self._rows = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.values = np.full((len(self.symbols), self.capacity), np.nan) \
+            if values is None else values
+        self.sessions = np.full(len(self.symbols), -1, dtype=np.int64) \
+            if sessions is None else sessions
+        self.appends = 0
+        self.sums = {}
+        self.counts = {}
+        for window in self.windows:
+            self.sums[window], self.counts[window] = self._window_sums(self.values, window)
+
+    def _window_sums(self, values, window):
+        # Exact sums from the stored values, the running sums drift by float rounding
+        recent = values[:, self.capacity - window:]
+        finite = np.isfinite(recent)
+        return np.where(finite, recent, 0.0).sum(axis=1), finite.sum(axis=1)
+
+    def _resync(self, rows=None):
+        rows = np.arange(len(self.symbols)) if rows is None else rows
+        for window in self.windows:
+            self.sums[window][rows], self.counts[window][rows] = \
+                self._window_sums(self.values[rows], window)
+
+    def load(self):
+        try:
+            with np.load(self.path) as f:
+                symbols = f["symbols"].tolist()
+                values = f["values"]
+                sessions = f["sessions"]
+        except (OSError, KeyError, ValueError):
+            return
+
+        if values.shape[1] != self.capacity:
+            log.info("{}: stored capacity {} != {}, rebuilding".format(
+                self.name, values.shape[1], self.capacity))
+            return
+        self._reset(symbols, values, sessions)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(self.path, threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            np.savez(f, symbols=np.array(self.symbols, dtype=str), values=self.values,
+                     sessions=self.sessions)
+        os.replace(tmp_path, self.path)
+
+    def rows(self, symbols):
+        return np.array([self._rows.get(symbol, -1) for symbol in symbols], dtype=np.int64)
+
+    def update(self, session, previous, symbols, latest, history):
+        """Adds ``latest`` (one value per symbol) as the bar of ``session``.
+
+        ``previous`` is the session before ``session``, rows whose newest bar
+        is from then are extended, rows already at ``session`` are left
+        alone and every other row is rebuilt from ``history(symbols, bars)``,
+        which returns a DataFrame of the last ``bars`` values indexed by
+        session with one column per symbol.
+        """
+        session, previous = session_day(session), session_day(previous)
+        symbols = list(symbols)
+        latest = np.asarray(latest, dtype=float)
+
+        with self._lock:
+            self._drop_stale(previous)
+            self._add_rows(symbols)
+            rows = self.rows(symbols)
+            row_sessions = self.sessions[rows]
+
+            extend = row_sessions == previous
+            if extend.any():
+                self._append(rows[extend], latest[extend])
+                self.sessions[rows[extend]] = session
+
+            rebuild = (row_sessions != previous) & (row_sessions != session)
+            if rebuild.any():
+                self._rebuild(session, rows[rebuild], latest[rebuild], history)
+
+            log.info("{}: extended {}, rebuilt {}, current {}".format(
+                self.name, int(extend.sum()), int(rebuild.sum()),
+                int((row_sessions == session).sum())))
+            self.save()
+
+    def _drop_stale(self, previous):
+        # Rows that missed the previous session need a rebuild anyway
+        keep = self.sessions >= previous
+        if keep.all():
+            return
+        self._reset(
+            [symbol for symbol, kept in zip(self.symbols, keep) if kept],
+            self.values[keep], self.sessions[keep],
+        )
+
+    def _add_rows(self, symbols):
+        new = [symbol for symbol in symbols if symbol not in self._rows]
+        if not new:
+            return
+
+        for symbol in new:
+            self._rows[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        self.values = np.vstack([self.values, np.full((len(new), self.capacity), np.nan)])
+        self.sessions = np.concatenate([self.sessions, np.full(len(new), -1, dtype=np.int64)])
+        for window in self.windows:
+            self.sums[window] = np.concatenate([self.sums[window], np.zeros(len(new))])
+            self.counts[window] = np.concatenate(
+                [self.counts[window], np.zeros(len(new), dtype=np.int64)])
+
+    def _append(self, rows, latest):
+        values = self.values[rows]
+        finite = np.isfinite(latest)
+        added = np.where(finite, latest, 0.0)
+        for window in self.windows:
+            leaving = values[:, self.capacity - window]
+            leaving_finite = np.isfinite(leaving)
+            self.sums[window][rows] += added - np.where(leaving_finite, leaving, 0.0)
+            self.counts[window][rows] += finite.astype(np.int64) - leaving_finite
+
+        values[:, :-1] = values[:, 1:]
+        values[:, -1] = latest
+        self.values[rows] = values
+
+        self.appends += 1
+        if self.appends % self.capacity == 0:
+            self._resync()
+
+    def _rebuild(self, session, rows, latest, history):
+        symbols = [self.symbols[row] for row in rows]
+        frame = history(symbols, self.capacity)
+        frame = frame.reindex(columns=symbols)
+        days = np.array([session_day(day) for day in frame.index], dtype=np.int64)
+        frame = frame[days <= session]
+
+        # The history source may not have the newest bar yet, take it from the pipeline
+        if not len(frame) or session_day(frame.index[-1]) < session:
+            bars = np.vstack([frame.values[-(self.capacity - 1):], latest[np.newaxis]]) \
+                if self.capacity > 1 else latest[np.newaxis]
+        else:
+            bars = frame.values[-self.capacity:]
+
+        values = np.full((len(rows), self.capacity), np.nan)
+        if len(bars):
+            values[:, self.capacity - len(bars):] = bars.T
+        self.values[rows] = values
+        self.sessions[rows] = session
+        self._resync(rows)
+
+    def sum(self, symbols, window):
+        """Sum of the non-NaN values among each symbol's last ``window`` bars."""
+        rows = self.rows(symbols)
+        sums = np.append(self.sums[window], np.nan)
+        return sums[rows]
+
+    def count(self, symbols, window):
+        """Number of non-NaN values among each symbol's last ``window`` bars."""
+        rows = self.rows(symbols)
+        counts = np.append(self.counts[window], 0)
+        return counts[rows]
+
+    def mean(self, symbols, window):
+        """NaN-ignoring mean of each symbol's last ``window`` bars, like ``np.nanmean``."""
+        counts = self.count(symbols, window)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, self.sum(symbols, window) / counts, np.nan)
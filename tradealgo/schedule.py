@@ -0,0 +1,93 @@
+"""Interval rules evaluated from ``handle_data`` instead of one registration per tick."""
+import threading
+
+import logbook
+import pandas as pd
+
+log = logbook.Logger("tradealgo")
+
+SESSION_MINUTES = 390
+MINUTE = pd.Timedelta(minutes=1)
+DAY = pd.Timedelta(days=1)
+
+
+def session_bounds(now):
+    """Open and close of the session ``now`` falls in, UTC.
+
+    The open is 9:30 New York time, the close comes from the NYSE calendar
+    so early closes are respected, regular hours are assumed without it.
+    """
+    local = pd.Timestamp(now).tz_convert("America/New_York")
+    market_open = local.normalize() + pd.Timedelta(hours=9, minutes=30)
+    market_close = market_open + SESSION_MINUTES * MINUTE
+    try:
+        from trading_calendars import get_calendar
+    except ImportError:
+        pass
+    else:
+        label = pd.Timestamp(local.date(), tz="UTC")
+        calendar = get_calendar("NYSE")
+        if calendar.is_session(label):
+            market_close = calendar.session_close(label)
+    return market_open.tz_convert("UTC"), market_close.tz_convert("UTC")
+
+
+class IntervalSchedule(object):
+    """Runs ``func(context, data)`` every ``minutes`` minutes of the session.
+
+    Ticks are at ``start``, ``start + minutes``, ... minutes after the open
+    (minute 1 is the first minute, like ``time_rules.market_open(minutes=1)``)
+    up to ``end`` minutes before the close. Call the schedule from
+    ``handle_data`` with the current time; deciding whether a tick is due
+    is a little arithmetic, whatever the number of ticks.
+
+    Ticks missed while the algo was busy or restarting are coalesced into
+    a single run, and a tick that comes while the previous run is still in
+    progress is skipped.
+    """
+
+    def __init__(self, func, minutes, start=1, end=0):
+        self.func = func
+        self.minutes = minutes
+        self.start = start
+        self.end = end
+        self.last_tick = None
+        self._running = threading.Lock()
+        self._session = None
+
+    def tick_minutes(self, session_minutes=SESSION_MINUTES):
+        return range(self.start, session_minutes - self.end + 1, self.minutes)
+
+    def _bounds(self, now):
+        # The calendar is only asked once per session
+        if self._session is None or not self._session[0] <= now < self._session[0] + DAY:
+            self._session = session_bounds(now)
+        return self._session
+
+    def __call__(self, context, data, now):
+        """Runs ``func`` if a tick is due at ``now``, returns whether it ran."""
+        now = pd.Timestamp(now)
+        market_open, market_close = self._bounds(now)
+        minute = int((now - market_open) // MINUTE)
+        last_minute = int((market_close - market_open) // MINUTE) - self.end
+        if minute < self.start or minute > last_minute:
+            return False
+
+        tick = (market_open.value, (minute - self.start) // self.minutes)
+        if self.last_tick is not None and tick <= self.last_tick:
+            return False
+
+        if not self._running.acquire(False):
+            log.info("skipping {} at {}, the previous run is still going".format(
+                self.func.__name__, now))
+            return False
+        try:
+            if self.last_tick is not None and self.last_tick[0] == tick[0] \
+                    and tick[1] - self.last_tick[1] > 1:
+                log.info("{} missed {} runs, running once".format(
+                    self.func.__name__, tick[1] - self.last_tick[1] - 1))
+            self.last_tick = tick
+            self.func(context, data)
+        finally:
+            self._running.release()
+        return True
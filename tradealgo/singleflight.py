@@ -0,0 +1,56 @@
+"""Coalesces identical lookups made during the same pipeline run."""
+import threading
+from concurrent.futures import Future
+
+
+class RequestCoalescer(object):
+    """Shares one in-flight fetch per symbol between every caller of a run.
+
+    The first caller asking for a symbol during ``run_key`` fetches it, later
+    (or concurrent) callers wait for and reuse that result. Results are kept
+    until a different ``run_key`` is seen, e.g. the next day's pipeline run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._run_key = None
+        self._futures = {}
+
+    def fetch(self, run_key, symbols, fetch_fn):
+        """Returns ``{symbol: value}``, calling ``fetch_fn`` for unseen symbols only.
+
+        ``fetch_fn`` receives a list of symbols and returns a ``{symbol: value}``
+        dict, symbols it leaves out resolve to ``None``.
+        """
+        owned = []
+        pending = {}
+        with self._lock:
+            if run_key != self._run_key:
+                self._run_key = run_key
+                self._futures = {}
+
+            futures = self._futures
+            for symbol in symbols:
+                future = futures.get(symbol)
+                if future is None:
+                    future = futures[symbol] = Future()
+                    owned.append(symbol)
+                pending[symbol] = future
+
+        if owned:
+            try:
+                fetched = fetch_fn(owned)
+            except Exception as e:
+                # Let the next caller retry instead of caching the failure for the run
+                with self._lock:
+                    for symbol in owned:
+                        if futures.get(symbol) is pending[symbol]:
+                            del futures[symbol]
+                for symbol in owned:
+                    pending[symbol].set_exception(e)
+                raise
+
+            for symbol in owned:
+                pending[symbol].set_result(fetched.get(symbol))
+
+        return {symbol: future.result() for symbol, future in pending.items()}
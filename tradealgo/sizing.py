@@ -0,0 +1,56 @@
+"""Vectorized order sizing for long_only's rebalance.
+
+The functions take one array entry per stock and do, in one pass, what
+long_only used to do a stock at a time with Python floats: limit prices
+rounded to the $0.05 grid, the buy discount, the fire sale and the
+exposure cap. The float operations are the same and in the same order, so
+the results match the scalar code exactly.
+"""
+import numpy as np
+
+
+def div_by_05(values, buy):
+    """Rounds down (buys) or up (sells) to a multiple of $0.05, like ``make_div_by_05``."""
+    scaled = np.asarray(values, dtype=float) * 20.00
+    return (np.floor(scaled) if buy else np.ceil(scaled)) / 20.00
+
+
+def plan_sells(prices, cost_basis, ages, fire_sale_age, fire_sale_price, sell_factor):
+    """Limit prices of the sells of positions, and which of them are fire sales.
+
+    A position old enough and trading under ``fire_sale_price`` or under its
+    cost is sold at 95% of the price, the others at ``sell_factor`` times
+    their cost.
+    """
+    prices = np.asarray(prices, dtype=float)
+    cost_basis = np.asarray(cost_basis, dtype=float)
+    fire_sale = (np.asarray(ages) >= fire_sale_age) & (
+        (prices < fire_sale_price) | (prices < cost_basis))
+    limits = np.where(fire_sale, div_by_05(.95 * prices, buy=False),
+                      div_by_05(cost_basis * sell_factor, buy=False))
+    return limits, fire_sale
+
+
+def plan_buys(prices, averages, held, amounts, weight, cash, portfolio_value, buy_factor):
+    """Which candidates to buy, at what limit and how many shares.
+
+    Candidates trading more than 25% above their ``averages`` are bought at
+    the price, the others at ``buy_factor`` times it. ``weight`` of
+    ``cash`` goes to each. Candidates without a price (or one rounding down
+    to $0), and ``held`` ones whose position ``amounts`` already reach
+    ``weight`` of the portfolio, are skipped. Returns ``(buy, limits, shares)``.
+    """
+    prices = np.asarray(prices, dtype=float)
+    averages = np.asarray(averages, dtype=float)
+    limits = np.where(prices > 1.25 * averages, prices, prices * buy_factor)
+    limits = div_by_05(limits, buy=True)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = weight * cash / limits
+        max_exposure = weight * portfolio_value / limits
+    priced = ~np.isnan(prices) & (limits > 0)
+    shares = np.where(priced, np.trunc(shares), 0).astype(np.int64)
+    max_exposure = np.where(priced, np.trunc(max_exposure), 0).astype(np.int64)
+
+    buy = priced & ~(np.asarray(held, dtype=bool) & (np.asarray(amounts) >= max_exposure))
+    return buy, limits, shares
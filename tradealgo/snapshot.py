@@ -0,0 +1,53 @@
+"""Batched price lookups shared by every decision made in one rebalance."""
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PriceSnapshot(object):
+    """Current prices and recent daily history for a set of assets.
+
+    Everything is fetched with one ``data.current`` and one ``data.history``
+    call when the snapshot is created, lookups afterwards are served from
+    NumPy arrays: ``prices`` (one per asset), ``history`` (bars x assets) and
+    ``averages`` (mean of each asset's history, ignoring NaNs like pandas).
+    """
+
+    def __init__(self, data, assets, history_bars=20):
+        self.assets = list(OrderedDict.fromkeys(assets))
+        self._index = {asset: i for i, asset in enumerate(self.assets)}
+
+        if not self.assets:
+            self.prices = np.empty(0)
+            self.history = np.empty((history_bars, 0))
+            self.averages = np.empty(0)
+            return
+
+        current = data.current(self.assets, "price")
+        history = data.history(self.assets, "price", history_bars, "1d")
+        # Reindexing an object index costs more than the lookups, skip it when already aligned
+        if list(current.index) != self.assets:
+            current = current.reindex(self.assets)
+        if list(history.columns) != self.assets:
+            history = history.reindex(columns=self.assets)
+
+        self.prices = np.asarray(current, dtype=float)
+        self.history = history.values.astype(float)
+        present = ~np.isnan(self.history)
+        counts = present.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.averages = np.where(
+                counts > 0, np.where(present, self.history, 0.0).sum(axis=0) / counts, np.nan
+            )
+
+    def __contains__(self, asset):
+        return asset in self._index
+
+    def index(self, asset):
+        return self._index[asset]
+
+    def price(self, asset):
+        return float(self.prices[self._index[asset]])
+
+    def average(self, asset):
+        return float(self.averages[self._index[asset]])
@@ -0,0 +1,458 @@
+"""Local stand-in for the Alpaca, Polygon and IEX HTTP APIs.
+
+    python -m tradealgo.standin [--port 8765] [--fixtures tmp/standin] [--faults FAULTS.json]
+        [--latency SECONDS] [--record]
+
+Serves recorded responses so the algos can be load tested offline. Each
+upstream API is served under its own path prefix (``/alpaca``, ``/paper``,
+``/data``, ``/polygon``, ``/iex``, ``/iex-sandbox``). A process started with
+``python -m tradealgo.host --standin http://127.0.0.1:8765`` (``STANDIN_URL``
+for ``./run``) sends its requests for those APIs here, whatever client
+library makes them, see ``redirect``.
+
+Responses are read from ``<fixtures>/<upstream>/<path>/<METHOD>.<query>.json``,
+where ``<query>`` is a hash of the query string without credentials, falling
+back to ``<METHOD>.json`` for any query. Requests without a fixture get a 404.
+With ``--record`` every request is passed on to the real API and its response
+saved as a fixture, record against the paper API since orders are sent too.
+Replaying, the Alpaca order endpoints are served by an in-memory order book:
+orders are accepted and stay open until canceled, they never fill.
+
+``--faults`` takes a JSON list of rules, e.g.::
+
+    [{"upstream": "alpaca", "rate": 200},
+     {"upstream": "polygon", "path": "/v2/reference/*", "latency": 0.2, "jitter": 0.3,
+      "error_rate": 0.02, "error_status": 502}]
+
+Every rule matching a request's ``upstream``, ``method`` and ``path`` (a glob,
+all of them by default) applies: the ``latency`` plus up to ``jitter``
+seconds are added, requests beyond ``rate`` per minute (bursts of ``burst``)
+get a 429 with ``Retry-After`` and ``error_rate`` of them fail with
+``error_status``. ``GET /_standin/stats`` returns the responses served per
+upstream, method and status.
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import logbook
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from tradealgo.fetch import TokenBucket
+
+log = logbook.Logger("tradealgo")
+
+STANDIN_DIR = os.path.join("tmp", "standin")
+PORT = 8765
+
+UPSTREAMS = OrderedDict([
+    ("alpaca", "https://api.alpaca.markets"),
+    ("paper", "https://paper-api.alpaca.markets"),
+    ("data", "https://data.alpaca.markets"),
+    ("polygon", "https://api.polygon.io"),
+    ("iex", "https://cloud.iexapis.com"),
+    ("iex-sandbox", "https://sandbox.iexapis.com"),
+])
+BROKERS = ("alpaca", "paper")
+
+# Query parameters holding API keys, left out of fixture names and files
+CREDENTIALS = frozenset(("apiKey", "token"))
+# Request headers passed on to the real API when recording
+FORWARDED_HEADERS = ("APCA-API-KEY-ID", "APCA-API-SECRET-KEY", "Authorization",
+                     "Content-Type")
+
+
+def query_key(query):
+    """Short hash of the ``[(name, value)]`` query without credentials, '' without one."""
+    query = sorted((name, value) for name, value in query if name not in CREDENTIALS)
+    if not query:
+        return ""
+    return hashlib.sha1(urlencode(query).encode()).hexdigest()[:12]
+
+
+def fixture_paths(root, upstream, method, path, query):
+    """The fixture files for a request, most specific first."""
+    segments = [segment for segment in path.split("/") if segment]
+    if any(segment in (".", "..") for segment in segments):
+        raise ValueError("invalid path {}".format(path))
+    directory = os.path.join(root, upstream, *segments)
+    key = query_key(query)
+    paths = [os.path.join(directory, "{}.json".format(method))]
+    if key:
+        paths.insert(0, os.path.join(directory, "{}.{}.json".format(method, key)))
+    return paths
+
+
+class Response(object):
+    def __init__(self, status, body=None, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+    @classmethod
+    def json(cls, status, value, headers=None):
+        headers = dict(headers or {})
+        headers["Content-Type"] = "application/json"
+        return cls(status, json.dumps(value).encode(), headers)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            fixture = json.load(f)
+        content_type = fixture.get("content_type", "application/json")
+        body = fixture.get("body")
+        if content_type.startswith("application/json"):
+            body = json.dumps(body)
+        return cls(fixture.get("status", 200), (body or "").encode(),
+                   {"Content-Type": content_type})
+
+    def save(self, path, query):
+        content_type = self.headers.get("Content-Type", "application/json")
+        body = self.body.decode("utf-8", "replace")
+        if content_type.startswith("application/json") and body:
+            body = json.loads(body)
+        fixture = OrderedDict([
+            ("status", self.status),
+            ("content_type", content_type),
+            ("query", [[name, value] for name, value in query if name not in CREDENTIALS]),
+            ("body", body),
+        ])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(tmp_path, "w") as f:
+            json.dump(fixture, f, indent=1)
+        os.replace(tmp_path, path)
+
+
+class Rule(object):
+    """Latency, throttling and errors injected into the requests a rule matches."""
+
+    def __init__(self, upstream=None, method=None, path="*", latency=0.0, jitter=0.0,
+                 rate=None, burst=None, error_rate=0.0, error_status=503):
+        self.upstream = upstream
+        self.method = method.upper() if method else None
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+        # Broker limits are per minute, so a minute's worth of requests may come at once
+        self.bucket = TokenBucket(rate / 60.0, burst or rate) if rate else None
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    def matches(self, upstream, method, path):
+        return ((self.upstream is None or self.upstream == upstream)
+                and (self.method is None or self.method == method)
+                and fnmatch.fnmatchcase(path, self.path))
+
+    def delay(self):
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def fails(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+def load_rules(path):
+    with open(path) as f:
+        return [Rule(**rule) for rule in json.load(f)]
+
+
+class OrderBook(object):
+    """Alpaca's ``/v2/orders`` endpoints over orders kept in memory."""
+
+    def __init__(self):
+        self._orders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def handle(self, method, path, query, body):
+        params = dict(query)
+        resource = path[len("/v2/"):]
+        with self._lock:
+            if resource == "orders":
+                if method == "POST":
+                    return self.submit(json.loads(body.decode() or "{}"))
+                if method == "GET":
+                    return Response.json(200, self.list(params))
+                if method == "DELETE":
+                    return Response.json(207, [
+                        {"id": order["id"], "status": 200, "body": self.cancel(order)}
+                        for order in list(self._orders.values()) if is_open(order)
+                    ])
+            elif resource == "orders:by_client_order_id" and method == "GET":
+                return self.found(self.by_client_order_id(params.get("client_order_id")))
+            elif resource.startswith("orders/"):
+                order = self._orders.get(resource[len("orders/"):])
+                if method == "GET":
+                    return self.found(order)
+                if method == "DELETE":
+                    if order is None:
+                        return self.found(None)
+                    if not is_open(order):
+                        return Response.json(422, {"message": "order is not cancelable"})
+                    self.cancel(order)
+                    return Response(204, b"")
+        return Response.json(405, {"message": "method not allowed"})
+
+    def found(self, order):
+        if order is None:
+            return Response.json(404, {"message": "order not found"})
+        return Response.json(200, order)
+
+    def submit(self, payload):
+        now = timestamp()
+        order = OrderedDict([
+            ("id", str(uuid.uuid4())),
+            ("client_order_id", payload.get("client_order_id") or uuid.uuid4().hex),
+            ("created_at", now),
+            ("updated_at", now),
+            ("submitted_at", now),
+            ("filled_at", None),
+            ("expired_at", None),
+            ("canceled_at", None),
+            ("failed_at", None),
+            ("asset_id", str(uuid.uuid5(uuid.NAMESPACE_URL, payload.get("symbol", "")))),
+            ("symbol", payload.get("symbol")),
+            ("asset_class", "us_equity"),
+            ("qty", str(payload.get("qty"))),
+            ("filled_qty", "0"),
+            ("filled_avg_price", None),
+            ("order_type", payload.get("type", "market")),
+            ("type", payload.get("type", "market")),
+            ("side", payload.get("side")),
+            ("time_in_force", payload.get("time_in_force", "day")),
+            ("limit_price", none_or_str(payload.get("limit_price"))),
+            ("stop_price", none_or_str(payload.get("stop_price"))),
+            ("status", "new"),
+            ("extended_hours", bool(payload.get("extended_hours", False))),
+        ])
+        self._orders[order["id"]] = order
+        return Response.json(200, order)
+
+    def cancel(self, order):
+        order["status"] = "canceled"
+        order["canceled_at"] = order["updated_at"] = timestamp()
+        return order
+
+    def by_client_order_id(self, client_order_id):
+        for order in self._orders.values():
+            if order["client_order_id"] == client_order_id:
+                return order
+        return None
+
+    def list(self, params):
+        status = params.get("status", "open")
+        orders = [order for order in self._orders.values()
+                  if status == "all" or (status == "open") == is_open(order)]
+        if params.get("after"):
+            after = utc(params["after"])
+            orders = [order for order in orders if utc(order["submitted_at"]) > after]
+        if params.get("until"):
+            until = utc(params["until"])
+            orders = [order for order in orders if utc(order["submitted_at"]) < until]
+        if params.get("direction", "desc") == "desc":
+            orders.reverse()
+        return orders[:min(500, int(params.get("limit", 50)))]
+
+
+def is_open(order):
+    return order["status"] == "new"
+
+
+def none_or_str(value):
+    return None if value is None else str(value)
+
+
+def timestamp():
+    return pd.Timestamp.now(tz="UTC").isoformat().replace("+00:00", "Z")
+
+
+def utc(value):
+    value = pd.Timestamp(value)
+    return value.tz_localize("UTC") if value.tz is None else value.tz_convert("UTC")
+
+
+class StandIn(object):
+    """Answers the requests for one of the ``UPSTREAMS``."""
+
+    def __init__(self, root=STANDIN_DIR, rules=(), record=False):
+        self.root = root
+        self.rules = list(rules)
+        self.record = record
+        self.orders = OrderBook()
+        self.session = requests.Session()
+        self.served = Counter()
+        self._missing = set()
+        self._lock = threading.Lock()
+
+    def handle(self, method, url, headers, body):
+        parts = urlsplit(url)
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        _, upstream, path = (parts.path.split("/", 2) + [""])[:3]
+        path = "/" + path
+
+        if upstream == "_standin" and path == "/stats":
+            return Response.json(200, [
+                {"upstream": u, "method": m, "status": s, "count": count}
+                for (u, m, s), count in sorted(self.served.items())
+            ])
+        if upstream not in UPSTREAMS:
+            return self.count(upstream, method, Response.json(
+                404, {"message": "unknown upstream {}".format(upstream)}))
+
+        rules = [rule for rule in self.rules if rule.matches(upstream, method, path)]
+        response = self.inject(rules)
+        delay = sum(rule.delay() for rule in rules)
+        if delay:
+            time.sleep(delay)
+        if response is None:
+            try:
+                response = self.respond(upstream, method, path, query, headers, body)
+            except ValueError as e:
+                response = Response.json(400, {"message": str(e)})
+        return self.count(upstream, method, response)
+
+    def inject(self, rules):
+        for rule in rules:
+            if rule.bucket is not None:
+                wait = rule.bucket.take()
+                if wait:
+                    return Response.json(429, {"message": "rate limit exceeded"},
+                                         {"Retry-After": str(int(math.ceil(wait)))})
+        for rule in rules:
+            if rule.fails():
+                return Response.json(rule.error_status, {"message": "injected error"})
+        return None
+
+    def respond(self, upstream, method, path, query, headers, body):
+        paths = fixture_paths(self.root, upstream, method, path, query)
+        if self.record:
+            return self.forward(upstream, method, path, query, headers, body, paths[0])
+        if upstream in BROKERS and path.startswith("/v2/orders"):
+            return self.orders.handle(method, path, query, body)
+
+        for fixture in paths:
+            if os.path.exists(fixture):
+                return Response.load(fixture)
+        if paths[0] not in self._missing:
+            self._missing.add(paths[0])
+            log.warning("no fixture for {} /{}{}, expected {}".format(
+                method, upstream, path, paths[0]))
+        return Response.json(404, {"message": "no fixture"})
+
+    def forward(self, upstream, method, path, query, headers, body, fixture):
+        forwarded = {name: headers[name] for name in FORWARDED_HEADERS if name in headers}
+        upstream_response = self.session.request(
+            method, UPSTREAMS[upstream] + path, params=query, data=body or None,
+            headers=forwarded, timeout=30)
+        content_type = upstream_response.headers.get("Content-Type", "application/json")
+        response = Response(upstream_response.status_code, upstream_response.content,
+                            {"Content-Type": content_type})
+        if upstream_response.status_code < 500 and upstream_response.status_code != 429:
+            response.save(fixture, query)
+        return response
+
+    def count(self, upstream, method, response):
+        with self._lock:
+            self.served[(upstream, method, response.status)] += 1
+        return response
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def handle_request(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        response = self.server.standin.handle(self.command, self.path, self.headers, body)
+
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, standin):
+        HTTPServer.__init__(self, address, Handler)
+        self.standin = standin
+
+
+def redirect(url):
+    """Sends this process's requests for the ``UPSTREAMS`` to the stand-in at ``url``.
+
+    Alpaca, Polygon, IEX and ``tradealgo.fetch`` clients all send through
+    ``requests``' ``HTTPAdapter``, some to fixed base URLs, so the rewrite
+    happens there.
+    """
+    hosts = {urlsplit(base).netloc: name for name, base in UPSTREAMS.items()}
+    target = urlsplit(url.rstrip("/"))
+    send = HTTPAdapter.send
+
+    def standin_send(self, request, *args, **kwargs):
+        parts = urlsplit(request.url)
+        upstream = hosts.get(parts.netloc)
+        if upstream is not None:
+            request.url = urlunsplit((target.scheme, target.netloc,
+                                      "{}/{}{}".format(target.path, upstream, parts.path),
+                                      parts.query, ""))
+        return send(self, request, *args, **kwargs)
+
+    HTTPAdapter.send = standin_send
+    log.info("sending Alpaca, Polygon and IEX requests to {}".format(url))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tradealgo.standin", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--fixtures", default=STANDIN_DIR)
+    parser.add_argument("--faults", help="JSON file with the latency and error rules")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every response")
+    parser.add_argument("--record", action="store_true",
+                        help="pass requests on to the real APIs and save the responses")
+    args = parser.parse_args(argv)
+
+    logbook.StreamHandler(sys.stdout, level=logbook.INFO).push_application()
+    rules = load_rules(args.faults) if args.faults else []
+    if args.latency:
+        rules.append(Rule(latency=args.latency))
+    standin = StandIn(args.fixtures, rules, record=args.record)
+    server = Server((args.host, args.port), standin)
+    log.info("{} {} on http://{}:{}".format(
+        "recording to" if args.record else "serving", args.fixtures, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for (upstream, method, status), count in sorted(standin.served.items()):
+            log.info("{} {} {}: {}".format(upstream, method, status, count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""Algo state stores that only write what changed, drop-ins for pylivetrader's.
+
+pylivetrader's stores pickle the whole context into one blob on every save.
+The stores here keep every context attribute separately and only write the
+attributes that changed since the last save:
+
+* ``JournalStore`` keeps a snapshot file plus an append-only journal of CRC
+  checked records. A torn write (crash, full disk) can only damage the
+  record at the end of the journal, which is dropped on load together with
+  anything after it.
+* ``RedisStateStore`` keeps one Redis key per attribute and writes the
+  changes of a save in one pipelined transaction.
+
+Series and DataFrames are compared with the last save by a digest of their
+values, everything else by its pickled form.
+"""
+import hashlib
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+import logbook
+import numpy as np
+import pandas as pd
+
+log = logbook.Logger("tradealgo")
+
+SCHEMA = 1
+HEADER = struct.Struct("<II")  # payload length, crc32 of the payload
+
+# Where pylivetrader's RedisStore keeps the pickled context, with the algo name as its checksum
+LEGACY_REDIS_KEY = "pylivetrader_redis_state"
+LEGACY_CHECKSUM_KEY = "__state_checksum"
+
+
+def dumps(value):
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def fingerprint(value):
+    """``(axes, digest)`` of a Series' or DataFrame's contents, None for other values.
+
+    pandas replaces an Index rather than changing it, so the axes are compared
+    by identity and only the values are hashed. Hashing a frame indexed by
+    assets is much cheaper than pickling it. Other values, numeric arrays
+    among them, are compared by their pickled form.
+    """
+    if isinstance(value, pd.DataFrame):
+        axes = (value.index, value.columns)
+        labels = (value.index.names, value.columns.names, value.dtypes.tolist())
+    elif isinstance(value, pd.Series):
+        axes = (value.index,)
+        labels = (value.index.names, value.name, value.dtype)
+    else:
+        return None
+
+    try:
+        rows = pd.util.hash_pandas_object(value, index=False).values
+    except Exception:
+        # Contents pandas can't hash, compared by their pickled form instead
+        return None
+    digest = hashlib.blake2b(repr(labels).encode(), digest_size=16)
+    digest.update(rows)
+    return axes, digest.digest()
+
+
+def same_fingerprint(a, b):
+    return (a is not None and b is not None and a[1] == b[1]
+            and all(x is y for x, y in zip(a[0], b[0])))
+
+
+class ContextDelta(object):
+    """Remembers the pickled form of each saved context attribute to find changes."""
+
+    def __init__(self, name):
+        self.name = name
+        self.blobs = {}
+        self._fingerprints = {}
+
+    def reset(self, state, blobs):
+        """Starts from what is stored: the loaded ``state`` and its pickled ``blobs``."""
+        self.blobs = blobs
+        self._fingerprints = {}
+        for key, value in state.items():
+            if blobs.get(key):
+                self._fingerprints[key] = fingerprint(value)
+
+    def changes(self, context, exclude_list):
+        """``({key: pickled value}, [deleted keys])`` since the last call."""
+        excluded = set(exclude_list)
+        changed = {}
+        current = set()
+        for key, value in list(vars(context).items()):
+            if key in excluded or key.startswith("_"):
+                continue
+            current.add(key)
+
+            digest = fingerprint(value)
+            if key in self.blobs and same_fingerprint(self._fingerprints.get(key), digest):
+                continue
+            try:
+                blob = dumps(value)
+            except Exception as e:
+                log.warning("{}: not saving {} ({})".format(self.name, key, e))
+                continue
+            self._fingerprints[key] = digest
+            if self.blobs.get(key) == blob:
+                continue
+            self.blobs[key] = changed[key] = blob
+
+        deleted = [key for key in self.blobs if key not in current]
+        for key in deleted:
+            del self.blobs[key]
+            self._fingerprints.pop(key, None)
+        return changed, deleted
+
+
+def write_record(f, record):
+    payload = dumps(record)
+    f.write(HEADER.pack(len(payload), zlib.crc32(payload)))
+    f.write(payload)
+    return HEADER.size + len(payload)
+
+
+def read_records(path):
+    """Yields the records of ``path`` up to the first torn or corrupt one."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+
+    with f:
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, crc = HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                log.warning("{}: dropping corrupt records at offset {}".format(
+                    path, f.tell() - len(payload) - HEADER.size))
+                return
+            yield pickle.loads(payload)
+
+
+class JournalStore(object):
+    """Keeps the context of one algo in ``<path>`` and ``<path>.journal``.
+
+    Records are ``("meta", {"schema": ..., "checksum": ...})``,
+    ``("set", key, pickled value)`` and ``("del", key)``. Values stay pickled
+    until the last record for their key is known, so replaying a long
+    journal only unpickles each key once. Once the journal outgrows
+    ``compact_ratio`` times the snapshot it is folded into a new snapshot.
+
+    ``migrations`` maps a schema version to a function upgrading a state dict
+    from that version to the next one. They run on load when the stored
+    schema is older than ``schema``.
+    """
+
+    def __init__(self, path, schema=SCHEMA, migrations=None, compact_ratio=4,
+                 min_compact_bytes=1 << 20):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.schema = schema
+        self.migrations = migrations or {}
+        self.compact_ratio = compact_ratio
+        self.min_compact_bytes = min_compact_bytes
+
+        self._lock = threading.Lock()
+        self._delta = ContextDelta(path)
+        self._checksum = None
+        self._journal = None
+        self._snapshot_bytes = 0
+        self._journal_bytes = 0
+
+    def _replay(self):
+        blobs = {}
+        meta = {"schema": self.schema, "checksum": None}
+        for name in (self.path, self.journal_path):
+            for record in read_records(name):
+                if record[0] == "meta":
+                    meta.update(record[1])
+                elif record[0] == "set":
+                    blobs[record[1]] = record[2]
+                elif record[0] == "del":
+                    blobs.pop(record[1], None)
+        return meta, blobs
+
+    def load(self, context, checksum):
+        with self._lock:
+            meta, blobs = self._replay()
+            state = {key: pickle.loads(blob) for key, blob in blobs.items()}
+            if meta["schema"] < self.schema:
+                state = migrate(state, meta["schema"], self.schema, self.migrations, self.path)
+                blobs = {key: dumps(value) for key, value in state.items()}
+
+            if meta["checksum"] not in (None, checksum):
+                log.info("{}: algo changed since the state was saved".format(self.path))
+
+            for key, value in state.items():
+                setattr(context, key, value)
+
+            self._delta.reset(state, blobs)
+            self._checksum = checksum
+            # Start from a fresh snapshot, which also drops a torn journal tail
+            self._compact()
+
+    def save(self, context, checksum, exclude_list):
+        with self._lock:
+            records = []
+            if checksum != self._checksum:
+                self._checksum = checksum
+                records.append(("meta", {"schema": self.schema, "checksum": checksum}))
+
+            changed, deleted = self._delta.changes(context, exclude_list)
+            records.extend(("set", key, blob) for key, blob in changed.items())
+            records.extend(("del", key) for key in deleted)
+            if not records:
+                return
+
+            journal = self._open_journal()
+            for record in records:
+                self._journal_bytes += write_record(journal, record)
+            journal.flush()
+
+            # The first save writes the snapshot, pylivetrader only loads state files that exist
+            if not self._snapshot_bytes or self._journal_bytes > max(
+                    self.min_compact_bytes, self.compact_ratio * self._snapshot_bytes):
+                self._compact()
+
+    def _open_journal(self):
+        if self._journal is None:
+            directory = os.path.dirname(self.journal_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._journal = open(self.journal_path, "ab")
+        return self._journal
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        """Writes every key to a new snapshot and empties the journal."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_path = "{}.{}.tmp".format(self.path, threading.get_ident())
+        size = 0
+        with open(tmp_path, "wb") as f:
+            size += write_record(f, ("meta", {"schema": self.schema, "checksum": self._checksum}))
+            for key, blob in self._delta.blobs.items():
+                size += write_record(f, ("set", key, blob))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        # Replaying the old journal over the new snapshot is harmless, so a crash
+        # before the truncate below loses nothing
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, "wb")
+        self._snapshot_bytes = size
+        self._journal_bytes = 0
+
+
+class RedisStateStore(object):
+    """Keeps the context of one algo as one Redis key per attribute.
+
+    ``tradealgo:state:<algo>:attr:<name>`` holds each pickled attribute, the
+    ``keys`` set lists them and ``meta`` holds the schema and checksum. A
+    save sends the changed and deleted attributes in one MULTI/EXEC
+    pipeline, so a checkpoint is applied entirely or not at all. Loading
+    reads the attribute list and the meta key in one round trip, then
+    every attribute with a single MGET. Without any attribute keys yet, the
+    state pylivetrader's ``RedisStore`` saved for the algo is loaded instead,
+    and the first save writes it as attributes.
+
+    ``last_checkpoint`` has the keys, bytes and round trip time of the
+    latest save that wrote anything.
+    """
+
+    def __init__(self, algoname, client=None, schema=SCHEMA, migrations=None):
+        if client is None:
+            import redis
+
+            client = redis.from_url(os.environ.get("REDIS_URL", "redis://localhost:6379"))
+
+        self.client = client
+        self.schema = schema
+        self.migrations = migrations or {}
+        self.prefix = "tradealgo:state:{}:".format(algoname)
+        self.index = self.prefix + "keys"
+        self.meta = self.prefix + "meta"
+
+        self._lock = threading.Lock()
+        self._delta = ContextDelta(self.prefix)
+        self._checksum = None
+        self.last_checkpoint = None
+
+    def _key(self, name):
+        return self.prefix + "attr:" + name
+
+    def load(self, context, checksum):
+        with self._lock:
+            pipe = self.client.pipeline(transaction=True)
+            pipe.smembers(self.index)
+            pipe.get(self.meta)
+            names, meta = pipe.execute()
+            meta = pickle.loads(meta) if meta else {"schema": self.schema, "checksum": None}
+
+            names = sorted(name.decode() if isinstance(name, bytes) else name for name in names)
+            values = self.client.mget([self._key(name) for name in names]) if names else []
+            blobs = {name: blob for name, blob in zip(names, values) if blob is not None}
+            state = {name: pickle.loads(blob) for name, blob in blobs.items()}
+
+            self._checksum = checksum
+            if not names and meta["checksum"] is None:
+                state = self._load_legacy(checksum)
+                if state:
+                    # Nothing is stored as attributes, the next save writes them all
+                    blobs = {}
+                    self._checksum = None
+            if meta["schema"] < self.schema:
+                state = migrate(state, meta["schema"], self.schema, self.migrations, self.prefix)
+                # Nothing matches what is stored, the next save rewrites every attribute,
+                # the meta key and deletes the attributes the migration dropped
+                blobs = {name: b"" for name in names}
+                self._checksum = None
+
+            if meta["checksum"] not in (None, checksum):
+                log.info("{}: algo changed since the state was saved".format(self.prefix))
+
+            for key, value in state.items():
+                setattr(context, key, value)
+            self._delta.reset(state, blobs)
+
+    def _load_legacy(self, checksum):
+        """The state pylivetrader's ``RedisStore`` saved for this algo, {} without one."""
+        blob = self.client.get(LEGACY_REDIS_KEY)
+        if not blob:
+            return {}
+        state = pickle.loads(blob)
+        # pylivetrader keeps a single blob, it may be another algo's
+        if state.pop(LEGACY_CHECKSUM_KEY, None) != checksum:
+            return {}
+        log.info("{}: importing {} attributes saved by pylivetrader".format(
+            self.prefix, len(state)))
+        return state
+
+    def save(self, context, checksum, exclude_list):
+        with self._lock:
+            changed, deleted = self._delta.changes(context, exclude_list)
+            if not changed and not deleted and checksum == self._checksum:
+                return
+
+            written = 0
+            pipe = self.client.pipeline(transaction=True)
+            if checksum != self._checksum:
+                meta = dumps({"schema": self.schema, "checksum": checksum})
+                pipe.set(self.meta, meta)
+                written += len(meta)
+            for name, blob in changed.items():
+                pipe.set(self._key(name), blob)
+                written += len(blob)
+            if changed:
+                pipe.sadd(self.index, *changed)
+            if deleted:
+                pipe.delete(*[self._key(name) for name in deleted])
+                pipe.srem(self.index, *deleted)
+
+            started = time.perf_counter()
+            pipe.execute()
+            elapsed = time.perf_counter() - started
+            self._checksum = checksum
+
+            keys = len(changed) + len(deleted)
+            self.last_checkpoint = {"keys": keys, "bytes": written, "seconds": elapsed}
+            log.info("{}: checkpoint wrote {} keys, {} bytes in {:.1f}ms".format(
+                self.prefix, keys, written, elapsed * 1000))
@@ -0,0 +1,43 @@
+"""Stop-loss checks over every position with one price lookup."""
+import numpy as np
+
+
+class StopLossMonitor(object):
+    """Finds the positions trading ``stop_loss`` (e.g. -0.05) or more below cost.
+
+    The trigger price of each position is computed when the positions change,
+    so a check is one batched ``data.current`` call and one vectorized
+    comparison, whatever the number of positions.
+    """
+
+    def __init__(self, stop_loss):
+        self.stop_loss = stop_loss
+        self.assets = []
+        self.cost_basis = np.empty(0)
+        self.triggers = np.empty(0)
+        self._signature = None
+
+    def update(self, positions):
+        """Recomputes the triggers if ``positions`` changed since the last call."""
+        signature = [(asset, p.amount, p.cost_basis) for asset, p in positions.items()]
+        if signature == self._signature:
+            return
+        self._signature = signature
+        self.assets = [asset for asset, _, _ in signature]
+        self.cost_basis = np.array([cost for _, _, cost in signature], dtype=float)
+        # Loss is (price - cost) / cost, below stop_loss means price below cost * (1 + stop_loss)
+        self.triggers = np.where(self.cost_basis > 0, self.cost_basis * (1 + self.stop_loss),
+                                 np.nan)
+
+    def crossed(self, positions, data):
+        """``[(asset, loss)]`` for the positions whose price is below their trigger."""
+        self.update(positions)
+        if not self.assets:
+            return []
+
+        prices = np.asarray(data.current(self.assets, "price").reindex(self.assets),
+                            dtype=float)
+        # NaN prices and triggers compare False, those positions are left alone
+        hits = np.flatnonzero(prices < self.triggers)
+        losses = (prices[hits] - self.cost_basis[hits]) / self.cost_basis[hits]
+        return [(self.assets[i], float(loss)) for i, loss in zip(hits, losses)]
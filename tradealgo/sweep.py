@@ -0,0 +1,290 @@
+"""Parameter sweeps of long_only_non_day_trade.py over recorded bars.
+
+    python -m tradealgo.sweep --bars tmp/bars --grid GRID.json [--pipelines tmp/pipelines]
+        [--start 2019-01-02] [--end 2019-12-31] [--workers N] [--rank-by sharpe]
+        [--output PATH]
+
+``GRID.json`` maps the context attributes ``initialize`` hard-codes to the
+values to try, e.g.::
+
+    {"buy_factor": [0.98, 0.99], "sell_factor": [1.01, 1.02, 1.03],
+     "MaxBuyOrdersAtOnce": [25, 50], "MyFireSaleAge": [4, 6, 8]}
+
+Every combination is backtested with ``tradealgo.backtest``, the values set
+on the context once ``initialize`` returned. ``MyFireSalePrice`` follows
+``MyLeastPrice`` unless the grid sets it too.
+
+Without ``--pipelines`` the algo's pipeline is computed from the bars (see
+``LongOnlyPipeline``), so the price band and ``MaxCandidates`` take effect
+as well. With recorded pipeline outputs they don't.
+
+The runs are spread over a process pool, one run per task. The bars and the
+pipeline factors are loaded once, before the workers are forked, so every
+worker reads the same memory. Where fork isn't available each worker loads
+its own copy. The results, ranked by ``--rank-by``, are written as CSV
+(``tmp/sweep/<time>.csv`` by default) and the best ones printed. Runs
+that filled no orders are flagged and ranked after the ones that did.
+
+The sweep is meant for minute bars. Without them limit orders fill by the
+backtest's daily rule, which can't tell whether the low came before or
+after the order was placed, and a warning is logged.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+
+import logbook
+import numpy as np
+import pandas as pd
+
+from tradealgo.backtest import BarStore, Engine, RecordedPipelines
+
+log = logbook.Logger("tradealgo")
+
+ALGO = os.path.join("algo", "long_only_non_day_trade.py")
+SWEEP_DIR = os.path.join("tmp", "sweep")
+RANK_BY = ("sharpe", "total_return", "end_value", "max_drawdown")
+
+# my_pipeline's windows and dollar volume percentiles
+SHORT_BARS = 3
+LONG_BARS = 45
+DOLLAR_VOLUME_BARS = 20
+LOW_VAR = 6
+HIGH_VAR = 40
+
+
+def trailing_sums(values, window):
+    """Sums and non-NaN counts of the ``window`` rows before each row.
+
+    Rows with fewer than ``window`` rows before them are NaN.
+    """
+    present = ~np.isnan(values)
+    cumulative = np.zeros((len(values) + 1,) + values.shape[1:])
+    np.cumsum(np.where(present, values, 0.0), axis=0, out=cumulative[1:])
+    counts = np.zeros_like(cumulative)
+    np.cumsum(present.astype(float), axis=0, out=counts[1:])
+
+    sums = np.full(values.shape, np.nan)
+    totals = np.full(values.shape, np.nan)
+    sums[window:] = cumulative[window:-1] - cumulative[:-window - 1]
+    totals[window:] = counts[window:-1] - counts[:-window - 1]
+    return sums, totals
+
+
+def trailing_mean(values, window):
+    """``SimpleMovingAverage`` of the ``window`` rows before each row, ignoring NaNs."""
+    sums, counts = trailing_sums(values, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+class LongOnlyPipeline(object):
+    """long_only's ``my_pipeline`` computed from the daily bars of a ``BarStore``.
+
+    Closes within the price band, average dollar volume between its 6th and
+    40th percentile among those, and the ``max_candidates`` of them furthest
+    below their 45 session average by their 3 session average. Every symbol
+    of the store counts as tradeable, the static filters of
+    ``TradeableUniverse`` aren't applied. Like the live pipeline, which runs
+    before the open, a session only sees the bars before it.
+    """
+
+    def __init__(self, bars):
+        count = len(bars.symbols)
+        close = bars.daily["close"][:, :count]
+        volume = bars.daily["volume"][:, :count]
+
+        self.sessions = bars.sessions
+        self.symbols = np.array(bars.symbols, dtype=object)
+        self.latest = np.vstack([np.full((1, count), np.nan), close[:-1]])
+        self.short_avg = trailing_mean(close, SHORT_BARS)
+        self.long_avg = trailing_mean(close, LONG_BARS)
+        # Like AverageDollarVolume, missing bars count as zero
+        self.dollar_volume = trailing_sums(close * volume, DOLLAR_VOLUME_BARS)[0] \
+            / DOLLAR_VOLUME_BARS
+
+    @property
+    def first_session(self):
+        """The first session with a full window for every factor."""
+        return self.sessions[min(LONG_BARS, len(self.sessions) - 1)]
+
+    def output(self, session, least_price, most_price, max_candidates):
+        i = self.sessions.get_loc(session)
+        latest = self.latest[i]
+        with np.errstate(invalid="ignore"):
+            tradeable = (latest >= least_price) & (latest <= most_price)
+
+        dollar_volume = self.dollar_volume[i]
+        in_band = dollar_volume[tradeable & ~np.isnan(dollar_volume)]
+        if not len(in_band):
+            return pd.DataFrame({"stocks_worst": []}, dtype=bool)
+        low, high = np.percentile(in_band, [LOW_VAR, HIGH_VAR])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            difference = (self.short_avg[i] - self.long_avg[i]) / self.long_avg[i]
+            base_universe = tradeable & (dollar_volume >= low) & (dollar_volume <= high)
+        columns = np.flatnonzero(base_universe & ~np.isnan(difference))
+        worst = columns[np.argsort(difference[columns], kind="mergesort")[:max_candidates]]
+        return pd.DataFrame({"stocks_worst": True}, index=self.symbols[np.sort(worst)])
+
+    def bind(self, context):
+        """A ``pipelines`` callable for an ``Engine`` reading the parameters from ``context``."""
+        def pipelines(name, session):
+            return self.output(session, context.MyLeastPrice, context.MyMostPrice,
+                               context.MaxCandidates)
+
+        return pipelines
+
+
+def grid_points(grid):
+    """Every combination of the ``{name: [values]}`` grid, in the grid's order."""
+    names = list(grid)
+    points = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = OrderedDict(zip(names, values))
+        if "MyLeastPrice" in params and "MyFireSalePrice" not in params:
+            params["MyFireSalePrice"] = params["MyLeastPrice"]
+        points.append(params)
+    return points
+
+
+# What the workers run against, set before they are forked
+_shared = {}
+
+
+def load_shared(algofile, bars_root, pipelines_root, start, end, capital):
+    bars = BarStore.load(bars_root)
+    pipeline = None if pipelines_root else LongOnlyPipeline(bars)
+    if start is None and pipeline is not None:
+        start = pipeline.first_session
+    _shared.update(
+        algofile=algofile,
+        bars=bars,
+        pipeline=pipeline,
+        recorded=RecordedPipelines(pipelines_root) if pipelines_root else None,
+        start=start,
+        end=end,
+        capital=capital,
+    )
+
+
+def run_point(task):
+    """Backtests one grid point, returns its parameters and stats."""
+    number, params = task
+    engine = Engine(_shared["algofile"], _shared["bars"], capital=_shared["capital"],
+                    pipelines=_shared["recorded"], start=_shared["start"], end=_shared["end"],
+                    params=params)
+    if _shared["pipeline"] is not None:
+        engine.pipelines = _shared["pipeline"].bind(engine.context)
+
+    row = OrderedDict([("point", number)])
+    row.update(params)
+    try:
+        # Only the algo's warnings, its info lines would interleave across workers
+        with logbook.NullHandler().applicationbound(), \
+                logbook.StderrHandler(level=logbook.WARNING).applicationbound():
+            row.update(engine.run().stats())
+        row["error"] = ""
+    except Exception as e:
+        row["error"] = "{}: {}".format(type(e).__name__, e)
+    return row
+
+
+def has_minute_bars(bars_root):
+    path = os.path.join(bars_root, "minute")
+    return os.path.isdir(path) and any(f.endswith((".csv", ".csv.gz")) for f in os.listdir(path))
+
+
+def rank(rows, rank_by):
+    """The results as a DataFrame, best ``rank_by`` first.
+
+    Runs without fills come after the ones with fills, failed runs last.
+    """
+    results = pd.DataFrame(rows)
+    for column in (rank_by, "fills"):
+        if column not in results:
+            results[column] = np.nan
+    results["traded"] = results["fills"] > 0
+    results = results.sort_values(["traded", rank_by, "point"], ascending=[False, False, True],
+                                  na_position="last", kind="mergesort")
+    results.insert(0, "rank", np.arange(1, len(results) + 1))
+    return results.set_index("rank")
+
+
+def sweep(grid, bars_root, algofile=ALGO, pipelines_root=None, start=None, end=None,
+          capital=100000, workers=None, rank_by="sharpe"):
+    """Backtests every point of ``grid`` over a process pool, returns the ranked results."""
+    tasks = list(enumerate(grid_points(grid), 1))
+    workers = min(workers or os.cpu_count() or 1, len(tasks)) or 1
+    shared = (algofile, bars_root, pipelines_root, start, end, capital)
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        load_shared(*shared)
+        context, initializer, initargs = multiprocessing.get_context("fork"), None, ()
+    else:
+        context, initializer, initargs = multiprocessing.get_context(), load_shared, shared
+
+    if not has_minute_bars(bars_root):
+        log.warning("{} has no minute bars, limit orders fill by the daily rule and the "
+                    "results are optimistic".format(bars_root))
+
+    log.info("{} runs on {} workers".format(len(tasks), workers))
+    started = time.time()
+    rows = []
+    with context.Pool(workers, initializer, initargs) as pool:
+        for row in pool.imap_unordered(run_point, tasks):
+            rows.append(row)
+            if row["error"]:
+                log.warning("run {} failed: {}".format(row["point"], row["error"]))
+            log.info("{}/{} runs done, {:.1f}s".format(len(rows), len(tasks),
+                                                        time.time() - started))
+
+    results = rank(rows, rank_by)
+    idle = int((~results["traded"]).sum())
+    if idle == len(results):
+        log.error("no run filled any order, the ranking is meaningless")
+    elif idle:
+        log.warning("{} of {} runs filled no orders, they are ranked last".format(
+            idle, len(results)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tradealgo.sweep", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grid", required=True, help="JSON file with the values to try")
+    parser.add_argument("--bars", required=True,
+                        help="directory with daily/<SYMBOL>.csv and minute/<SYMBOL>.csv bars")
+    parser.add_argument("--pipelines", help="directory with recorded pipeline outputs")
+    parser.add_argument("--algo", default=ALGO)
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--capital", type=float, default=100000)
+    parser.add_argument("--workers", type=int, help="processes, one per core by default")
+    parser.add_argument("--rank-by", choices=RANK_BY, default="sharpe")
+    parser.add_argument("--output", help="results CSV, tmp/sweep/<time>.csv by default")
+    parser.add_argument("--top", type=int, default=10, help="results to print")
+    args = parser.parse_args(argv)
+
+    with open(args.grid) as f:
+        grid = json.load(f, object_pairs_hook=OrderedDict)
+
+    with logbook.StderrHandler(level=logbook.INFO).applicationbound():
+        results = sweep(grid, args.bars, args.algo, args.pipelines, args.start, args.end,
+                        args.capital, args.workers, args.rank_by)
+
+    output = args.output or os.path.join(SWEEP_DIR, time.strftime("%Y%m%d-%H%M%S") + ".csv")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    results.to_csv(output)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(results.head(args.top).to_string())
+    print("results written to {}".format(output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Daily index of the symbols passing the static classification filters.
+
+The long_only pipeline keeps common stocks with fundamentals that are
+listed on an exchange, are not when-issued and are not partnerships. None
+of that changes during the day, yet as pipeline filters it loads the IEX
+company and key stats columns for every listed ticker each morning.
+``UniverseIndex`` evaluates those filters once per session and stores the
+result as a bitmap over the sorted symbol list in
+``tmp/state/universe/<YYYY-MM-DD>.npz``. The pipeline reads it back with
+``tradealgo.filters.TradeableUniverse``.
+
+The index can be built ahead of the open, e.g. from cron:
+
+    python -m tradealgo.universe [--date YYYY-MM-DD]
+
+otherwise the first pipeline run of the session builds it.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import logbook
+import numpy as np
+import pandas as pd
+
+from tradealgo.rolling import STATE_DIR
+
+log = logbook.Logger("tradealgo")
+
+UNIVERSE_DIR = os.path.join(STATE_DIR, "universe")
+KEEP_DAYS = 5
+
+# The same expression long_only used with ``companyName.matches``
+LP_NAME = re.compile(r".* L[. ]?P.?$")
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def classify(symbols, company, key_stats, polygon_company, polygon_financials):
+    """``{filter name: bool array}`` for ``symbols``, like the pipeline filters.
+
+    Missing IEX strings read as ``''`` and a missing market cap as NaN, as
+    pipeline_live's IEX loaders fill them.
+    """
+    def field(source, name, missing=""):
+        values = []
+        for symbol in symbols:
+            value = source.get(symbol, {}).get(name)
+            values.append(missing if value is None else value)
+        return values
+
+    issue_type = field(company, "issueType")
+    exchange = field(company, "exchange")
+    name = field(company, "companyName")
+    marketcap = np.array(field(key_stats, "marketcap", np.nan), dtype=float)
+
+    filters = OrderedDict()
+    # IsPrimaryShareEmulation: a Polygon company record with a country and revenue
+    filters["primary_share"] = np.array([
+        "country" in polygon_company.get(symbol, {})
+        and len(polygon_financials.get(symbol) or ()) > 0
+        and polygon_financials[symbol][0].get("totalRevenue") is not None
+        for symbol in symbols
+    ], dtype=bool)
+    filters["common_stock"] = np.array([value == "cs" for value in issue_type], dtype=bool)
+    filters["not_otc"] = ~np.array([value.startswith("OTC") for value in exchange], dtype=bool)
+    filters["not_wi"] = ~np.array([symbol.endswith(".WI") for symbol in symbols], dtype=bool)
+    filters["not_lp_name"] = ~np.array(
+        [LP_NAME.match(value) is not None for value in name], dtype=bool)
+    filters["have_market_cap"] = ~np.isnan(marketcap)
+    return filters
+
+
+class UniverseIndex(object):
+    """Which of a sorted list of symbols passed the classification filters."""
+
+    def __init__(self, symbols, mask, meta=None):
+        order = np.argsort(symbols, kind="mergesort")
+        self.symbols = np.asarray(symbols, dtype=str)[order]
+        self.mask = np.asarray(mask, dtype=bool)[order]
+        self.meta = meta or {}
+
+    @classmethod
+    def build(cls, session):
+        """Classifies every symbol the IEX and Polygon sources list for ``session``."""
+        from pipeline_live.data.sources import iex, polygon
+
+        started = time.time()
+        company = iex.company()
+        filters = classify(sorted(company), company, iex.key_stats(), polygon.company(),
+                           polygon.financials())
+        mask = np.logical_and.reduce(list(filters.values()))
+
+        meta = {
+            "session": str(session.date()),
+            "built_at": pd.Timestamp.utcnow().isoformat(),
+            "symbols": len(company),
+            "tradeable": int(mask.sum()),
+            "passed": {name: int(passed.sum()) for name, passed in filters.items()},
+        }
+        log.info("universe index for {}: {} of {} symbols tradeable in {:.1f}s".format(
+            meta["session"], meta["tradeable"], meta["symbols"], time.time() - started))
+        return cls(sorted(company), mask, meta)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            symbols = f["symbols"]
+            mask = np.unpackbits(f["bits"])[:len(symbols)].astype(bool)
+            meta = json.loads(str(f["meta"]))
+        return cls(symbols, mask, meta)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, symbols=self.symbols, bits=np.packbits(self.mask),
+                                meta=np.array(json.dumps(self.meta)))
+        os.replace(tmp_path, path)
+
+    def contains(self, symbols):
+        """Bool array, True for the ``symbols`` in the index that passed."""
+        symbols = np.asarray(symbols, dtype=str)
+        if not len(self.symbols):
+            return np.zeros(len(symbols), dtype=bool)
+        i = np.minimum(np.searchsorted(self.symbols, symbols), len(self.symbols) - 1)
+        return (self.symbols[i] == symbols) & self.mask[i]
+
+
+def index_path(session, root=UNIVERSE_DIR):
+    return os.path.join(root, "{}.npz".format(session.date()))
+
+
+def prune(root=UNIVERSE_DIR, keep=KEEP_DAYS):
+    for path in sorted(glob.glob(os.path.join(root, "*.npz")))[:-keep]:
+        os.remove(path)
+
+
+def universe_index(session, root=UNIVERSE_DIR):
+    """The index of ``session``, loaded from disk or built and saved on first use."""
+    session = pd.Timestamp(session).normalize()
+    path = index_path(session, root)
+    with _lock:
+        index = _indexes.get(path)
+        if index is None:
+            try:
+                index = UniverseIndex.load(path)
+            except FileNotFoundError:
+                index = UniverseIndex.build(session)
+                index.save(path)
+                prune(root)
+            _indexes.clear()
+            _indexes[path] = index
+        return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tradealgo.universe", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--date", help="session to build the index for, today by default")
+    parser.add_argument("--root", default=UNIVERSE_DIR)
+    args = parser.parse_args(argv)
+
+    session = pd.Timestamp(args.date or pd.Timestamp.now(tz="America/New_York").date())
+    index = UniverseIndex.build(session)
+    index.save(index_path(session, args.root))
+    prune(args.root)
+    print(json.dumps(index.meta, indent=2))
+
+
+if __name__ == "__main__":
+    main()